@@ -0,0 +1,363 @@
+"""
+api_client - This module is the API client module.
+This module is responsible for all HTTP requests made to the Coronavirus API and the News API.
+This includes...
+    - Sharing one pooled HTTP session, so that connections are kept alive between requests.
+    - Applying a timeout to every request, and retrying failed requests after a jittered, exponentially growing delay.
+    - Keeping a circuit breaker for each upstream API, so that an API which keeps failing is left alone for a while.
+    - Serving the last good response for a query while its API is failing.
+    - Optionally hedging slow requests, by sending a second copy once the first has taken too long.
+    - Fetching all the pages of a query from the Coronavirus API.
+    - Running several queries at the same time on a thread pool, so that they cost one round trip together.
+    - Caching responses in memory and on disk, and revalidating them with conditional requests once they expire.
+"""
+import os
+import json
+import time
+import random
+import logging
+import hashlib
+import threading
+import collections
+import concurrent.futures
+import urllib.parse
+import requests
+
+import metrics
+import settings
+
+
+config_data = settings.config_data
+
+COVID_API_URL = config_data.get("covid_api_url", "https://api.coronavirus.data.gov.uk/v1/data")
+NEWS_API_URL = config_data.get("news_api_url", "https://newsapi.org/v2/everything")
+REQUEST_TIMEOUT = (config_data.get("connect_timeout", 5), config_data.get("read_timeout", 30))  # (connect, read) in seconds
+
+session = requests.Session()
+_adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+session.mount("https://", _adapter)
+session.mount("http://", _adapter)
+fetch_pool = concurrent.futures.ThreadPoolExecutor(max_workers=8, thread_name_prefix="fetch")
+hedge_pool = concurrent.futures.ThreadPoolExecutor(max_workers=8, thread_name_prefix="hedge")
+
+RETRY_ATTEMPTS = config_data.get("retry_attempts", 3)  # How many times a request is sent before giving up
+RETRY_BASE_DELAY = config_data.get("retry_base_delay", 0.5)  # The delay (in seconds) before the first retry, doubling with each retry
+RETRY_MAX_DELAY = config_data.get("retry_max_delay", 8)
+RETRY_STATUSES = (429, 500, 502, 503, 504)  # Responses which mean the request may succeed if it is sent again
+BREAKER_THRESHOLD = config_data.get("breaker_threshold", 5)  # How many failures in a row open an upstream's circuit breaker
+BREAKER_COOLDOWN = config_data.get("breaker_cooldown", 60)  # How long (in seconds) an open breaker waits before letting a trial request through
+STALE_IF_ERROR = config_data.get("stale_if_error", 7 * 24 * 3600)  # How old (in seconds) a cached response can be and still be served while its API is failing
+HEDGE_AFTER = config_data.get("hedge_after")  # If set, a second copy of a request is sent once the first has taken this long (in seconds)
+breakers = {}  # Maps upstream (host) -> {"state", "failures", "opened_at"}
+breaker_lock = threading.Lock()
+
+metrics.describe("dashboard_api_cache_total", "counter", "Requests to the API client, by whether they were served from the cache (hit), revalidated (revalidated), fetched again (miss) or served stale while the API was failing (stale).")
+metrics.describe("dashboard_upstream_request_seconds", "histogram", "Time taken by each request sent to an API, including failed requests.")
+metrics.describe("dashboard_upstream_failures_total", "counter", "Requests to an API which failed, before any retry.")
+metrics.register_gauge("dashboard_circuit_breaker_open", "Whether the circuit breaker for an API is open (1) or half-open (0.5).",
+                       lambda: {(("upstream", upstream),): {"closed": 0, "half-open": 0.5, "open": 1}[breaker["state"]] for upstream, breaker in list(breakers.items())})
+
+CACHE_TTLS = {"covid": 3600, "news": 900}  # How long (in seconds) a response is served without asking the API again
+CACHE_TTLS.update(config_data.get("cache_ttl", {}))
+CACHE_MAX_ENTRIES = config_data.get("cache_max_entries", 64)
+CACHE_DIR = config_data.get("cache_dir", "api_cache")
+response_cache = collections.OrderedDict()  # Least recently used entries are at the front
+cache_lock = threading.Lock()
+
+
+def cache_key(url: str, params: dict) -> str:
+    """Returns the key under which the response for a request is cached."""
+    query = json.dumps(params, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1((url + "?" + query).encode()).hexdigest()
+
+
+def load_cache_entry(key: str) -> dict:
+    """Returns the cache entry for a key, from memory or else from disk, or None if there is no entry."""
+    with cache_lock:
+        if key in response_cache:
+            response_cache.move_to_end(key)
+            return response_cache[key]
+    try:
+        with open(os.path.join(CACHE_DIR, key + ".json")) as cache_file:
+            entry = json.load(cache_file)
+    except (OSError, ValueError):
+        return None
+    store_cache_entry(key, entry, write_to_disk = False)
+    return entry
+
+
+def store_cache_entry(key: str, entry: dict, write_to_disk: bool = True) -> None:
+    """Stores a cache entry, evicting the least recently used entries beyond 'CACHE_MAX_ENTRIES'.
+
+        Parameters:
+            key (str): The key of the entry, as given by 'cache_key'.
+            entry (dict): The entry, holding the response body and its validators.
+            write_to_disk (bool): Whether the entry should also be written to the on-disk cache.
+
+        Returns:
+            None
+    """
+    evicted = []
+    with cache_lock:
+        response_cache[key] = entry
+        response_cache.move_to_end(key)
+        while len(response_cache) > CACHE_MAX_ENTRIES:
+            evicted.append(response_cache.popitem(last=False)[0])
+    for old_key in evicted:
+        try:
+            os.remove(os.path.join(CACHE_DIR, old_key + ".json"))
+        except OSError:
+            pass
+    if write_to_disk:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        path = os.path.join(CACHE_DIR, key + ".json")
+        with open(path + ".tmp", "w") as cache_file:
+            json.dump(entry, cache_file, separators=(",", ":"))
+        os.replace(path + ".tmp", path)  # Replace in one step, so a crash never leaves a half-written entry
+
+
+class UpstreamUnavailable(requests.exceptions.RequestException):
+    """Raised instead of sending a request, when the circuit breaker for its API is open."""
+
+
+def upstream_name(url: str) -> str:
+    """Returns the name of the upstream API a URL belongs to, which is its host."""
+    return urllib.parse.urlsplit(url).netloc
+
+
+def get_breaker(upstream: str) -> dict:
+    """Returns the circuit breaker for an upstream API, creating a closed one if it has none."""
+    with breaker_lock:
+        if upstream not in breakers:
+            breakers[upstream] = {"state": "closed", "failures": 0, "opened_at": None}
+        return breakers[upstream]
+
+
+def breaker_allows(upstream: str) -> bool:
+    """Returns whether a request may be sent to an upstream API.
+    Once an open breaker has cooled down, exactly one trial request is let through ('half-open'); its result closes or reopens the breaker.
+    """
+    breaker = get_breaker(upstream)
+    with breaker_lock:
+        if breaker["state"] == "closed":
+            return True
+        if breaker["state"] == "open" and time.time() - breaker["opened_at"] >= BREAKER_COOLDOWN:
+            breaker["state"] = "half-open"
+            return True
+        return False
+
+
+def record_success(upstream: str) -> None:
+    """Closes the circuit breaker for an upstream API, after a request to it has succeeded."""
+    breaker = get_breaker(upstream)
+    with breaker_lock:
+        if breaker["state"] != "closed":
+            logging.info("The circuit breaker for %s has closed.", upstream)
+        breaker.update({"state": "closed", "failures": 0, "opened_at": None})
+
+
+def record_failure(upstream: str) -> None:
+    """Counts a failed request to an upstream API, opening its circuit breaker after 'BREAKER_THRESHOLD' failures in a row."""
+    breaker = get_breaker(upstream)
+    with breaker_lock:
+        breaker["failures"] += 1
+        if breaker["state"] == "half-open" or (breaker["state"] == "closed" and breaker["failures"] >= BREAKER_THRESHOLD):
+            breaker["state"] = "open"
+            breaker["opened_at"] = time.time()
+            logging.warning("The circuit breaker for %s has opened. No requests will be sent to it for %s seconds.", upstream, BREAKER_COOLDOWN)
+
+
+def retry_delay(attempt: int, response=None) -> float:
+    """Returns how long to wait before the given retry (counting from 0).
+    The delay is picked at random up to an exponentially growing cap ('full jitter'), so that retries from many clients do not arrive together.
+    A 'Retry-After' header sent by the API is honoured, up to 'RETRY_MAX_DELAY'.
+    """
+    if response is not None and response.headers.get("Retry-After", "").isdigit():
+        return min(float(response.headers["Retry-After"]), RETRY_MAX_DELAY)
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+
+def send_request(url: str, params: dict, headers: dict) -> requests.Response:
+    """Sends a GET request through the shared session.
+    If 'HEDGE_AFTER' is set and no response has arrived by then, a second copy is sent, and whichever succeeds first is used.
+    """
+    request_args = {"params": params, "headers": headers, "timeout": REQUEST_TIMEOUT}
+    if not HEDGE_AFTER:
+        return session.get(url, **request_args)
+    pending = [hedge_pool.submit(session.get, url, **request_args)]
+    done, not_done = concurrent.futures.wait(pending, timeout = HEDGE_AFTER)
+    if not done:
+        pending.append(hedge_pool.submit(session.get, url, **request_args))  # Only GET requests are hedged, so sending twice is safe
+    while True:
+        done, not_done = concurrent.futures.wait(pending, return_when = concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None or not not_done:
+                return future.result()  # The first success, or the last failure once both copies have failed
+        pending = list(not_done)
+
+
+def send_with_retries(url: str, params: dict, headers: dict) -> requests.Response:
+    """Sends a GET request, retrying it after connection errors, timeouts and responses in 'RETRY_STATUSES'.
+    Every failure, including those which are not retried, is counted by the circuit breaker of the API, and no request is sent while the breaker is open.
+
+        Parameters:
+            url (str): The URL to send the request to.
+            params (dict): The query string parameters for the request.
+            headers (dict): The headers for the request.
+
+        Returns:
+            response (requests.Response): The first successful response.
+    """
+    upstream = upstream_name(url)
+    for attempt in range(RETRY_ATTEMPTS):
+        if not breaker_allows(upstream):
+            raise UpstreamUnavailable("The circuit breaker for " + upstream + " is open.")
+        response = None
+        try:
+            with metrics.timer("dashboard_upstream_request_seconds", upstream = upstream):
+                response = send_request(url, params, headers)
+            if response.status_code in RETRY_STATUSES:
+                response.raise_for_status()
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.HTTPError) as error:
+            metrics.inc("dashboard_upstream_failures_total", upstream = upstream)
+            record_failure(upstream)
+            if attempt == RETRY_ATTEMPTS - 1:
+                raise
+            delay = retry_delay(attempt, response)
+            logging.warning("A request to %s has failed (%s). Retrying in %s seconds.", upstream, error, round(delay, 2))
+            time.sleep(delay)
+            continue
+        except Exception:
+            metrics.inc("dashboard_upstream_failures_total", upstream = upstream)
+            record_failure(upstream)  # Not worth retrying, such as a broken response body, but it must still settle a half-open breaker
+            raise
+        record_success(upstream)
+        return response
+
+
+def cached_get(url: str, params: dict, ttl: float) -> dict:
+    """Sends a GET request, unless a fresh enough response is already cached.
+    Once the cached response is older than 'ttl', it is revalidated with If-None-Match/If-Modified-Since,
+    so that the API can answer '304 Not Modified' instead of sending the whole body again.
+    If the API cannot be reached, a cached response up to 'STALE_IF_ERROR' seconds old is served in its place.
+
+        Parameters:
+            url (str): The URL to send the request to.
+            params (dict): The query string parameters for the request.
+            ttl (float): How long (in seconds) the cached response can be used without asking the API.
+
+        Returns:
+            entry (dict): The cache entry, holding the status code, the JSON body (or None) and the validators.
+    """
+    key = cache_key(url, params)
+    entry = load_cache_entry(key)
+    upstream = upstream_name(url)
+    if entry is not None and time.time() - entry["fetched_at"] < ttl:
+        metrics.inc("dashboard_api_cache_total", upstream = upstream, result = "hit")
+        return entry
+
+    headers = {}
+    if entry is not None:
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+    try:
+        response = send_with_retries(url, params, headers)
+    except requests.exceptions.RequestException:
+        if entry is not None and time.time() - entry["fetched_at"] < STALE_IF_ERROR:
+            logging.warning("Serving a cached response from %s, since it cannot be reached.", upstream)
+            metrics.inc("dashboard_api_cache_total", upstream = upstream, result = "stale")
+            return dict(entry, stale = True)
+        raise
+    response.raise_for_status()
+    if response.status_code == 304 and entry is not None:
+        metrics.inc("dashboard_api_cache_total", upstream = upstream, result = "revalidated")
+        entry = dict(entry, fetched_at = time.time())
+    else:
+        metrics.inc("dashboard_api_cache_total", upstream = upstream, result = "miss")
+        entry = {
+            "status": response.status_code,
+            "body": response.json() if response.status_code != 204 else None,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "fetched_at": time.time()
+            }
+    store_cache_entry(key, entry)
+    return entry
+
+
+def get_json(url: str, params: dict, ttl: float = 0) -> dict:
+    """Sends a GET request through the shared session and returns the decoded JSON body.
+
+        Parameters:
+            url (str): The URL to send the request to.
+            params (dict): The query string parameters for the request.
+            ttl (float): How long (in seconds) a cached response can be used without asking the API.
+
+        Returns:
+            data (dict): The JSON body of the response.
+    """
+    return cached_get(url, params, ttl)["body"]
+
+
+def get_covid_pages(filters: list, structure: dict, since: str = None, ttl: float = None) -> dict:
+    """Fetches every page of a query from the Coronavirus API, in the same format as 'Cov19API.get_json'.
+    The API returns the newest records first, so when 'since' is given, paging stops as soon as older records are reached.
+    The API can only filter dates by equality, so the first page is always downloaded in full and older records on it are dropped here;
+    what 'since' saves is every page after the one which reaches it.
+
+        Parameters:
+            filters (list): The filters for the query, such as "areaType=nation".
+            structure (dict): The fields to be returned for each record.
+            since (str): If given, only records on or after this date (yyyy-mm-dd) are kept, and no later pages are fetched once it is passed.
+            ttl (float): How long (in seconds) a cached page can be used without asking the API. Defaults to the TTL for the Coronavirus API.
+
+        Returns:
+            data (dict): A dictionary containing the records for the query, along with when they were last updated.
+    """
+    params = {
+        "filters": ";".join(filters),
+        "structure": json.dumps(structure, separators=(",", ":")),
+        "format": "json",
+        "page": 1
+        }
+    ttl = CACHE_TTLS["covid"] if ttl is None else ttl
+    data = {"data": [], "lastUpdate": None}
+    while True:
+        entry = cached_get(COVID_API_URL, params, ttl)
+        if entry["status"] == 204:  # The API answers 'No Content' once the last page has been passed
+            break
+        records = entry["body"]["data"]
+        data["lastUpdate"] = entry["last_modified"]
+        params["page"] += 1
+        if since is not None:
+            data["data"].extend(record for record in records if record["date"] >= since)
+            if not records or records[-1]["date"] < since:
+                break  # Every later page only holds older records
+        else:
+            data["data"].extend(records)
+    data["length"] = len(data["data"])
+    data["totalPages"] = params["page"] - 1
+    return data
+
+
+def fetch_all(jobs: list, return_exceptions: bool = False) -> list:
+    """Runs several fetches at the same time and waits for all of them to finish.
+
+        Parameters:
+            jobs (list): A list of (function, args) pairs, one for each fetch.
+            return_exceptions (bool): If True, a failed fetch gives its exception in place of a result, rather than raising it.
+
+        Returns:
+            results (list): The result of each fetch, in the same order as the jobs.
+    """
+    futures = [fetch_pool.submit(function, *args) for function, args in jobs]
+    concurrent.futures.wait(futures)
+    results = []
+    for future in futures:
+        if future.exception() is not None and return_exceptions:
+            results.append(future.exception())
+        else:
+            results.append(future.result())
+    return results
@@ -0,0 +1,11 @@
+"""
+benchmarks - This package is the benchmark and load-test suite for the dashboard.
+This package is responsible for measuring the performance of the dashboard without an internet connection.
+This includes...
+    - fake_upstreams: a local stand-in for the Coronavirus API and the News API, with configurable latency.
+    - bench_csv: microbenchmarks for parsing and processing CSV files with millions of rows.
+    - bench_load: throughput and latency of the dashboard's pages, with many scheduled updates.
+    - bench_memory: memory growth over many simulated days of repeating updates.
+    - run: runs every benchmark, and compares the results with the recorded baseline.
+Every benchmark must be run from the root of the repository, so that 'config.json' can be found.
+"""
@@ -0,0 +1,84 @@
+"""
+bench_csv - This module is the CSV microbenchmark.
+This module is responsible for timing the CSV functions of 'covid_data_handler.py' on synthetic files with millions of rows.
+This includes...
+    - Writing a synthetic CSV file in the 'nation_*.csv' format, with many areas and blank cells where the real files have them.
+    - Timing 'parse_csv_data', 'process_covid_csv_data', 'load_csv_columns' and 'stream_covid_csv_metrics' on it.
+"""
+import os
+import csv
+import gc
+import sys
+import json
+import time
+import datetime
+import tempfile
+
+import covid_data_handler
+
+
+DAYS_PER_AREA = 600
+
+
+def write_csv(path: str, rows: int) -> None:
+    """Writes a synthetic CSV file in the 'nation_*.csv' format, with rows for each area sorted from the newest date to the oldest."""
+    newest = datetime.date(2021, 10, 28).toordinal()
+    dates = [datetime.date.fromordinal(newest - offset).strftime("%d/%m/%Y") for offset in range(DAYS_PER_AREA)]
+    with open(path, "w", newline="") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(["areaCode", "areaName", "areaType", "date", "cumDailyNsoDeathsByDeathDate", "hospitalCases", "newCasesBySpecimenDate"])
+        for row_number in range(rows):
+            area, offset = divmod(row_number, DAYS_PER_AREA)
+            code = "E" + str(area).zfill(8)
+            writer.writerow([
+                code, "Area " + str(area), "ltla", dates[offset],
+                "" if offset < 14 else 100000 - offset,  # Deaths are blank for the most recent days
+                "" if offset == 0 else 5000 + (row_number * 7) % 3000,
+                "" if offset == 0 else 500 + (row_number * 31) % 1500
+                ])
+
+
+def best_time(function, *args, repeat: int = 3) -> float:
+    """Returns the fastest of several timings of a function call, in seconds."""
+    timings = []
+    for unused in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        function(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run(quick: bool = False, rows: int = None) -> dict:
+    """Runs the CSV microbenchmarks.
+
+        Parameters:
+            quick (bool): If True, a smaller file is used, and each function is only timed once.
+            rows (int): The number of rows in the synthetic file. Defaults to 2,000,000 (200,000 if 'quick').
+
+        Returns:
+            results (dict): The time taken by each function in seconds, and the rows processed per second.
+    """
+    rows = rows or (200000 if quick else 2000000)
+    repeat = 1 if quick else 3
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "synthetic.csv")
+        write_csv(path, rows)
+        parse_seconds = best_time(covid_data_handler.parse_csv_data, path, repeat=repeat)
+        parsed = covid_data_handler.parse_csv_data(path)
+        process_seconds = best_time(covid_data_handler.process_covid_csv_data, parsed, repeat=repeat)
+        del parsed
+        columns_seconds = best_time(covid_data_handler.load_csv_columns, path, repeat=repeat)
+        stream_seconds = best_time(covid_data_handler.stream_covid_csv_metrics, path, repeat=repeat)
+    return {
+        "csv_rows": rows,
+        "csv_parse_seconds": parse_seconds,
+        "csv_process_seconds": process_seconds,
+        "csv_load_columns_seconds": columns_seconds,
+        "csv_stream_seconds": stream_seconds,
+        "csv_stream_rows_per_second": rows / stream_seconds
+        }
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(quick="--quick" in sys.argv)))
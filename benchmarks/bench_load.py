@@ -0,0 +1,144 @@
+"""
+bench_load - This module is the load test for the dashboard.
+This module is responsible for measuring how many requests the dashboard can serve, and how quickly, with many scheduled updates.
+This includes...
+    - Starting the dashboard against the offline API stand-in, with its snapshot file and API cache in a temporary folder.
+    - Scheduling a number of updates, so that the page has as many update boxes as a heavy user would have.
+    - Sending requests to '/' and '/index' from several clients at once, and reporting the throughput and latency percentiles.
+"""
+import os
+import sys
+import json
+import time
+import datetime
+import tempfile
+import threading
+
+import requests
+from werkzeug.serving import make_server
+
+from benchmarks import fake_upstreams
+
+
+def percentile(values: list, fraction: float) -> float:
+    """Returns the given percentile (as a fraction) of a list of values."""
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def start_dashboard(folder: str, latency: float):
+    """Starts the dashboard on a free local port, against the API stand-in, and waits for its first refresh.
+
+        Parameters:
+            folder (str): A temporary folder for the snapshot file and the API cache.
+            latency (float): Seconds the stand-in adds to every API response.
+
+        Returns:
+            url (str): The URL the dashboard is being served on.
+    """
+    upstream = fake_upstreams.start(latency=latency)
+    fake_upstreams.point_clients_at(upstream)
+    import api_client
+    import snapshot_store
+    api_client.CACHE_DIR = os.path.join(folder, "api_cache")
+    snapshot_store.SNAPSHOT_FILE = os.path.join(folder, "snapshot.db")
+    import main
+    import refresh_engine
+    app = main.create_app()
+    deadline = time.time() + 60
+    while refresh_engine.get_snapshot()["local_covid_data"].get("local_7day_infections") is None:
+        if time.time() > deadline:
+            raise RuntimeError("The dashboard did not finish its first refresh against the API stand-in.")
+        time.sleep(0.05)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="dashboard", daemon=True).start()
+    return "http://127.0.0.1:" + str(server.server_port)
+
+
+def schedule_updates(count: int) -> None:
+    """Schedules the given number of updates for tomorrow, as the Flask app would."""
+    import refresh_engine
+    start = datetime.datetime.now().replace(second=0, microsecond=0) + datetime.timedelta(days=1)
+    for number in range(count):
+        refresh_engine.add_update({
+            "title": "Load test update " + str(number),
+            "content": "Next update is at " + str(number) + ". COVID data updates set. News updates set.",
+            "time": start + datetime.timedelta(minutes=number),
+            "covid-data": True,
+            "news": True,
+            "repeat": number % 2 == 0,
+            "complete": False,
+            "cancelled": False
+            })
+
+
+def load(url: str, clients: int, requests_per_client: int) -> dict:
+    """Sends requests to a URL from several clients at once.
+
+        Parameters:
+            url (str): The URL to request.
+            clients (int): The number of clients sending requests at the same time.
+            requests_per_client (int): The number of requests sent by each client, one after another.
+
+        Returns:
+            results (dict): The number of requests per second, and the 50th, 95th and 99th percentile latencies in seconds.
+    """
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def client():
+        session = requests.Session()
+        own = []
+        for unused in range(requests_per_client):
+            start = time.perf_counter()
+            response = session.get(url, headers={"Accept-Encoding": "gzip"})
+            own.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors.append(response.status_code)
+        with lock:
+            latencies.extend(own)
+
+    threads = [threading.Thread(target=client) for unused in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    if errors:
+        raise RuntimeError(str(len(errors)) + " requests to " + url + " failed, with status codes " + str(sorted(set(errors))) + ".")
+    return {
+        "requests_per_second": len(latencies) / elapsed,
+        "p50_seconds": percentile(latencies, 0.50),
+        "p95_seconds": percentile(latencies, 0.95),
+        "p99_seconds": percentile(latencies, 0.99)
+        }
+
+
+def run(quick: bool = False, updates: int = 100, clients: int = 8, latency: float = 0.05) -> dict:
+    """Runs the load test.
+
+        Parameters:
+            quick (bool): If True, fewer requests are sent.
+            updates (int): The number of updates to schedule before the test.
+            clients (int): The number of clients sending requests at the same time.
+            latency (float): Seconds the API stand-in adds to every response. The pages must not depend on it.
+
+        Returns:
+            results (dict): The throughput and latency percentiles for each page, named after the page.
+    """
+    requests_per_client = 50 if quick else 250
+    results = {"load_updates": updates, "load_clients": clients}
+    with tempfile.TemporaryDirectory() as folder:
+        url = start_dashboard(folder, latency)
+        schedule_updates(updates)
+        for name, path in (("index", "/"), ("index_form", "/index")):
+            load(url + path, clients, 5)  # Warms up the page cache and the connections
+            for key, value in load(url + path, clients, requests_per_client).items():
+                results["load_" + name + "_" + key] = value
+    return results
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(quick="--quick" in sys.argv)))
@@ -0,0 +1,81 @@
+"""
+bench_memory - This module is the memory-growth test.
+This module is responsible for checking that the memory used by the dashboard stays flat over many days of repeating updates.
+This includes...
+    - Simulating a number of days against the offline API stand-in, with new COVID data and new articles each day.
+    - Carrying out every repeating update once a day, as the refresh engine would, and publishing a new snapshot each time.
+    - Measuring the memory still held after each day, and working out how much it grows by each day.
+"""
+import gc
+import os
+import sys
+import json
+import datetime
+import tempfile
+import tracemalloc
+
+from benchmarks import fake_upstreams
+
+
+def growth_per_day(samples: list) -> float:
+    """Returns the slope of a least-squares line through daily memory samples, in bytes per day."""
+    count = len(samples)
+    mean_x = (count - 1) / 2
+    mean_y = sum(samples) / count
+    numerator = sum((x - mean_x) * (y - mean_y) for x, y in enumerate(samples))
+    denominator = sum((x - mean_x) ** 2 for x in range(count))
+    return numerator / denominator if denominator else 0.0
+
+
+def run(quick: bool = False, days: int = None, updates: int = 50) -> dict:
+    """Runs the memory-growth test.
+    The first days warm up the caches and stores, so the growth is only measured over the second half of the simulation.
+
+        Parameters:
+            quick (bool): If True, fewer days are simulated.
+            days (int): The number of days to simulate. Defaults to 365 (30 if 'quick').
+            updates (int): The number of repeating updates, all carried out once a day.
+
+        Returns:
+            results (dict): The memory held at the end in bytes, and its growth in bytes per day.
+    """
+    days = days or (30 if quick else 365)
+    with tempfile.TemporaryDirectory() as folder:
+        fake_upstreams.point_clients_at(fake_upstreams.start())
+        import api_client
+        api_client.CACHE_DIR = os.path.join(folder, "api_cache")
+        api_client.CACHE_TTLS.update({"covid": 0, "news": 0})  # Every simulated day fetches again
+        import covid_data_handler
+        import covid_news_handling
+        import update_registry
+        import refresh_engine
+
+        start = datetime.datetime(2021, 10, 29, 9, 0)
+        for number in range(updates):
+            update_registry.add_update({"title": "Daily update " + str(number), "content": "", "time": start,
+                                        "covid-data": True, "news": True, "repeat": True})
+        tracemalloc.start()
+        samples = []
+        for day in range(days):
+            fake_upstreams.advance_day()
+            now = start + datetime.timedelta(days=day)
+            due = update_registry.pop_due(now.timestamp())
+            if due:
+                covid_data_handler.update_covid_data()
+                covid_news_handling.news_API_request()
+            for item in due:
+                update_registry.reschedule_update(item["id"], item["time"] + datetime.timedelta(days=1))
+            refresh_engine.publish_snapshot()
+            gc.collect()
+            samples.append(tracemalloc.get_traced_memory()[0])
+        tracemalloc.stop()
+    measured = samples[days // 2:]
+    return {
+        "memory_days": days,
+        "memory_held_bytes": samples[-1],
+        "memory_growth_bytes_per_day": growth_per_day(measured)
+        }
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(quick="--quick" in sys.argv)))
@@ -0,0 +1,210 @@
+"""
+fake_upstreams - This module is the offline stand-in for the Coronavirus API and the News API.
+This module is responsible for answering the dashboard's API requests locally, so that benchmarks need no internet connection.
+This includes...
+    - Replaying responses recorded from the real APIs (in the 'recordings' folder), or generating responses in the same format.
+    - Delaying every response by a configurable latency, with optional random jitter.
+    - Moving the simulated date forward, so that each simulated day brings a new day of COVID data and new articles.
+    - Recording responses from the real APIs, so that they can be replayed later.
+"""
+import os
+import json
+import time
+import random
+import datetime
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+RECORDINGS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "recordings")
+PAGE_SIZE = 1000  # Records per page, as in the Coronavirus API
+state = {
+    "today": datetime.date(2021, 10, 28),  # The newest date in the generated COVID data
+    "history_days": 600,  # How many days of COVID data are generated for each area
+    "articles_per_day": 20,
+    "latency": 0.0,  # Seconds added to every response
+    "jitter": 0.0,  # Up to this many seconds are added at random on top of 'latency'
+    "requests": 0
+    }
+state_lock = threading.Lock()
+
+
+def load_recording(name: str):
+    """Returns a recorded response body from the 'recordings' folder, or None if it has not been recorded."""
+    try:
+        with open(os.path.join(RECORDINGS_DIR, name + ".json")) as recording:
+            return json.load(recording)
+    except OSError:
+        return None
+
+
+def recording_name(area_type: str, area_name: str) -> str:
+    """Returns the name under which the COVID data for an area is recorded."""
+    return "covid_" + area_type + "_" + area_name.replace(" ", "_")
+
+
+def generate_records(area_type: str, area_name: str) -> list:
+    """Generates COVID records for an area in the format of the Coronavirus API, newest first.
+    The figures only depend on the area and the date, so a day's figures are the same every time they are fetched.
+    """
+    seed = sum(map(ord, area_name))
+    today = state["today"].toordinal()
+    records = []
+    for offset in range(state["history_days"]):
+        day = today - offset
+        records.append({
+            "date": datetime.date.fromordinal(day).isoformat(),
+            "areaName": area_name,
+            "areaCode": "X" + str(seed).zfill(8),
+            "cumDailyNsoDeathsByDeathDate": None if offset < 14 or area_type != "nation" else 100000 + (day - 737000) * 40,
+            "hospitalCases": None if area_type != "nation" else 5000 + (day * 7 + seed) % 3000,
+            "newCasesBySpecimenDate": None if offset == 0 else 500 + (day * 31 + seed) % 1500
+            })
+    return records
+
+
+def covid_records(area_type: str, area_name: str) -> list:
+    """Returns the recorded COVID records for an area, or generated ones if none have been recorded."""
+    recording = load_recording(recording_name(area_type, area_name))
+    if recording is not None:
+        return recording["data"]
+    return generate_records(area_type, area_name)
+
+
+def news_body() -> dict:
+    """Returns the recorded News API response, or a generated one holding articles for the simulated date."""
+    recording = load_recording("news")
+    if recording is not None:
+        return recording
+    today = state["today"].isoformat()
+    articles = [{
+        "title": "Coronavirus update for " + today + " (" + str(number) + ")",
+        "description": "Generated article " + str(number) + " for " + today + ".",
+        "content": "Generated article " + str(number) + " for " + today + ".",
+        "url": "https://news.example.com/" + today + "/" + str(number),
+        "publishedAt": today + "T09:00:00Z"
+        } for number in range(state["articles_per_day"])]
+    return {"status": "ok", "totalResults": len(articles), "articles": articles}
+
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    """Answers requests for '/v1/data' like the Coronavirus API, and any other path like the News API."""
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        with state_lock:
+            state["requests"] += 1
+        delay = state["latency"] + random.uniform(0, state["jitter"])
+        if delay > 0:
+            time.sleep(delay)
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        etag = '"' + state["today"].isoformat() + "-" + url.query + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if url.path.endswith("/v1/data"):
+            filters = dict(item.split("=", 1) for item in query["filters"][0].split(";"))
+            page = int(query.get("page", ["1"])[0])
+            records = covid_records(filters.get("areaType", "nation"), filters.get("areaName", "England"))
+            chunk = records[(page - 1) * PAGE_SIZE:page * PAGE_SIZE]
+            if not chunk:
+                self.send_response(204)  # The Coronavirus API answers 'No Content' once the last page has been passed
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            body = {"length": len(chunk), "maxPageLimit": PAGE_SIZE, "totalRecords": len(records), "data": chunk}
+        else:
+            body = news_body()
+        payload = json.dumps(body, separators=(",", ":")).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime()))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def start(latency: float = 0.0, jitter: float = 0.0) -> ThreadingHTTPServer:
+    """Starts the stand-in on a free local port, in a background thread.
+
+        Parameters:
+            latency (float): Seconds added to every response.
+            jitter (float): Up to this many seconds are added at random on top of 'latency'.
+
+        Returns:
+            server (ThreadingHTTPServer): The running server. Its URL is given by 'base_url'.
+    """
+    state.update({"latency": latency, "jitter": jitter})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeUpstreamHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-upstreams", daemon=True).start()
+    return server
+
+
+def base_url(server: ThreadingHTTPServer) -> str:
+    """Returns the URL the stand-in is listening on."""
+    return "http://127.0.0.1:" + str(server.server_port)
+
+
+def point_clients_at(server: ThreadingHTTPServer) -> None:
+    """Points the dashboard's API client at the stand-in, in place of the real APIs."""
+    import api_client
+    api_client.COVID_API_URL = base_url(server) + "/v1/data"
+    api_client.NEWS_API_URL = base_url(server) + "/v2/everything"
+
+
+def advance_day(days: int = 1) -> None:
+    """Moves the simulated date forward, so that new COVID data and articles are served."""
+    state["today"] += datetime.timedelta(days=days)
+
+
+def record_responses(folder: str = RECORDINGS_DIR) -> list:
+    """Fetches the COVID data for every configured area and the latest news from the real APIs, and saves them for replaying.
+    This needs an internet connection and a News API key in 'config.json'.
+
+        Parameters:
+            folder (str): The folder the recordings are saved in.
+
+        Returns:
+            names (list): The names of the recordings which were saved.
+    """
+    import api_client
+    import covid_data_handler
+    import settings
+    os.makedirs(folder, exist_ok=True)
+    structure = {field: field for field in ("date", "areaName", "areaCode") + covid_data_handler.CSV_METRICS}
+    recordings = {}
+    for location, location_type in covid_data_handler.configured_areas():
+        recordings[recording_name(location_type, location)] = api_client.get_covid_pages(
+            ["areaType=" + location_type, "areaName=" + location], structure)
+    recordings["news"] = api_client.get_json(api_client.NEWS_API_URL, {
+        "q": "Covid COVID-19 coronavirus", "apiKey": settings.config_data["api_key"]})
+    for name, body in recordings.items():
+        with open(os.path.join(folder, name + ".json"), "w") as recording:
+            json.dump(body, recording)
+    return list(recordings)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Serves stand-ins for the Coronavirus API and the News API, or records the real APIs.")
+    parser.add_argument("--record", action="store_true", help="record responses from the real APIs into the 'recordings' folder, then exit")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many seconds added at random to every response")
+    arguments = parser.parse_args()
+    if arguments.record:
+        print("Recorded: " + ", ".join(record_responses()))
+    else:
+        state.update({"latency": arguments.latency, "jitter": arguments.jitter})
+        print("Serving the Coronavirus API at http://127.0.0.1:" + str(arguments.port) + "/v1/data and the News API at http://127.0.0.1:" + str(arguments.port) + "/v2/everything")
+        ThreadingHTTPServer(("127.0.0.1", arguments.port), FakeUpstreamHandler).serve_forever()
@@ -0,0 +1,98 @@
+"""
+run - This module is the benchmark runner.
+This module is responsible for running every benchmark, and catching performance regressions.
+This includes...
+    - Running each benchmark in its own process, so that they cannot affect each other's timings or memory.
+    - Comparing the results with the baseline recorded in 'baseline.json', and reporting any result which has got worse by more than the tolerance.
+    - Recording a new baseline, once a change in performance is expected.
+Usage, from the root of the repository:
+    python -m benchmarks.run [--quick] [--only csv,load,memory] [--tolerance 1.5] [--record]
+"""
+import os
+import sys
+import json
+import argparse
+import platform
+import subprocess
+
+
+BENCHMARKS = {"csv": "benchmarks.bench_csv", "load": "benchmarks.bench_load", "memory": "benchmarks.bench_memory"}
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+MEMORY_GROWTH_ALLOWANCE = 4096  # Bytes per day of growth always allowed, since a day of history is legitimately added to every area
+
+
+def run_benchmark(module: str, quick: bool) -> dict:
+    """Runs one benchmark in a new process, and returns its results."""
+    command = [sys.executable, "-m", module] + (["--quick"] if quick else [])
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def worse_by(name: str, value: float, baseline: float) -> float:
+    """Returns how many times worse a result is than its baseline (below 1 if it is better).
+    Results ending in '_per_second' are better when higher; every other result is better when lower.
+    """
+    if name.endswith("_per_second"):
+        return baseline / value if value else float("inf")
+    if name == "memory_growth_bytes_per_day":
+        return (max(value, 0) + MEMORY_GROWTH_ALLOWANCE) / (max(baseline, 0) + MEMORY_GROWTH_ALLOWANCE)
+    return value / baseline if baseline else 1.0
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Returns a description of every result which is worse than its baseline by more than the tolerance."""
+    regressions = []
+    for name, value in sorted(results.items()):
+        if name not in baseline or not (name.endswith("_seconds") or name.endswith("_per_second") or name.endswith("_per_day")):
+            continue
+        factor = worse_by(name, value, baseline[name])
+        if factor > tolerance:
+            regressions.append(name + ": " + format(value, ".6g") + " against a baseline of " + format(baseline[name], ".6g") + " (" + format(factor, ".2f") + "x worse)")
+    return regressions
+
+
+def main(arguments: list = None) -> int:
+    """Runs the benchmarks, and compares them with the baseline or records a new one.
+
+        Returns:
+            status (int): 0 if there were no regressions, or 1 if there were.
+    """
+    parser = argparse.ArgumentParser(description="Runs the dashboard's benchmarks and compares them with the recorded baseline.")
+    parser.add_argument("--quick", action="store_true", help="run smaller versions of the benchmarks")
+    parser.add_argument("--only", default=",".join(BENCHMARKS), help="a comma-separated list of benchmarks to run")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="how many times worse than the baseline a result may be")
+    parser.add_argument("--record", action="store_true", help="save the results as the new baseline")
+    arguments = parser.parse_args(arguments)
+
+    results = {}
+    for name in arguments.only.split(","):
+        print("Running the " + name + " benchmark...", flush=True)
+        results.update(run_benchmark(BENCHMARKS[name], arguments.quick))
+    for name, value in sorted(results.items()):
+        print("  " + name + ": " + format(value, ".6g"))
+
+    key = "quick" if arguments.quick else "full"
+    baselines = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE) as baseline_file:
+            baselines = json.load(baseline_file)
+    if arguments.record:
+        recorded = dict(baselines.get(key, {}), **results)
+        baselines[key] = dict(recorded, machine=platform.platform() + ", Python " + platform.python_version())
+        with open(BASELINE_FILE, "w") as baseline_file:
+            json.dump(baselines, baseline_file, indent=4, sort_keys=True)
+        print("The results have been recorded as the " + key + " baseline.")
+        return 0
+    if key not in baselines:
+        print("There is no " + key + " baseline to compare with. Record one with --record.")
+        return 0
+    regressions = compare(results, baselines[key], arguments.tolerance)
+    for regression in regressions:
+        print("REGRESSION " + regression)
+    if not regressions:
+        print("No results are more than " + str(arguments.tolerance) + "x worse than the " + key + " baseline (recorded on " + baselines[key]["machine"] + ").")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,20 @@
+import pytest
+
+import api_client
+from benchmarks import fake_upstreams
+
+
+@pytest.fixture
+def fake_apis(tmp_path, monkeypatch):
+    """Points the API client at a local stand-in for the Coronavirus API and the News API, so that tests never need the internet.
+    Each test gets an empty response cache and fresh circuit breakers, with the on-disk cache in a temporary directory."""
+    server = fake_upstreams.start()
+    monkeypatch.setattr(api_client, "COVID_API_URL", fake_upstreams.base_url(server) + "/v1/data")
+    monkeypatch.setattr(api_client, "NEWS_API_URL", fake_upstreams.base_url(server) + "/v2/everything")
+    monkeypatch.setattr(api_client, "CACHE_DIR", str(tmp_path))
+    api_client.response_cache.clear()
+    api_client.breakers.clear()
+    yield server
+    server.shutdown()
+    server.server_close()
+    api_client.response_cache.clear()
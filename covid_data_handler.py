@@ -2,22 +2,29 @@
 covid_data_handler - This module is the COVID data handler module.
 This module is responsible for handling all COVID-19 related data.
 This includes...
-    - Parsing data from a CSV file into a list of strings to allow processing.
-    - Processing a list (read from a CSV file) and returning the relevant interpreted data.
-    - Sending a request to Coronavirus API to fetch the relevant COVID-19 data.
-    - Parsing the API data into a usable format for the Flask app, via dictionaries.
+    - Parsing data from a CSV file into a list of strings, or into typed columns (converted a whole column at a time), to allow processing.
+    - Processing the data (read from a CSV file) and returning the relevant interpreted data.
+    - Streaming the metrics for every area out of very large CSV files, in bounded memory.
+    - Sending a request to Coronavirus API to fetch the relevant COVID-19 data, for all locations at the same time.
+    - Only fetching the pages, and merging the days, which are new (or may have been revised) since the last update of each location.
+    - Merging the API data into the time-series store, and parsing it into a usable format for the Flask app, via dictionaries.
+    - Serving any number of areas, as listed in the configuration file.
     - Enabling the user to schedule updates to the COVID-19 data at their chosen interval.
 """
 import csv
-import json
 import sched
 import time
 import datetime
-from uk_covid19 import Cov19API
+import itertools
+from array import array
 
+import api_client
+import covid_timeseries
+import metrics
+import settings
 
-config_file = open("config.json")
-config_data = json.load(config_file)
+
+config_data = settings.config_data
 covid_scheduler = sched.scheduler(time.time, time.sleep)
 
 local_covid_data = {
@@ -35,6 +42,9 @@ national_covid_data = {
     "last_update": None
     }
 
+CSV_METRICS = ("cumDailyNsoDeathsByDeathDate", "hospitalCases", "newCasesBySpecimenDate")
+REVISION_DAYS = config_data.get("revision_days", 21)  # Recent figures (especially deaths) are revised, so these days are always fetched again
+
 
 def parse_csv_data(csv_filename : str) -> list:
     """Returns a list of strings for all lines in a CSV file.
@@ -45,13 +55,151 @@ def parse_csv_data(csv_filename : str) -> list:
         Returns:
             data (list): A list of strings for all lines of the CSV file.
     """        
-    file_1 = open(csv_filename, "r")
-    csvreader = csv.reader(file_1) # Read csv to variable 'csvreader'
-    data = []
-    for row in csvreader:
-        data.append(row) # Append all data read from csv to list, row by row
+    with open(csv_filename, "r", newline="") as file_1:
+        return list(csv.reader(file_1))  # Read every row of the csv into a list
 
-    return data
+
+def parse_date(date: str) -> int:
+    """Converts a date in either the CSV format (dd/mm/yyyy) or the API format (yyyy-mm-dd) into a day number.
+
+        Parameters:
+            date (str): The date to be converted.
+
+        Returns:
+            day (int): The proleptic Gregorian ordinal of the date, as given by 'datetime.date.toordinal'.
+    """
+    if date[2] == "/":
+        return datetime.date(int(date[6:10]), int(date[3:5]), int(date[0:2])).toordinal()
+    return datetime.date(int(date[0:4]), int(date[5:7]), int(date[8:10])).toordinal()
+
+
+def columns_from_rows(rows) -> dict:
+    """Converts CSV rows (header first) into typed columns.
+    Each metric is held in an array of integers, alongside a mask which is 1 where a value is present and 0 where the cell is blank.
+
+        Parameters:
+            rows (iterable): The rows of a CSV file, such as those returned by 'parse_csv_data'.
+
+        Returns:
+            columns (dict): The area codes, names and types, an array of dates (as day numbers), and an array and mask for each metric.
+    """
+    rows = iter(rows)
+    header = next(rows)
+    area_index = header.index("areaCode")
+    name_index = header.index("areaName")
+    type_index = header.index("areaType") if "areaType" in header else None
+    date_index = header.index("date")
+    metric_indexes = [header.index(metric) for metric in CSV_METRICS]
+    columns = {
+        "area_codes": [],  # Each distinct area code, so that every row only needs to store a small index
+        "area_names": [],
+        "area_types": [],
+        "area": array("l"),
+        "date": array("l")
+        }
+    for metric in CSV_METRICS:
+        columns[metric] = array("q")
+        columns[metric + "_mask"] = bytearray()
+    areas = {}
+    dates = {}  # Every area repeats the same dates, so each date string is only parsed once
+    metric_columns = [(index, columns[metric], columns[metric + "_mask"]) for metric, index in zip(CSV_METRICS, metric_indexes)]
+    for row in rows:
+        if not row:
+            continue
+        code = row[area_index]
+        if code not in areas:
+            areas[code] = len(columns["area_codes"])
+            columns["area_codes"].append(code)
+            columns["area_names"].append(row[name_index])
+            columns["area_types"].append(row[type_index] if type_index is not None else "")
+        columns["area"].append(areas[code])
+        date = row[date_index]
+        if date not in dates:
+            dates[date] = parse_date(date)
+        columns["date"].append(dates[date])
+        for index, values, mask in metric_columns:
+            value = row[index]
+            values.append(int(value) if value else 0)
+            mask.append(1 if value else 0)
+    return columns
+
+
+def decode_cell(cell) -> str:
+    """Returns a CSV cell as a string, whether it was read as a string or as bytes."""
+    return cell.decode() if isinstance(cell, bytes) else cell
+
+
+def columns_from_cells(cells: dict) -> dict:
+    """Converts whole columns of CSV cells into typed columns, in the same form as 'columns_from_rows' returns.
+    Each column is converted as a whole by built-in functions, so there is no Python loop over the rows.
+
+        Parameters:
+            cells (dict): Maps each field name in the header -> a list of the cells in that column, as strings or as bytes.
+
+        Returns:
+            columns (dict): The typed columns, as returned by 'columns_from_rows'.
+    """
+    codes = cells["areaCode"]
+    areas = dict.fromkeys(codes)  # Each distinct area code, in the order the areas first appear
+    first_rows = dict(zip(reversed(codes), range(len(codes) - 1, -1, -1)))  # The first row of each area
+    area_indexes = dict(zip(areas, range(len(areas))))
+    dates = dict.fromkeys(cells["date"])  # Every area repeats the same dates, so each date string is only parsed once
+    for date in dates:
+        dates[date] = parse_date(decode_cell(date))
+    columns = {
+        "area_codes": [decode_cell(code) for code in areas],
+        "area_names": [decode_cell(cells["areaName"][first_rows[code]]) for code in areas],
+        "area_types": [decode_cell(cells["areaType"][first_rows[code]]) if "areaType" in cells else "" for code in areas],
+        "area": array("l", map(area_indexes.__getitem__, codes)),
+        "date": array("l", map(dates.__getitem__, cells["date"]))
+        }
+    for metric in CSV_METRICS:
+        values = cells[metric]
+        columns[metric] = array("q", map(int, [value or 0 for value in values]))  # int() accepts strings, bytes and the 0 put in for blank cells
+        columns[metric + "_mask"] = bytearray(map(bool, values))
+    return columns
+
+
+def load_csv_columns(csv_filename: str) -> dict:
+    """Parses a CSV file straight into typed columns, without holding every row as a list of strings.
+    A file without quoted cells or blank lines (such as the 'nation_*.csv' files) is split into cells in one go by 'bytes.split',
+    and each column is then sliced out and converted as a whole. Any other file is read by the csv module, one row at a time.
+
+        Parameters:
+            csv_filename (str): The name of some CSV file in the 'nation_*.csv' format.
+
+        Returns:
+            columns (dict): The typed columns of the file, as returned by 'columns_from_rows'.
+    """
+    with open(csv_filename, "rb") as csv_file:
+        data = csv_file.read()
+    header, unused, body = data.replace(b"\r\n", b"\n").rstrip(b"\n").partition(b"\n")
+    fields = header.decode("utf-8-sig").split(",")
+    row_count = body.count(b"\n") + 1 if body else 0
+    cells = body.replace(b"\n", b",").split(b",") if body else []
+    if b'"' in data or len(cells) != row_count * len(fields):  # Quoted cells may hold commas or line breaks, and blank lines hold no cells
+        with open(csv_filename, "r", newline="") as csv_file:
+            return columns_from_rows(csv.reader(csv_file))
+    return columns_from_cells({field: cells[index::len(fields)] for index, field in enumerate(fields)})
+
+
+def covid_csv_metrics(columns: dict) -> tuple:
+    """Works out the headline metrics from typed columns, for data sorted from the newest date to the oldest.
+    The most recent day of cases is skipped, since it is still incomplete.
+
+        Parameters:
+            columns (dict): The typed columns, as returned by 'columns_from_rows'.
+
+        Returns:
+            last7days_cases (int): The sum of the seven most recent complete days of cases.
+            current_hospital_cases (int): The latest non-blank number of hospital cases.
+            total_deaths (int): The latest non-blank cumulative number of deaths.
+    """
+    cases = itertools.compress(columns["newCasesBySpecimenDate"], columns["newCasesBySpecimenDate_mask"])
+    last7days_cases = sum(itertools.islice(cases, 1, 8))
+    current_hospital_cases = next(itertools.compress(columns["hospitalCases"], columns["hospitalCases_mask"]), 0)
+    total_deaths = next(itertools.compress(columns["cumDailyNsoDeathsByDeathDate"], columns["cumDailyNsoDeathsByDeathDate_mask"]), 0)
+    return last7days_cases, current_hospital_cases, total_deaths
 
 
 def process_covid_csv_data(covid_csv_data: list) -> int:
@@ -65,28 +213,77 @@ def process_covid_csv_data(covid_csv_data: list) -> int:
             current_hospital_cases (int): The current number of COVID-19-related hospital cases, as interpreted from the list.
             total_deaths (int): The total number of COVID-19-related deaths, as interpreted from the list.
     """    
-    days = []
-    last7days_cases = 0
-    current_hospital_cases = 0
-    total_deaths = 0
-    for i in range(3,10):
-        last7days_cases += int(covid_csv_data[i][-1])
-    current_hospital_cases = int(covid_csv_data[1][-2])
-    total_deaths = int(covid_csv_data[14][-3])
-    return last7days_cases, current_hospital_cases, total_deaths
+    rows = iter(covid_csv_data)
+    header = next(rows)
+    deaths_index, hospital_index, cases_index = [header.index(metric) for metric in CSV_METRICS]
+    cases = []  # The most recent days of cases, newest first; the first of them is still incomplete, so it is left out of the sum
+    current_hospital_cases = None
+    total_deaths = None
+    for row in rows:  # Only read until every value needed has been found, so the time taken does not grow with the length of the file
+        if not row:
+            continue
+        if row[cases_index] and len(cases) < 8:
+            cases.append(int(row[cases_index]))
+        if current_hospital_cases is None and row[hospital_index]:
+            current_hospital_cases = int(row[hospital_index])
+        if total_deaths is None and row[deaths_index]:
+            total_deaths = int(row[deaths_index])
+        if len(cases) == 8 and current_hospital_cases is not None and total_deaths is not None:
+            break
+    return sum(cases[1:]), current_hospital_cases or 0, total_deaths or 0
+
+
+def stream_covid_csv_metrics(csv_filename: str) -> dict:
+    """Works out the headline metrics for every area in a CSV file, reading it one row at a time.
+    Only a few numbers are kept for each area, so files with millions of rows are processed in bounded memory.
+    The rows for each area must be sorted from the newest date to the oldest, as in the 'nation_*.csv' files.
+
+        Parameters:
+            csv_filename (str): The name of some CSV file in the 'nation_*.csv' format.
+
+        Returns:
+            metrics (dict): Maps each area code to its (last7days_cases, current_hospital_cases, total_deaths).
+    """
+    state = {}  # Maps area code -> [cases seen, 7-day sum, hospital cases, deaths]
+    with open(csv_filename, "r", newline="") as csv_file:
+        csvreader = csv.reader(csv_file)
+        header = next(csvreader)
+        area_index = header.index("areaCode")
+        deaths_index, hospital_index, cases_index = [header.index(metric) for metric in CSV_METRICS]
+        for row in csvreader:
+            if not row:
+                continue
+            area = state.get(row[area_index])
+            if area is None:
+                area = state[row[area_index]] = [0, 0, None, None]
+            if row[cases_index] and area[0] < 8:
+                if area[0] > 0:  # The first day with cases is incomplete, so it is skipped
+                    area[1] += int(row[cases_index])
+                area[0] += 1
+            if area[2] is None and row[hospital_index]:
+                area[2] = int(row[hospital_index])
+            if area[3] is None and row[deaths_index]:
+                area[3] = int(row[deaths_index])
+    return {code: (area[1], area[2] or 0, area[3] or 0) for code, area in state.items()}
 
 
-def covid_API_request(location: str = "Exeter", location_type: str = "ltla") -> dict:
+def covid_API_request(location: str = "Exeter", location_type: str = "ltla", incremental: bool = True, revalidate: bool = False) -> dict:
     """Returns a JSON object containing data on the COVID-19 pandemic from Public Health England.
 
         Parameters:
             location (str): Specifies the location for which the data is to be fetched.
             location_type (str): Specifies the type of the location.
+            incremental (bool): If True and the location has been fetched before, only the most recent days are fetched.
+            revalidate (bool): If True, the API is always asked again, even if a cached response is still fresh.
 
         Returns:
             data (dict): A dictionary containing the COVID API data as fetched from Public Health England.
     """    
     last_update = datetime.datetime.now()
+    since = None
+    latest_date = covid_timeseries.latest_date(location_type, location)
+    if incremental and latest_date is not None:
+        since = (datetime.date.fromisoformat(latest_date) - datetime.timedelta(days=REVISION_DAYS)).isoformat()
     location_spec = ["areaType="+str(location_type), "areaName="+str(location)]
     data_spec = {
         "date": "date",
@@ -96,8 +293,7 @@ def covid_API_request(location: str = "Exeter", location_type: str = "ltla") ->
         "hospitalCases": "hospitalCases",
         "newCasesBySpecimenDate": "newCasesBySpecimenDate"
         }
-    api = Cov19API(filters = location_spec, structure = data_spec)
-    data = api.get_json()
+    data = api_client.get_covid_pages(location_spec, data_spec, since, 0 if revalidate else api_client.CACHE_TTLS["covid"])
     process_covid_API_data(data, location_type, location, last_update)
     return data
 
@@ -114,21 +310,42 @@ def process_covid_API_data(data: dict, location_type: str, location: str, last_u
         Returns:
             None
     """
-    _7day_infections = 0
-    for i in range(1,8):
-        _7day_infections += data["data"][i]["newCasesBySpecimenDate"]
-    if location_type == "nation":
-        national_covid_data.update({"nation_location": data["data"][1]["areaName"]})
-        national_covid_data.update({"national_7day_infections": _7day_infections})
-        national_covid_data.update({"hospital_cases": "Current hospital cases: " + str(data["data"][0]["hospitalCases"])})
-        national_covid_data.update({"deaths_total": "Deaths as of " +  str(data["data"][17]["date"]) + ": " + str(data["data"][17]["cumDailyNsoDeathsByDeathDate"])})
+    with metrics.timer("dashboard_processing_seconds", stage = "covid"):
+        stats = covid_timeseries.merge_records(location_type, location, data["data"])
+    if location_type == "nation" and location == config_data["national_location"]:
+        national_covid_data.update({"nation_location": stats["area_name"]})
+        national_covid_data.update({"national_7day_infections": stats["7day_infections"]})
+        national_covid_data.update({"hospital_cases": "Current hospital cases: " + str(stats["hospital_cases"])})
+        national_covid_data.update({"deaths_total": "Deaths as of " +  str(stats["deaths_date"]) + ": " + str(stats["deaths_total"])})
         national_covid_data.update({"last_update": last_update})
-    else:
-        local_covid_data.update({"location": data["data"][1]["areaName"]})
-        local_covid_data.update({"local_7day_infections": _7day_infections})
+    elif location == config_data["local_location"]:
+        local_covid_data.update({"location": stats["area_name"]})
+        local_covid_data.update({"local_7day_infections": stats["7day_infections"]})
         local_covid_data.update({"last_update": last_update})
 
 
+def extra_areas() -> list:
+    """Returns the (location, location type) of every area listed under "areas" in the configuration file."""
+    return [(area["location"], area["location_type"]) for area in config_data.get("areas", [])]
+
+
+def configured_areas() -> list:
+    """Returns the (location, location type) of every area the dashboard serves, starting with the local and national locations."""
+    return [(config_data["local_location"], config_data["local_type"]), (config_data["national_location"], "nation")] + extra_areas()
+
+
+def update_covid_data(update_name = covid_API_request) -> list:
+    """Fetches the COVID data for every configured location at the same time.
+
+        Parameters:
+            update_name (function): Specifies the function to be called for each location.
+
+        Returns:
+            data (list): The data returned for each location.
+    """
+    return api_client.fetch_all([(update_name, area) for area in configured_areas()])
+
+
 def schedule_covid_updates(update_interval: datetime.datetime, update_name: str) -> sched.Event:
     """Calls the given function at the given interval.
 
@@ -140,6 +357,5 @@ def schedule_covid_updates(update_interval: datetime.datetime, update_name: str)
             event_id (sched.Event): Specifies a unique ID for the event, which can be used to cancel the update.      
     """
     update_interval = update_interval.timestamp()  # Converts datetime object to UTC
-    local_event_id = covid_scheduler.enterabs(update_interval, 1, update_name,(config_data["local_location"], config_data["local_type"]))
-    national_event_id = covid_scheduler.enterabs(update_interval, 1, update_name, (config_data["national_location"], "nation"))
-    return local_event_id, national_event_id  # Returns two sched.Event objects, which can be used to cancel the update if need be
+    event_id = covid_scheduler.enterabs(update_interval, 1, update_covid_data, (update_name,))  # One event fetches every location concurrently
+    return event_id
@@ -3,44 +3,118 @@ covid_news_handling - This module is the COVID news handling module.
 This module is responsible for handling all news related data.
 This includes...
     - Sending a request to the News API to fetch the relevant news data.
-    - Updating a data structure to hold all of the news data.
+    - Updating a bounded, deduplicated store to hold the current news articles.
+    - Removing articles that the user has dismissed, and keeping them dismissed across updates.
     - Enabling the user to schedule updates to the news data at their chosen interval.
 """
-import json
 import sched
 import time
 import datetime
-import requests
-from newsapi import NewsApiClient
+import threading
+import collections
 
+import api_client
+import metrics
+import settings
 
-config_file = open("config.json")
-config_data = json.load(config_file)
+
+config_data = settings.config_data
 news_scheduler = sched.scheduler(time.time, time.sleep)
-news_data = []
-newsapi = NewsApiClient(api_key = config_data["api_key"])
+
+Article = collections.namedtuple("Article", ["title", "content", "url", "published_at"])  # A tuple, so each article is stored compactly
+MAX_ARTICLES = config_data.get("max_articles", 50)
+MAX_DISMISSED = 1000
+news_articles = collections.OrderedDict()  # Maps title -> Article, newest first
+article_urls = {}  # Maps url -> title, so that the same article under a new title is not added twice
+dismissed_titles = collections.OrderedDict()  # Maps title -> url of each dismissed article, oldest first, so that the oldest dismissals can be forgotten
+dismissed_urls = {}  # Maps url -> title, so that a dismissed article is not added back under a new title
+news_lock = threading.Lock()
+news_status = {
+    "last_update": None
+    }
 
 
-def news_API_request(covid_terms: str = "Covid COVID-19 coronavirus") -> dict:
-    """Fetches latest news articles on the COVID-19 pandemic from the News API and appends this data to a list.
+def news_API_request(covid_terms: str = "Covid COVID-19 coronavirus", revalidate: bool = False) -> dict:
+    """Fetches latest news articles on the COVID-19 pandemic from the News API and adds them to the news store.
 
         Parameters:
             covid_terms (str): Keywords which specify what terms the News API should search for.
+            revalidate (bool): If True, the API is always asked again, even if a cached response is still fresh.
 
         Returns:
             response (dict): A dictionary containing the News API data as fetched.
     """
-    url = ("https://newsapi.org/v2/everything?")
     parameters = {
         "q" : covid_terms,
         "apiKey" : config_data["api_key"]
         }
     
-    response = requests.get(url, params = parameters).json()
-    news_data.append(response)
+    response = api_client.get_json(api_client.NEWS_API_URL, parameters, 0 if revalidate else api_client.CACHE_TTLS["news"])
+    with metrics.timer("dashboard_processing_seconds", stage = "news"):
+        update_news_store(response["articles"])
+    news_status.update({"last_update": datetime.datetime.now()})
     return response
 
 
+def update_news_store(articles: list) -> None:
+    """Adds new articles to the front of the news store, skipping duplicates and dismissed articles.
+    The oldest articles are dropped once the store holds more than 'MAX_ARTICLES'.
+
+        Parameters:
+            articles (list): The articles as returned by the News API, newest first.
+
+        Returns:
+            None
+    """
+    with news_lock:
+        for article in reversed(articles[:MAX_ARTICLES]):  # Oldest first, so the newest article ends up at the front
+            title = article.get("title")
+            url = article.get("url")
+            if not title or title in dismissed_titles or title in news_articles or url in article_urls or url in dismissed_urls:
+                continue
+            news_articles[title] = Article(title, article.get("content") or article.get("description"), url, article.get("publishedAt"))
+            news_articles.move_to_end(title, last=False)
+            if url:
+                article_urls[url] = title
+        while len(news_articles) > MAX_ARTICLES:
+            title, old_article = news_articles.popitem()
+            article_urls.pop(old_article.url, None)
+
+
+def get_articles() -> list:
+    """Returns a list of the articles currently in the news store, newest first."""
+    with news_lock:
+        return list(news_articles.values())
+
+
+def remove_article(title: str, url: str = None) -> bool:
+    """Removes an article from the news store, and stops it from being added back by later updates,
+    under the same title or (if its url is known) under a new one.
+
+        Parameters:
+            title (str): The title of the article to be removed.
+            url (str): The url of the article. Defaults to the url of the article in the store, if there is one.
+
+        Returns:
+            found (bool): Whether an article with the given title was in the store.
+    """
+    with news_lock:
+        article = news_articles.pop(title, None)
+        if article is not None:
+            article_urls.pop(article.url, None)
+            url = url or article.url
+        url = url or dismissed_titles.get(title)
+        dismissed_titles[title] = url
+        dismissed_titles.move_to_end(title)
+        if url:
+            dismissed_urls[url] = title
+        while len(dismissed_titles) > MAX_DISMISSED:
+            old_title, old_url = dismissed_titles.popitem(last=False)
+            if dismissed_urls.get(old_url) == old_title:
+                del dismissed_urls[old_url]
+        return article is not None
+
+
 def update_news(update_interval: datetime.datetime, update_name: str) -> sched.Event:
     """Calls the given function at the given interval.
 
@@ -0,0 +1,304 @@
+"""
+covid_timeseries - This module is the COVID time-series store module.
+This module is responsible for holding the COVID-19 history of every area the dashboard serves.
+This includes...
+    - Keeping a date-indexed series of cases, hospital cases and deaths for each area, in compact arrays.
+    - Merging newly fetched records into an area's series, appending new days and correcting revised ones.
+    - Keeping a rolling 7-day sum of cases up to date, recomputing only the days affected by each merge.
+    - Keeping the derived statistics of each area (such as the 7-day sum) up to date, so they can be looked up in O(1).
+    - Keeping weekly buckets of each metric up to date, and building the 30, 90 and 365-day trends of each area from them as data is merged.
+"""
+import datetime
+import threading
+from array import array
+
+
+METRICS = {
+    "cases": "newCasesBySpecimenDate",
+    "hospital_cases": "hospitalCases",
+    "deaths": "cumDailyNsoDeathsByDeathDate"
+    }
+TREND_RANGES = {30: "day", 90: "week", 365: "week"}  # Maps the days covered by each trend -> the period of each of its points
+series_store = {}  # Maps (area type, area name) -> the series for that area
+store_lock = threading.Lock()
+
+
+def _mean(values: list) -> int:
+    """Returns the mean of some values, rounded to a whole number."""
+    return round(sum(values) / len(values))
+
+
+def _last(values: list) -> int:
+    """Returns the last of some values."""
+    return values[-1]
+
+
+WEEKLY_AGGREGATES = {
+    "cases": sum,  # New cases over the week
+    "hospital_cases": _mean,  # Average number of patients in hospital over the week
+    "deaths": _last  # Cumulative deaths at the end of the week
+    }
+
+
+def day_number(date: str) -> int:
+    """Converts a date in the API format (yyyy-mm-dd) into a day number."""
+    return datetime.date(int(date[0:4]), int(date[5:7]), int(date[8:10])).toordinal()
+
+
+def week_number(day: int) -> int:
+    """Converts a day number into a week number. Day 1 (1st January of year 1) was a Monday, so every week starts on a Monday."""
+    return (day - 1) // 7
+
+
+def new_series(area_type: str, area_name: str) -> dict:
+    """Returns an empty series for an area.
+    Index i of every array holds the value for day 'first_day + i'; the mask for a metric is 0 on days with no value.
+    Index i of every weekly array holds the aggregate for week 'first_week + i', as given by 'WEEKLY_AGGREGATES'.
+    """
+    series = {
+        "area_type": area_type,
+        "area_name": area_name,
+        "area_code": None,
+        "first_day": None,
+        "last_day": None,
+        "first_week": None,
+        "stats": None,
+        "trends": {},
+        "cases_7day": array("q")  # Index i holds the sum of cases over the seven days ending on day 'first_day + i'
+        }
+    for metric in METRICS:
+        series[metric] = array("q")
+        series[metric + "_mask"] = bytearray()
+        series[metric + "_weekly"] = array("q")
+        series[metric + "_weekly_mask"] = bytearray()
+    return series
+
+
+def _update_rolling(series: dict, from_index: int) -> None:
+    """Recomputes the rolling 7-day sum of cases from the given index to the end of the series.
+    Each sum is worked out from the one before it, so the cost is proportional to the number of days recomputed.
+    """
+    cases = series["cases"]
+    rolling = series["cases_7day"]
+    del rolling[from_index:]
+    total = rolling[-1] if rolling else 0
+    for index in range(from_index, len(cases)):
+        total += cases[index]
+        if index >= 7:
+            total -= cases[index - 7]
+        rolling.append(total)
+
+
+def _update_weekly(series: dict, from_index: int) -> None:
+    """Recomputes the weekly buckets from the week holding the given index to the end of the series.
+    Only the days in those weeks are looked at, so the cost is proportional to the number of days changed.
+    """
+    first_day = series["first_day"]
+    series["first_week"] = first_week = week_number(first_day)
+    last_week = week_number(series["last_day"]) - first_week
+    for metric, aggregate in WEEKLY_AGGREGATES.items():
+        values = series[metric]
+        mask = series[metric + "_mask"]
+        weekly = series[metric + "_weekly"]
+        weekly_mask = series[metric + "_weekly_mask"]
+        from_week = min(week_number(first_day + from_index) - first_week, len(weekly))
+        del weekly[from_week:]
+        del weekly_mask[from_week:]
+        for week in range(from_week, last_week + 1):
+            start = (first_week + week) * 7 + 1 - first_day  # The index of the Monday of the week
+            present = [values[index] for index in range(max(start, 0), min(start + 7, len(values))) if mask[index]]
+            weekly.append(aggregate(present) if present else 0)
+            weekly_mask.append(1 if present else 0)
+
+
+def _extend_to(series: dict, day: int) -> None:
+    """Grows the arrays of a series with blank days, so that they reach the given day."""
+    missing = day - series["last_day"]
+    for metric in METRICS:
+        series[metric].frombytes(bytes(series[metric].itemsize * missing))
+        series[metric + "_mask"].extend(bytes(missing))
+    series["last_day"] = day
+
+
+def _prepend_to(series: dict, day: int) -> None:
+    """Grows the arrays of a series with blank days at the front, so that they start from the given day."""
+    missing = series["first_day"] - day
+    for metric in METRICS:
+        series[metric] = array("q", [0]) * missing + series[metric]
+        series[metric + "_mask"] = bytearray(missing) + series[metric + "_mask"]
+    series["cases_7day"] = array("q")  # Every index has moved, so the rolling sum and the weekly buckets are rebuilt
+    for metric in METRICS:
+        series[metric + "_weekly"] = array("q")
+        series[metric + "_weekly_mask"] = bytearray()
+    series["first_day"] = day
+
+
+def merge_records(area_type: str, area_name: str, records: list) -> dict:
+    """Merges records from the Coronavirus API into the series for an area, creating the series if needed.
+    Records for new days are appended; records for days already in the series overwrite them, since recent figures are often revised.
+
+        Parameters:
+            area_type (str): The type of the area, such as "ltla" or "nation".
+            area_name (str): The name of the area.
+            records (list): Records in the format returned by the API, in any order.
+
+        Returns:
+            stats (dict): The derived statistics of the area, once the records have been merged.
+    """
+    key = (area_type, area_name)
+    with store_lock:
+        series = series_store.get(key)
+        if series is None:
+            series = series_store[key] = new_series(area_type, area_name)
+        changed_from = None  # The earliest index changed by this merge
+        for record in records:
+            day = day_number(record["date"])
+            if series["first_day"] is None:
+                series["first_day"] = series["last_day"] = day
+                for metric in METRICS:
+                    series[metric].append(0)
+                    series[metric + "_mask"].append(0)
+            elif day > series["last_day"]:
+                _extend_to(series, day)
+            elif day < series["first_day"]:
+                _prepend_to(series, day)
+            index = day - series["first_day"]
+            for metric, field in METRICS.items():
+                value = record.get(field)
+                series[metric][index] = value if value is not None else 0
+                series[metric + "_mask"][index] = 1 if value is not None else 0
+            if record.get("areaCode"):
+                series["area_code"] = record["areaCode"]
+            if record.get("areaName"):
+                series["area_name"] = record["areaName"]
+            if changed_from is None or index < changed_from:
+                changed_from = index
+        if changed_from is not None:
+            _update_rolling(series, min(changed_from, len(series["cases_7day"])))
+            _update_weekly(series, changed_from)
+        series["stats"] = compute_stats(series)
+        series["trends"] = compute_trends(series)
+        return series["stats"]
+
+
+def rebuild_aggregates(series: dict) -> None:
+    """Rebuilds the weekly buckets, statistics and trends of a series from its daily arrays, such as after it has been restored."""
+    if series["first_day"] is not None:
+        _update_weekly(series, 0)
+    series["stats"] = compute_stats(series)
+    series["trends"] = compute_trends(series)
+
+
+def latest_index(series: dict, metric: str) -> int:
+    """Returns the index of the latest day with a value for the given metric, or None if it has no values."""
+    index = series[metric + "_mask"].rfind(1)
+    return index if index >= 0 else None
+
+
+def compute_stats(series: dict) -> dict:
+    """Works out the derived statistics of a series.
+    The 7-day sum covers the seven days before the latest day with cases, since the latest day is still incomplete.
+    Only the most recent days and the rolling sum are looked at, so the cost does not grow with the length of the history.
+
+        Parameters:
+            series (dict): The series for an area.
+
+        Returns:
+            stats (dict): The derived statistics of the area.
+    """
+    stats = {
+        "area_type": series["area_type"],
+        "area_name": series["area_name"],
+        "area_code": series["area_code"],
+        "7day_infections": None,
+        "hospital_cases": None,
+        "deaths_total": None,
+        "deaths_date": None,
+        "latest_date": None
+        }
+    if series["first_day"] is None:
+        return stats
+    stats["latest_date"] = datetime.date.fromordinal(series["last_day"]).isoformat()
+    cases_index = latest_index(series, "cases")
+    if cases_index is not None:
+        stats["7day_infections"] = series["cases_7day"][cases_index - 1] if cases_index > 0 else 0
+    hospital_index = latest_index(series, "hospital_cases")
+    if hospital_index is not None:
+        stats["hospital_cases"] = series["hospital_cases"][hospital_index]
+    deaths_index = latest_index(series, "deaths")
+    if deaths_index is not None:
+        stats["deaths_total"] = series["deaths"][deaths_index]
+        stats["deaths_date"] = datetime.date.fromordinal(series["first_day"] + deaths_index).isoformat()
+    return stats
+
+
+def compute_trends(series: dict) -> dict:
+    """Builds the trend of each metric over every range in 'TREND_RANGES'.
+    Each trend is taken from the last few days or weekly buckets only, so the cost does not grow with the length of the history.
+    A weekly trend holds every week which any of its days fall in: 13 or 14 weeks for 90 days, depending on the day of the week
+    the last day falls on, and always 53 for 365 days, so no trend ever holds more than 53 points.
+
+        Parameters:
+            series (dict): The series for an area.
+
+        Returns:
+            trends (dict): Maps the days covered by each trend -> the trend, holding a label (a date) and a value (or None) for each point.
+    """
+    trends = {}
+    if series["first_day"] is None:
+        return trends
+    for days, period in TREND_RANGES.items():
+        trend = {"area_type": series["area_type"], "area_name": series["area_name"], "days": days, "period": period}
+        if period == "day":
+            start = max(len(series["cases"]) - days, 0)
+            indexes = range(start, len(series["cases"]))
+            trend["labels"] = [datetime.date.fromordinal(series["first_day"] + index).isoformat() for index in indexes]
+            suffix = ""
+        else:
+            start = max(week_number(series["last_day"] - days + 1) - series["first_week"], 0)
+            indexes = range(start, len(series["cases_weekly"]))
+            trend["labels"] = [datetime.date.fromordinal((series["first_week"] + index) * 7 + 1).isoformat() for index in indexes]  # Each week's Monday
+            suffix = "_weekly"
+        for metric in METRICS:
+            values = series[metric + suffix]
+            mask = series[metric + suffix + "_mask"]
+            trend[metric] = [values[index] if mask[index] else None for index in indexes]
+        trends[days] = trend
+    return trends
+
+
+def get_trends(area_type: str, area_name: str) -> dict:
+    """Returns the trends of an area, keyed by the days each covers, or an empty dictionary if the area has no series."""
+    series = series_store.get((area_type, area_name))
+    return series["trends"] if series is not None else {}
+
+
+def get_stats(area_type: str, area_name: str) -> dict:
+    """Returns the derived statistics of an area, or None if the area has no series."""
+    series = series_store.get((area_type, area_name))
+    return series["stats"] if series is not None else None
+
+
+def latest_date(area_type: str, area_name: str) -> str:
+    """Returns the latest date (yyyy-mm-dd) held for an area, or None if the area has no series."""
+    series = series_store.get((area_type, area_name))
+    if series is None or series["last_day"] is None:
+        return None
+    return datetime.date.fromordinal(series["last_day"]).isoformat()
+
+
+def get_value(area_type: str, area_name: str, metric: str, date: str) -> int:
+    """Returns the value of a metric for an area on a given date (yyyy-mm-dd), or None if there is no value."""
+    series = series_store.get((area_type, area_name))
+    if series is None or series["first_day"] is None:
+        return None
+    index = day_number(date) - series["first_day"]
+    if index < 0 or index >= len(series[metric]) or not series[metric + "_mask"][index]:
+        return None
+    return series[metric][index]
+
+
+def list_areas() -> list:
+    """Returns the (area type, area name) key of every area in the store."""
+    with store_lock:
+        return list(series_store)
@@ -0,0 +1,250 @@
+"""
+csv_archive - This module is the COVID CSV archive module.
+This module is responsible for back-loading daily CSV dumps of COVID-19 data into a compact columnar file, and answering queries from it.
+This includes...
+    - Parsing many CSV files (in the 'nation_*.csv' format) at the same time, each in its own process.
+    - Keeping one row for each area and date, taken from the newest dump which holds it, so that revised figures replace older ones.
+    - Writing the rows to a single file of fixed-width columns, sorted by area and from the newest date to the oldest.
+    - Memory-mapping that file, so that the same headline metrics as 'process_covid_csv_data' can be worked out without parsing any CSV.
+Usage, from the root of the repository:
+    python csv_archive.py ingest <CSV files or folders> [--workers 4]
+    python csv_archive.py metrics [<area code>]
+"""
+import os
+import re
+import sys
+import json
+import mmap
+import struct
+import logging
+import concurrent.futures
+from array import array
+
+import covid_data_handler
+import settings
+
+
+ARCHIVE_FILE = settings.config_data.get("archive_file", "covid_archive.col")
+MAGIC = b"COVIDCOL"
+COLUMN_FORMATS = {"area": "i", "date": "i", "dump": "i"}  # Day numbers and area indexes fit in 4 bytes; every metric takes 8, as in the time-series store
+DUMP_DATE = re.compile(r"(\d{4}-\d{2}-\d{2})")  # The date of a dump, as in 'nation_2021-10-28.csv'
+COLUMN_FORMATS.update((name, "B" if name.endswith("_mask") else "q") for metric in covid_data_handler.CSV_METRICS for name in (metric, metric + "_mask"))
+
+
+def find_csv_files(paths: list) -> list:
+    """Returns every CSV file among the given paths, looking inside any folders, sorted by file name (and so by the date of each dump)."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in os.listdir(path) if name.endswith(".csv"))
+        else:
+            files.append(path)
+    return sorted(files, key=os.path.basename)
+
+
+def dump_day(csv_filename: str, columns: dict) -> int:
+    """Returns the date of a CSV dump as a day number, taken from its file name, or else from the newest date it holds.
+
+        Parameters:
+            csv_filename (str): The name of the CSV file, such as 'nation_2021-10-28.csv'.
+            columns (dict): The typed columns of the file, as returned by 'covid_data_handler.load_csv_columns'.
+
+        Returns:
+            day (int): The day number of the dump, as given by 'covid_data_handler.parse_date'.
+    """
+    match = DUMP_DATE.search(os.path.basename(csv_filename))
+    if match:
+        return covid_data_handler.parse_date(match.group(1))
+    return max(columns["date"], default=0)
+
+
+def merge_columns(rows: dict, areas: dict, columns: dict) -> None:
+    """Adds the rows held in typed columns to the merged rows, replacing any row already held for the same area and date from the same or an older dump.
+    Rows from an older dump than the one already held are dropped, so the newest dump's figures are kept whatever order the columns are added in.
+
+        Parameters:
+            rows (dict): Maps (area index, -day) -> the row's dump date, metric values and masks. Negative days sort the newest date first.
+            areas (dict): Maps each area code -> [area index, area name, area type].
+            columns (dict): Typed columns, as returned by 'open_archive', or by 'covid_data_handler.columns_from_rows' with a "dump" column added.
+
+        Returns:
+            None
+    """
+    indexes = []
+    for code, name, area_type in zip(columns["area_codes"], columns["area_names"], columns["area_types"]):
+        if code not in areas:
+            areas[code] = [len(areas), name, area_type]
+        indexes.append(areas[code][0])
+    keys = zip(map(indexes.__getitem__, columns["area"]), map(int.__neg__, columns["date"]))
+    values = zip(*[columns[name] for name in COLUMN_FORMATS if name not in ("area", "date")])
+    added = dict(zip(keys, values))  # Later rows in the same columns replace earlier ones with the same key, without a Python loop over the rows
+    for key in added.keys() & rows.keys():  # Only the rows already held are compared
+        if rows[key][0] > added[key][0]:
+            added[key] = rows[key]
+    rows.update(added)
+
+
+def write_archive(rows: dict, areas: dict, filename: str = ARCHIVE_FILE) -> int:
+    """Writes merged rows to an archive file, replacing it as a whole so that readers never see a half-written file.
+    The file is a short JSON header, followed by each column as a packed array aligned to 8 bytes.
+
+        Parameters:
+            rows (dict): The merged rows, as built by 'merge_columns'.
+            areas (dict): The areas of the rows, as built by 'merge_columns'.
+            filename (str): The name of the archive file.
+
+        Returns:
+            row_count (int): The number of rows written.
+    """
+    keys = sorted(rows)
+    columns = {"area": array("i", [key[0] for key in keys]), "date": array("i", [-key[1] for key in keys])}
+    value_names = [name for name in COLUMN_FORMATS if name not in ("area", "date")]
+    for name, values in zip(value_names, zip(*map(rows.__getitem__, keys)) if keys else [()] * len(value_names)):
+        columns[name] = array(COLUMN_FORMATS[name], values)
+
+    area_list = sorted(areas.items(), key=lambda item: item[1][0])
+    ranges = {}  # Maps area index -> [first row, last row + 1]
+    for row_number, area in enumerate(columns["area"]):
+        ranges.setdefault(area, [row_number, row_number])[1] = row_number + 1
+    header = {
+        "rows": len(keys),
+        "byteorder": sys.byteorder,
+        "areas": [[code, name, area_type] + ranges.get(index, [0, 0]) for code, (index, name, area_type) in area_list],
+        "columns": {}
+        }
+    offset = 0
+    for name, values in columns.items():
+        header["columns"][name] = [COLUMN_FORMATS[name], offset]
+        offset += -(-len(values) * values.itemsize // 8) * 8
+    header_bytes = json.dumps(header, separators=(",", ":")).encode()
+    data_start = -(-(len(MAGIC) + 8 + len(header_bytes)) // 8) * 8
+
+    temporary_name = filename + ".tmp"
+    with open(temporary_name, "wb") as archive:
+        archive.write(MAGIC + struct.pack("<Q", len(header_bytes)) + header_bytes)
+        for name, values in columns.items():
+            archive.write(b"\0" * (data_start + header["columns"][name][1] - archive.tell()))
+            values.tofile(archive)
+        archive.write(b"\0" * (data_start + offset - archive.tell()))
+    os.replace(temporary_name, filename)
+    return len(keys)
+
+
+def ingest(paths: list, filename: str = ARCHIVE_FILE, workers: int = None) -> int:
+    """Back-loads CSV dumps into the archive file, adding to whatever the archive already holds.
+    The files are parsed in parallel, and each row keeps the date of its dump (from the file name), so that the newest dump's row
+    for each area and date is kept, even if an older dump is added after a newer one.
+
+        Parameters:
+            paths (list): CSV files, or folders of CSV files, named with the date of the dump (such as 'nation_2021-10-28.csv').
+            filename (str): The name of the archive file.
+            workers (int): The number of processes parsing files. Defaults to the number of CPUs.
+
+        Returns:
+            row_count (int): The number of rows in the archive once the files have been added.
+    """
+    files = find_csv_files(paths)
+    rows = {}
+    areas = {}
+    if os.path.exists(filename):
+        archive = open_archive(filename)
+        try:
+            merge_columns(rows, areas, archive)
+        finally:
+            close_archive(archive)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        for csv_filename, columns in zip(files, pool.map(covid_data_handler.load_csv_columns, files)):  # Results arrive in file order
+            columns["dump"] = array(COLUMN_FORMATS["dump"], [dump_day(csv_filename, columns)]) * len(columns["date"])
+            merge_columns(rows, areas, columns)
+            logging.info("'%s' has been added to the COVID archive.", csv_filename)
+    return write_archive(rows, areas, filename)
+
+
+def open_archive(filename: str = ARCHIVE_FILE) -> dict:
+    """Memory-maps an archive file, without reading or copying its columns.
+
+        Parameters:
+            filename (str): The name of the archive file.
+
+        Returns:
+            archive (dict): The columns in the same form as 'covid_data_handler.columns_from_rows' returns, as views onto the file,
+            and the rows held for each area. It must be passed to 'close_archive' once it is no longer needed.
+    """
+    with open(filename, "rb") as archive_file:
+        mapped = mmap.mmap(archive_file.fileno(), 0, access=mmap.ACCESS_READ)
+    if mapped[:len(MAGIC)] != MAGIC:
+        mapped.close()
+        raise ValueError("'" + filename + "' is not a COVID archive file.")
+    header_length = struct.unpack("<Q", mapped[len(MAGIC):len(MAGIC) + 8])[0]
+    header = json.loads(mapped[len(MAGIC) + 8:len(MAGIC) + 8 + header_length])
+    if header["byteorder"] != sys.byteorder:
+        mapped.close()
+        raise ValueError("'" + filename + "' was written on a machine with a different byte order.")
+    data_start = -(-(len(MAGIC) + 8 + header_length) // 8) * 8
+    view = memoryview(mapped)
+    archive = {
+        "mmap": mapped,
+        "views": [view],
+        "rows": header["rows"],
+        "area_codes": [area[0] for area in header["areas"]],
+        "area_names": [area[1] for area in header["areas"]],
+        "area_types": [area[2] for area in header["areas"]],
+        "area_rows": {area[0]: (area[3], area[4]) for area in header["areas"]}
+        }
+    for name, (column_format, offset) in header["columns"].items():
+        start = data_start + offset
+        column = view[start:start + header["rows"] * struct.calcsize(column_format)].cast(column_format)
+        archive["views"].append(column)
+        archive[name] = column
+    if "dump" not in archive:
+        archive["dump"] = array(COLUMN_FORMATS["dump"], [0]) * header["rows"]  # Archives written before dump dates were kept count as the oldest dump
+    return archive
+
+
+def close_archive(archive: dict) -> None:
+    """Releases the views onto an archive file, and unmaps it."""
+    for view in reversed(archive["views"]):
+        view.release()
+    archive["mmap"].close()
+
+
+def area_columns(archive: dict, area_code: str) -> dict:
+    """Returns the columns of one area in an archive, newest date first, as views onto the file. Returns None if the area is not held."""
+    if area_code not in archive["area_rows"]:
+        return None
+    start, end = archive["area_rows"][area_code]
+    return {name: archive[name][start:end] for name in COLUMN_FORMATS}
+
+
+def archive_metrics(archive: dict, area_code: str = None) -> dict:
+    """Works out the headline metrics for areas in an archive, as 'process_covid_csv_data' does for a CSV file.
+
+        Parameters:
+            archive (dict): The archive, as returned by 'open_archive'.
+            area_code (str): The area to work out the metrics for. Defaults to every area in the archive.
+
+        Returns:
+            metrics (dict): Maps each area code to its (last7days_cases, current_hospital_cases, total_deaths).
+    """
+    codes = archive["area_codes"] if area_code is None else [area_code]
+    return {code: covid_data_handler.covid_csv_metrics(area_columns(archive, code)) for code in codes if code in archive["area_rows"]}
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Back-loads COVID CSV dumps into the archive file, or works out metrics from it.")
+    parser.add_argument("--archive", default=ARCHIVE_FILE, help="the archive file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    ingest_parser = commands.add_parser("ingest", help="add CSV files, or folders of CSV files, to the archive")
+    ingest_parser.add_argument("paths", nargs="+")
+    ingest_parser.add_argument("--workers", type=int, default=None, help="the number of processes parsing files")
+    metrics_parser = commands.add_parser("metrics", help="print the headline metrics of one area, or of every area")
+    metrics_parser.add_argument("area_code", nargs="?")
+    arguments = parser.parse_args()
+    if arguments.command == "ingest":
+        print("The archive now holds " + str(ingest(arguments.paths, arguments.archive, arguments.workers)) + " rows.")
+    else:
+        archive = open_archive(arguments.archive)
+        for code, (last7days_cases, current_hospital_cases, total_deaths) in archive_metrics(archive, arguments.area_code).items():
+            print(code + ": " + str(last7days_cases) + " cases in the last 7 days, " + str(current_hospital_cases) + " hospital cases, " + str(total_deaths) + " deaths")
+        close_archive(archive)
@@ -0,0 +1,128 @@
+"""
+event_stream - This module is the Server-Sent Events module.
+This module is responsible for pushing changes to the dashboard out to every connected browser.
+This includes...
+    - Keeping a short, numbered history of recent events, so that reconnecting browsers can catch up on what they missed.
+    - Numbering each event from the data generation it describes, so that a browser can reconnect to any worker of the dashboard.
+    - Waking every waiting connection with a single notification when an event is published, rather than keeping a queue per browser.
+    - Formatting events for the 'text/event-stream' format, with regular keep-alive comments.
+    - Telling a browser which has missed more events than the history holds to reload, with a "reset" event.
+    - Limiting how many streams are open at once, since each one holds a server thread for as long as the browser is connected.
+"""
+import json
+import threading
+import collections
+
+import settings
+
+
+KEEPALIVE_SECONDS = 15
+HISTORY_LENGTH = 256
+KIND_OFFSETS = {"stats": 0, "articles": 1, "updates": 2}  # Each generation has at most one event of each kind
+EVENTS_PER_GENERATION = len(KIND_OFFSETS) + 1  # Any other kind of event takes the last ID of its generation
+MAX_STREAMS = settings.config_data.get("max_event_streams", 100)
+_events = collections.deque(maxlen=HISTORY_LENGTH)  # Holds (event ID, data generation, message), oldest first
+_last_id = 0
+_dropped_id = 0  # The ID of the newest event which no longer fits in the history
+_dropped_generation = 0  # The data generation of that event
+_open_streams = 0
+_condition = threading.Condition()
+
+
+def publish(kind: str, payload: dict) -> int:
+    """Publishes an event to every connected browser.
+
+        Parameters:
+            kind (str): The type of the event, such as "stats", "articles" or "updates".
+            payload (dict): The data sent with the event, which is serialised as JSON.
+                            Its "generation" decides the ID of the event, which is always higher than any before it.
+
+        Returns:
+            event_id (int): The ID of the published event.
+    """
+    global _last_id, _dropped_id, _dropped_generation
+    data = json.dumps(payload, separators=(",", ":"), default=str)
+    generation = payload.get("generation", 0)
+    with _condition:
+        _last_id = max(_last_id + 1, generation * EVENTS_PER_GENERATION + KIND_OFFSETS.get(kind, len(KIND_OFFSETS)))
+        if len(_events) == HISTORY_LENGTH:
+            _dropped_id, _dropped_generation = _events[0][:2]
+        message = "id: " + str(_last_id) + "\nevent: " + kind + "\ndata: " + data + "\n\n"
+        _events.append((_last_id, generation, message.encode()))
+        _condition.notify_all()
+        return _last_id
+
+
+def _reset_event() -> tuple:
+    """Returns a "reset" event, which tells a browser to reload the page, as (event ID, data generation, message).
+    It takes the ID of the newest event, so that once the browser reconnects it is only sent what happens next.
+    The caller must hold '_condition'.
+    """
+    generation = _events[-1][1] if _events else 0
+    return (_last_id, generation, ("id: " + str(_last_id) + "\nevent: reset\ndata: {}\n\n").encode())
+
+
+def events_after(event_id: int) -> list:
+    """Returns every (event ID, data generation, message) in the history after the given ID.
+    If some of those events are no longer in the history, or the ID is from a later run of the dashboard,
+    a single "reset" event is returned instead.
+    """
+    with _condition:
+        if event_id < _dropped_id or event_id > _last_id:
+            return [_reset_event()]  # The browser has missed more than the history holds, so it can only reload
+        return [event for event in _events if event[0] > event_id]
+
+
+def open_stream() -> bool:
+    """Reserves one of the 'MAX_STREAMS' streams, returning False if they are all open. 'close_stream' must be called once it ends."""
+    global _open_streams
+    with _condition:
+        if _open_streams >= MAX_STREAMS:
+            return False
+        _open_streams += 1
+        return True
+
+
+def close_stream() -> None:
+    """Releases a stream reserved by 'open_stream'."""
+    global _open_streams
+    with _condition:
+        _open_streams -= 1
+
+
+def stream(last_event_id: int = None, generation: int = None):
+    """Yields messages for one browser, waiting for new events between them.
+
+        Parameters:
+            last_event_id (int): The ID of the last event the browser received, if it is reconnecting.
+            generation (int): The data generation of the page the browser has, so that it is sent every later change.
+
+        Returns:
+            messages (generator): The messages to send, as bytes.
+    """
+    resync = []
+    if last_event_id is None:
+        with _condition:
+            last_event_id = _last_id
+            if generation is not None and generation < _dropped_generation:
+                resync = [_reset_event()]  # Some of the changes since the page was built are no longer in the history
+            elif generation is not None:
+                # Changes published between the page being built and the browser connecting are sent as well
+                for event_id, event_generation, message in _events:
+                    if event_generation > generation:
+                        last_event_id = event_id - 1
+                        break
+    yield b"retry: 5000\n\n"
+    for event_id, event_generation, message in resync:
+        yield message
+    while True:
+        with _condition:
+            if _last_id == last_event_id:
+                _condition.wait(timeout=KEEPALIVE_SECONDS)
+        events = events_after(last_event_id)
+        if not events:
+            yield b": keep-alive\n\n"  # Stops proxies from closing an idle connection
+            continue
+        for event_id, event_generation, message in events:
+            yield message
+        last_event_id = events[-1][0]
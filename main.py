@@ -1,261 +1,345 @@
 """main - This module is the main Flask app."""
 
+import settings
+import startup_profile
+if settings.PROFILE_STARTUP:
+    startup_profile.install()  # Before anything else is imported, so that every import is timed
+
+import sys
 import json
+import gzip
+import queue
+import atexit
 import logging
+import logging.handlers
 import datetime
 import time
-import sched
-from flask import Flask, render_template, request
+from flask import Flask, render_template, request, make_response, Response, g
+
+import event_stream
+import metrics
+import page_cache
+import refresh_engine
+import snapshot_store
+
+
 
-import covid_data_handler
-import covid_news_handling 
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Hands log records to the logging thread as they are, so that messages are formatted there rather than on the request path."""
 
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:
+            return super().prepare(record)  # Tracebacks are formatted straight away, while the frames they refer to still exist
+        return record
+
+
+# Log records are written to the file by a background thread, and messages below "log_level" (INFO by default) are never formatted at all.
+# The thread is started by 'create_app'; until then, records wait in the queue.
 FORMAT = "%(levelname)s: %(asctime)s %(message)s"
-logging.basicConfig(filename="system_log.log", level=logging.DEBUG, format=FORMAT)
+log_queue = queue.SimpleQueue()
+log_file_handler = logging.FileHandler("system_log.log", delay=True)
+log_file_handler.setFormatter(logging.Formatter(FORMAT))
+log_listener = logging.handlers.QueueListener(log_queue, log_file_handler)
+logging.basicConfig(level=settings.config_data.get("log_level", "INFO"), handlers=[DeferredQueueHandler(log_queue)])
 app = Flask(__name__)
-logging.info("Program has been launched.")
-covid_scheduler = covid_data_handler.covid_scheduler
-news_scheduler = covid_news_handling.news_scheduler
-updates = []
-
-try:
-    covid_data_handler.covid_API_request(location = covid_data_handler.config_data["local_location"],
-                                         location_type = covid_data_handler.config_data["local_type"])
-    covid_data_handler.covid_API_request(location = covid_data_handler.config_data["national_location"],
-                                         location_type = "nation")
-except:
-    # If unable to connect with the API, log the issue and terminate the program.
-    logging.critical("Connection to Coronavirus API has failed. Terminating the program.")
-    exit()
-
-try:
-    covid_news_handling.news_API_request()
-except:
-    logging.critical("Connection to News API has failed. Terminating the program.")
-    exit()
+PUBLISH_WAIT = settings.config_data.get("publish_wait", 2)  # The longest time (in seconds) a form sent to /index waits for its change to be published
+metrics.describe("dashboard_http_request_seconds", "histogram", "Time taken to handle each request, by endpoint.")
+metrics.describe("dashboard_http_requests_total", "counter", "Requests handled, by endpoint and status code.")
+_started = False
+
+
+def create_app() -> Flask:
+    """Restores the last saved snapshot and starts the refresh engine, then returns the app, ready to serve.
+    Importing this module starts nothing, so this must be called before serving, for example with 'gunicorn "main:create_app()"'.
+    Calling it again returns the same app without starting anything else.
+
+        Returns:
+            app (Flask): The Flask app.
+    """
+    global _started
+    if _started:
+        return app
+    _started = True
+    log_listener.start()
+    atexit.register(log_listener.stop)
+    logging.info("Program has been launched.")
+
+    # Serve straight away from the last saved snapshot, and bring the data up to date in the background.
+    with startup_profile.step("restore snapshot"):
+        restored = snapshot_store.load_snapshot()
+    if restored:
+        logging.info("The dashboard has been restored from the snapshot file.")
+    else:
+        logging.warning("No snapshot file was found. The dashboard will be empty until the first refresh has finished.")
+
+    with startup_profile.step("start refresh engine"):
+        refresh_engine.start()
+        refresh_engine.refresh_now()  # Only queues the refreshes; nothing waits for the APIs before the app can serve
+
+    if settings.PROFILE_STARTUP:
+        startup_profile.uninstall()
+        profile = startup_profile.report()
+        logging.info("Start-up profile:\n%s", profile)
+        print(profile, file=sys.stderr)
+    return app
+
+
+@app.before_request
+def start_timer() -> None:
+    """Notes when the handling of a request began."""
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request(response: Response) -> Response:
+    """Records how long a request took to handle, and its status code."""
+    endpoint = request.endpoint or "unknown"
+    metrics.observe("dashboard_http_request_seconds", time.perf_counter() - g.request_start, endpoint=endpoint)
+    metrics.inc("dashboard_http_requests_total", endpoint=endpoint, status=response.status_code)
+    return response
+
+
+def cached_response(name: str, generation: int, build, mimetype: str):
+    """Serves output which is only built once for each generation of the data, gzipped if the client accepts it.
+
+        Parameters:
+            name (str): The name of the output, such as "index".
+            generation (int): The generation of the snapshot the output is built from.
+            build (function): Builds the output as bytes, when called with no arguments.
+            mimetype (str): The mimetype of the output.
+
+        Returns:
+            response (flask.Response): The output, or '304 Not Modified' if the client already has it.
+    """
+    body = page_cache.get_or_build(name, generation, build)
+    if request.accept_encodings["gzip"]:
+        body = page_cache.get_or_build(name + ".gz", generation, lambda: gzip.compress(body))
+        name += ".gz"  # The gzipped output is a different representation, so it needs its own ETag
+    response = make_response(body)
+    response.mimetype = mimetype
+    if name.endswith(".gz"):
+        response.headers["Content-Encoding"] = "gzip"
+    response.headers["Vary"] = "Accept-Encoding"
+    response.set_etag(page_cache.make_etag(name, generation))
+    response.headers["Cache-Control"] = "no-cache"  # Clients may keep the output, but must check its ETag before using it
+    return response.make_conditional(request)
+
+
+def to_json(payload) -> bytes:
+    """Serialises a payload into compact JSON."""
+    return json.dumps(payload, separators=(",", ":"), default=str).encode()
+
+
+def json_response(payload, status: int = 200) -> Response:
+    """Returns a payload as a JSON response with the given status code."""
+    return Response(to_json(payload), status=status, mimetype="application/json")
 
 
 @app.route("/")
 def index() -> render_template:
     """This is the index page for the website."""
-    logging.info("The user has navigated to index.")
-    
-    for item in updates:
-        """ EXPIRY CHECK """
-        if (item["time"] < (datetime.datetime.now())) and (item["repeat"] == False):
-            item["complete"] = True
-
-        """ CANCELLING UPDATES """
-        if item ["cancelled"] == True:
-            if item["covid-data"] == True:
-                # Remove the item from the covid scheduler queue
-                covid_scheduler.cancel(item["covid_event_ids"][0])
-                covid_scheduler.cancel(item["covid_event_ids"][1])
-            if item["news"] == True:
-                # Remove the item from the news scheduler queue
-                news_scheduler.cancel(item["news_event_id"])
-            logging.info("The user has cancelled update '" + str(item["title"]) + "' for " + str(item["time"]) + ".")
-            updates.remove(item)
-
-        """ CARRYING OUT OPERATION """       
-        if (item["complete"] == False) and (item["cancelled"] == False):        
-            if (item["covid-data"] == True) and (item["news"] == True) and (item["repeat"] == True):
-                item["covid_event_ids"] = covid_data_handler.schedule_covid_updates(item["time"], covid_data_handler.covid_API_request)
-                item["news_event_id"] = covid_news_handling.update_news(item["time"], covid_news_handling.news_API_request)
-                logging.info("'" + str(item["title"]) + "' for " + str(item["time"]) + " has been added to the COVID scheduler.")
-                logging.info("'" + str(item["title"]) + "' for " + str(item["time"]) + " has been added to the news scheduler.")
-                item["time"] += datetime.timedelta(days=1)  # Increment time by 1 day, so that the update can be repeated again tomorrow at the same time
-                logging.info("'" + str(item["title"]) + "' for " + str(item["time"]) + " is now scheduled to repeat tomorrow.")
-                
-            elif (item["covid-data"] == True) and (item["news"] == True) and (item["repeat"] == False):
-                item["covid_event_ids"] = covid_data_handler.schedule_covid_updates(item["time"], covid_data_handler.covid_API_request)
-                item["news_event_id"] = covid_news_handling.update_news(item["time"], covid_news_handling.news_API_request)
-                logging.info("'" + str(item["title"]) + "' for " + str(item["time"]) + " has been added to the COVID scheduler.")
-                logging.info("'" + str(item["title"]) + "' for " + str(item["time"]) + " has been added to the news scheduler.")
-                
-            elif (item["covid-data"] == True) and (item["news"] == False) and (item["repeat"] == True):
-                item["covid_event_ids"] = covid_data_handler.schedule_covid_updates(item["time"], covid_data_handler.covid_API_request)
-                logging.info("'" + str(item["title"]) + "' for " + str(item["time"]) + " has been added to the COVID scheduler.")
-                item["time"] += datetime.timedelta(days=1)
-                logging.info("'" + str(item["title"]) + "' for " + str(item["time"]) + " is now scheduled to repeat tomorrow.")
-                
-            elif (item["covid-data"] == False) and (item["news"] == True) and (item["repeat"] == True):
-                item["news_event_id"] = covid_news_handling.update_news(item["time"], covid_news_handling.news_API_request)
-                logging.info("'" + str(item["title"]) + "' for " + str(item["time"]) + " has been added to the news scheduler.")
-                item["time"] += datetime.timedelta(days=1)
-                logging.info("'" + str(item["title"]) + "' for " + str(item["time"]) + " is now scheduled to repeat tomorrow.")
-                
-            elif (item["covid-data"] == True) and (item["news"] == False) and (item["repeat"] == False):
-                item["covid_event_ids"] = covid_data_handler.schedule_covid_updates(item["time"], covid_data_handler.covid_API_request)
-                logging.info("'" + str(item["title"]) + "' for " + str(item["time"]) + " has been added to the COVID scheduler.")
-                
-            elif (item["covid-data"] == False) and (item["news"] == True) and (item["repeat"] == False):
-                item["news_event_id"] = covid_news_handling.update_news(item["time"], covid_news_handling.news_API_request)
-                logging.info("'" + str(item["title"]) + "' for " + str(item["time"]) + " has been added to the news scheduler.")
-                
-            else:
-                logging.warning("'" + str(item["title"]) + "' for " + str(item["time"]) + "is an invalid item in updates list. Item has been ignored.")
-
-        """ REMOVING IF COMPLETE """
-        if item["complete"] == True:
-            updates.remove(item)
-            logging.info("Update '" + str(item["title"]) + "' for " + str(item["time"]) + " has been completed.")
-
-    covid_scheduler.run(blocking=False)
-    news_scheduler.run(blocking=False)
+    logging.debug("The user has navigated to index.")
+    data = refresh_engine.get_snapshot()  # Scheduling and refreshing happen in the refresh engine, not here
+    # The page is only rendered once for each generation of the data; every other request is served the cached page.
+    return cached_response("index", data["generation"], lambda: render_index(data).encode(), "text/html")
+
+
+@app.route("/events")
+def events() -> Response:
+    """Streams changes to the dashboard to the browser as Server-Sent Events, so that it does not need to reload to find them.
+    Each open stream holds a server thread, so once 'event_stream.MAX_STREAMS' are open, further browsers are turned away
+    and fall back to reloading the page every 60 seconds.
+    """
+    if not event_stream.open_stream():
+        return Response("Too many open event streams.", status=503, mimetype="text/plain")
+    last_event_id = request.headers.get("Last-Event-ID", "")
+    stream = event_stream.stream(int(last_event_id) if last_event_id.isdigit() else None,
+                                 request.args.get("generation", type=int))
+    response = Response(stream, mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    response.call_on_close(event_stream.close_stream)  # Runs once the browser disconnects, even if the stream never started
+    return response
+
+
+@app.route("/metrics")
+def metrics_endpoint() -> Response:
+    """Returns the dashboard's metrics in the Prometheus text format."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
 
+@app.route("/api/stats")
+def api_stats():
+    """Returns the COVID statistics for every configured area as JSON."""
+    data = refresh_engine.get_snapshot()
+    return cached_response("stats", data["generation"], lambda: to_json({
+        "generation": data["generation"],
+        "local": data["local_covid_data"],
+        "national": data["national_covid_data"],
+        "areas": data["all_area_stats"]
+        }), "application/json")
+
+
+@app.route("/api/articles")
+def api_articles():
+    """Returns the current news articles as JSON."""
+    data = refresh_engine.get_snapshot()
+    return cached_response("articles", data["generation"], lambda: to_json({
+        "generation": data["generation"],
+        "articles": [article._asdict() for article in data["news_articles"]]
+        }), "application/json")
+
+
+@app.route("/api/updates")
+def api_updates():
+    """Returns the scheduled updates as JSON."""
+    data = refresh_engine.get_snapshot()
+    fields = ("id", "title", "content", "time", "covid-data", "news", "repeat")
+    return cached_response("updates", data["generation"], lambda: to_json({
+        "generation": data["generation"],
+        "updates": [{field: item.get(field) for field in fields} for item in data["updates"]]
+        }), "application/json")
+
+
+@app.route("/api/trends")
+def api_trends():
+    """Returns the trend of an area's COVID data over 30, 90 or 365 days as JSON. By default, the local area over 90 days is returned."""
+    data = refresh_engine.get_snapshot()
+    area_type = request.args.get("area_type", settings.config_data["local_type"])
+    area_name = request.args.get("area_name", settings.config_data["local_location"])
+    days = request.args.get("days", 90, type=int)
+    trend = data["trends"].get((area_type, area_name), {}).get(days)
+    if trend is None:
+        return json_response({"error": "There is no " + str(days) + "-day trend for " + area_name + " (" + area_type + ")."}, 404)
+    return cached_response("trends-" + area_type + "-" + area_name + "-" + str(days), data["generation"],
+                           lambda: to_json(dict(trend, generation=data["generation"])), "application/json")
+
+
+def render_index(data: dict) -> str:
+    """Renders the dashboard from a snapshot of the data."""
     return render_template("index.html",
                            title="SARS-CoV-2 (Coronavirus) dashboard",
-                           location=covid_data_handler.local_covid_data["location"],
-                           nation_location=covid_data_handler.national_covid_data["nation_location"],
-                           local_7day_infections=covid_data_handler.local_covid_data["local_7day_infections"],
-                           national_7day_infections=covid_data_handler.national_covid_data["national_7day_infections"],
-                           hospital_cases=covid_data_handler.national_covid_data["hospital_cases"],
-                           deaths_total=covid_data_handler.national_covid_data["deaths_total"],
-                           news_articles=covid_news_handling.news_data[-1]["articles"],
-                           updates=updates,
+                           location=data["local_covid_data"]["location"],
+                           nation_location=data["national_covid_data"]["nation_location"],
+                           local_7day_infections=data["local_covid_data"]["local_7day_infections"],
+                           national_7day_infections=data["national_covid_data"]["national_7day_infections"],
+                           hospital_cases=data["national_covid_data"]["hospital_cases"],
+                           deaths_total=data["national_covid_data"]["deaths_total"],
+                           area_stats=data["area_stats"],
+                           trend_area_type=settings.config_data["local_type"],
+                           trend_area_name=settings.config_data["local_location"],
+                           news_articles=data["news_articles"],
+                           updates=data["updates"],
+                           generation=data["generation"],
                            image="favicon.png") 
                         
 
+def make_update(title: str, update_time: str, covid_data: bool, news: bool, repeat: bool) -> dict:
+    """Builds an update for the given time of day, which is carried out today if that time is still to come, or else tomorrow.
+
+        Parameters:
+            title (str): The label the user gave the update.
+            update_time (str): The time of day of the update (hh:mm).
+            covid_data (bool): Whether the update refreshes the COVID data.
+            news (bool): Whether the update refreshes the news articles.
+            repeat (bool): Whether the update repeats at the same time every day.
+
+        Returns:
+            item (dict): The update, or None if the time is not valid or the update would refresh nothing.
+    """
+    if not (covid_data or news):
+        return None
+    now = datetime.datetime.now()
+    try:
+        chosen_time = datetime.datetime.strptime(update_time, "%H:%M")
+    except (TypeError, ValueError):
+        return None
+    spec_time = now.replace(hour = chosen_time.hour, minute = chosen_time.minute, second = 0, microsecond = 0)
+
+    if now >= spec_time:
+        spec_time += datetime.timedelta(days=1)  # If the chosen time has already passed today, schedule the update for tomorrow instead.
+
+    settings_text = ""
+    if covid_data:
+        settings_text += " COVID data updates set."
+    if news:
+        settings_text += " News updates also set." if covid_data else " News updates set."
+    if repeat:
+        settings_text += " Updates will repeat."
+    logging.info("The user has scheduled update '%s' for %s.%s", title, spec_time, settings_text)
+    return {
+        "title": str(title),
+        "content": "Next update is at " + update_time + "." + settings_text,
+        "time": spec_time,
+        "covid-data": covid_data,
+        "news": news,
+        "repeat": repeat,
+        "complete": False,
+        "cancelled": False
+        }
+
+
+@app.route("/api/updates", methods=["POST"])
+def api_add_update():
+    """Schedules an update from a JSON body, such as {"title": "Morning", "time": "08:00", "covid-data": true, "news": true, "repeat": false}.
+    The update is added straight away, without rendering anything; it appears in the page (and as an "updates" event) once it has been published.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get("title"), str) or not body["title"] or not isinstance(body.get("time"), str):
+        return json_response({"error": "An update needs a title and a time (hh:mm)."}, 400)
+    item = make_update(body["title"], body["time"], bool(body.get("covid-data")), bool(body.get("news")), bool(body.get("repeat")))
+    if item is None:
+        logging.warning("The user has attempted to schedule an invalid update. Their input has been ignored.")
+        return json_response({"error": "The time must be hh:mm, and the update must refresh the COVID data, the news or both."}, 400)
+    update_id = refresh_engine.add_update(item)
+    return json_response({"id": update_id, "time": item["time"]}, 202)
+
+
+@app.route("/api/updates/<update_id>", methods=["DELETE"])
+def api_cancel_update(update_id: str):
+    """Cancels the update with the given ID."""
+    if not refresh_engine.cancel_update(update_id):
+        return json_response({"error": "There is no update with that ID."}, 404)
+    return json_response({"id": update_id}, 202)
+
+
+@app.route("/api/articles/dismiss", methods=["POST"])
+def api_dismiss_article():
+    """Removes a news article for good, from a JSON body such as {"title": "..."}."""
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get("title"), str):
+        return json_response({"error": "The title of the article is needed."}, 400)
+    found = refresh_engine.dismiss_article(body["title"])
+    return json_response({"title": body["title"], "found": found}, 202)
+
+
 @app.route("/index")
 def update() -> index:
-    """This function will be called every time the user sends a request to the server."""
+    """This function will be called every time the user sends a request to the server.
+    Only forms sent without JavaScript arrive here; otherwise the page sends its changes to the JSON endpoints above.
+    """
     if "update" in request.args:
-        content = request.args.to_dict()
-
-        if content["update"] == "":
+        if request.args["update"] == "":
             return index()
-
-
-        now = datetime.datetime.now()
-        spec_time = now.replace(hour = int((str(content["update"]))[0:2]), minute = int((str(content["update"]))[3:5]), second = 0, microsecond = 0)  # Replace  
-
-        if now >= spec_time:
-            spec_time += datetime.timedelta(days=1)  # If the chosen time has already passed today, schedule the update for tomorrow instead.
-
-        if now < spec_time:
-            pass
-
-        if ("covid-data" in request.args) and ("news" in request.args) and ("repeat" in request.args):
-            item = {
-                "title": str(content["two"]),
-                "content": "Next update is at " + str(content["update"]) + ". COVID data updates set. News updates also set. Updates will repeat.",
-                "time": spec_time,
-                "covid-data": True,
-                "news": True,
-                "repeat": True,
-                "complete": False,
-                "news_event_id" : None,
-                "covid_event_ids": None,
-                "cancelled": False
-                }                
-            logging.info("The user has scheduled update '" + str(content["two"]) + "' for " + str(spec_time) + ". COVID updates set. News updates set. Updates will repeat.")
-            
-        elif ("covid-data" in request.args) and ("news" in request.args) and ("repeat" not in request.args):
-            item = {
-                "title": str(content["two"]),   
-                "content": "Next update is at " + str(content["update"]) + ". COVID data updates set. News updates also set.",
-                "time": spec_time,
-                "covid-data": True,
-                "news": True,
-                "repeat": False,
-                "complete": False,
-                "news_event_id" : None,
-                "covid_event_ids": None,
-                "cancelled": False
-                }
-            logging.info("The user has scheduled update '" + str(content["two"]) + "' for " + str(spec_time) + ". COVID updates set. News updates set.")
-
-        elif ("covid-data" in request.args) and ("news" not in request.args) and ("repeat" in request.args):
-            item = {
-                "title": str(content["two"]),
-                "content": "Next update is at " + str(content["update"]) + ". COVID data updates set. Updates will repeat.",
-                "time": spec_time,
-                "covid-data": True,
-                "news": False,
-                "repeat": True,
-                "complete": False,
-                "news_event_id" : None,
-                "covid_event_ids": None,
-                "cancelled": False
-                }
-            logging.info("The user has scheduled update '" + str(content["two"]) + "' for " + str(spec_time) + ". COVID updates set. Updates will repeat.")
-
-        elif ("covid-data" not in request.args) and ("news" in request.args) and ("repeat" in request.args):
-            item = {
-                "title": str(content["two"]),
-                "content": "Next update is at " + str(content["update"]) + ". News updates set. Updates will repeat.",
-                "time": spec_time,
-                "covid-data": False,
-                "news": True,
-                "repeat": True,
-                "complete": False,
-                "news_event_id" : None,
-                "covid_event_ids": None,
-                "cancelled": False
-                }
-            logging.info("The user has scheduled update '" + str(content["two"]) + "' for " + str(spec_time) + ". News updates set. Updates will repeat.")
-            
-        elif ("covid-data" in request.args) and ("news" not in request.args) and ("repeat" not in request.args):
-            item = {
-                "title": str(content["two"]),
-                "content": "Next update is at " + str(content["update"]) + ". COVID data updates set.",
-                "time": spec_time,
-                "covid-data": True,
-                "news": False,
-                "repeat": False,
-                "complete": False,
-                "news_event_id" : None,
-                "covid_event_ids": None,
-                "cancelled": False
-                }
-            logging.info("The user has scheduled update '" + str(content["two"]) + "' for " + str(spec_time) + ". COVID updates set.")
-
-        elif ("covid-data" not in request.args) and ("news" in request.args) and ("repeat" not in request.args):
-            item = {
-                "title": str(content["two"]),
-                "content": "Next update is at " + str(content["update"]) + ". News updates set.",
-                "time": spec_time,
-                "covid-data": False,
-                "news": True,
-                "repeat": False,
-                "complete": False,
-                "news_event_id" : None,
-                "covid_event_ids": None,
-                "cancelled": False
-                }
-            logging.info("The user has scheduled update '" + str(content["two"]) + "' for " + str(spec_time) + ". News updates set.")
-
-        else:
+        item = make_update(request.args.get("two", ""), request.args["update"],
+                           "covid-data" in request.args, "news" in request.args, "repeat" in request.args)
+        if item is None:
             logging.warning("The user has attempted to schedule an invalid update. Their input has been ignored.")
             return index()
-    
-        updates.append(item)
-    
+        refresh_engine.add_update(item)
+
     elif 'notif' in request.args:
-        content = request.args.to_dict()
-        
-        for article in covid_news_handling.news_data[-1]["articles"]:
-            if article["title"] == content["notif"]:
-                covid_news_handling.news_data[-1]["articles"].remove(article)
-                logging.info("The user has removed article titled '" + str(article["title"]) + "'.")
-                return index()
-
-                
-    elif 'update_item' in request.args:
-        content = request.args.to_dict()
+        refresh_engine.dismiss_article(request.args["notif"])
 
-        for item in updates:
-            if item["title"] == content["update_item"]:
-                item["cancelled"] = True
-                return index()
+    elif 'update_item' in request.args:
+        refresh_engine.cancel_update(request.args["update_item"])
 
     else:
         return index()
-    
+
+    refresh_engine.request_publish(PUBLISH_WAIT)  # The worker publishes the change; if it takes too long, the page shows it on the next load
     return index()
 
     
 if __name__ == "__main__":
-    app.run(debug=True)
+    create_app().run(debug=True, use_reloader=False)  # The reloader would run 'create_app' again in its watching process, starting a second refresh engine
 
@@ -0,0 +1,144 @@
+"""
+metrics - This module is the metrics module.
+This module is responsible for measuring how the dashboard performs, and exposing the measurements to monitoring tools.
+This includes...
+    - Counters, for events such as cache hits, failed requests and pages served.
+    - Histograms, for timings such as API latency and rendering time, kept in fixed buckets so that recording a value is cheap.
+    - Gauges, which are only read from the rest of the dashboard when the metrics are collected, such as the depth of the scheduler queues.
+    - Writing all of these out in the Prometheus text format, for the '/metrics' endpoint.
+"""
+import time
+import threading
+import contextlib
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)  # Upper bounds, in seconds
+descriptions = {}  # Maps name -> (type, help text)
+counters = {}  # Maps (name, labels) -> value
+histograms = {}  # Maps (name, labels) -> [count in each bucket..., sum, count]
+gauges = {}  # Maps name -> function returning a value, or a dictionary of {labels: value}
+metrics_lock = threading.Lock()
+
+
+def _labels(labels: dict) -> tuple:
+    """Converts label keyword arguments into a hashable key, in a fixed order."""
+    return tuple(sorted(labels.items()))
+
+
+def describe(name: str, kind: str, text: str) -> None:
+    """Gives a metric its type ("counter", "histogram" or "gauge") and help text."""
+    descriptions[name] = (kind, text)
+
+
+def inc(name: str, amount: float = 1, **labels) -> None:
+    """Adds to a counter.
+
+        Parameters:
+            name (str): The name of the counter.
+            amount (float): How much to add.
+            labels: The labels of the counter, such as api="covid".
+
+        Returns:
+            None
+    """
+    key = (name, _labels(labels))
+    with metrics_lock:
+        counters[key] = counters.get(key, 0) + amount
+
+
+def observe(name: str, value: float, **labels) -> None:
+    """Records a value (such as a time in seconds) in a histogram.
+
+        Parameters:
+            name (str): The name of the histogram.
+            value (float): The value to record.
+            labels: The labels of the histogram, such as upstream="newsapi.org".
+
+        Returns:
+            None
+    """
+    key = (name, _labels(labels))
+    with metrics_lock:
+        buckets = histograms.get(key)
+        if buckets is None:
+            buckets = histograms[key] = [0] * (len(DEFAULT_BUCKETS) + 2)
+        for index, bound in enumerate(DEFAULT_BUCKETS):
+            if value <= bound:
+                buckets[index] += 1
+                break
+        buckets[-2] += value
+        buckets[-1] += 1
+
+
+@contextlib.contextmanager
+def timer(name: str, **labels):
+    """Times the code inside a 'with' block, and records the time taken in a histogram, even if the code raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def register_gauge(name: str, text: str, function) -> None:
+    """Registers a gauge, which is read by calling the given function whenever the metrics are collected.
+    The function returns either a single value, or a dictionary mapping label dictionaries (as tuples of pairs) to values.
+    """
+    describe(name, "gauge", text)
+    gauges[name] = function
+
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    """Formats labels as they appear in the Prometheus text format, such as '{api="covid"}'."""
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(key + "=\"" + _escape(value) + "\"" for key, value in pairs) + "}"
+
+
+def _escape(value) -> str:
+    """Escapes a label value, as required by the Prometheus text format."""
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _header(lines: list, name: str, kind: str) -> None:
+    """Adds the HELP and TYPE lines for a metric."""
+    text = descriptions.get(name, (kind, name))[1]
+    lines.append("# HELP " + name + " " + text)
+    lines.append("# TYPE " + name + " " + kind)
+
+
+def render() -> str:
+    """Writes out every metric in the Prometheus text format (version 0.0.4).
+
+        Returns:
+            text (str): The metrics, one sample per line.
+    """
+    with metrics_lock:
+        counter_items = sorted(counters.items())
+        histogram_items = sorted((key, list(buckets)) for key, buckets in histograms.items())
+    lines = []
+    last_name = None
+    for (name, labels), value in counter_items:
+        if name != last_name:
+            _header(lines, name, "counter")
+            last_name = name
+        lines.append(name + _format_labels(labels) + " " + repr(float(value)))
+    for (name, labels), buckets in histogram_items:
+        if name != last_name:
+            _header(lines, name, "histogram")
+            last_name = name
+        cumulative = 0
+        for bound, count in zip(DEFAULT_BUCKETS, buckets):
+            cumulative += count
+            lines.append(name + "_bucket" + _format_labels(labels, (("le", repr(float(bound))),)) + " " + str(cumulative))
+        lines.append(name + "_bucket" + _format_labels(labels, (("le", "+Inf"),)) + " " + str(buckets[-1]))
+        lines.append(name + "_sum" + _format_labels(labels) + " " + repr(float(buckets[-2])))
+        lines.append(name + "_count" + _format_labels(labels) + " " + str(buckets[-1]))
+    for name, function in sorted(gauges.items()):
+        _header(lines, name, "gauge")
+        value = function()
+        samples = value.items() if isinstance(value, dict) else [((), value)]
+        for labels, sample in samples:
+            lines.append(name + _format_labels(tuple(labels)) + " " + repr(float(sample)))
+    return "\n".join(lines) + "\n"
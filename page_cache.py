@@ -0,0 +1,54 @@
+"""
+page_cache - This module is the rendered page cache module.
+This module is responsible for making sure each version of the dashboard is only rendered once.
+This includes...
+    - Caching rendered output against the data generation it was built from, so it is rebuilt only once the data has changed.
+    - Giving each version of the output an ETag, so that browsers which already have it can be answered with '304 Not Modified'.
+"""
+import uuid
+import threading
+
+import metrics
+import shared_state
+
+
+metrics.describe("dashboard_page_cache_total", "counter", "Requests for rendered output, by whether it was served from the cache (hit) or had to be built (build).")
+metrics.describe("dashboard_render_seconds", "histogram", "Time taken to build each version of the rendered output, such as rendering the dashboard template.")
+BOOT_ID = uuid.uuid4().hex[:8]  # A single process's generations restart from zero with each run, so ETags from an older run must never match
+cache = {}  # Maps name -> (generation, output)
+cache_lock = threading.Lock()
+
+
+def get_or_build(name: str, generation: int, build) -> bytes:
+    """Returns the cached output for the given generation, building it only if the cached output is out of date.
+
+        Parameters:
+            name (str): The name of the output, such as "index".
+            generation (int): The generation of the data the output should be built from.
+            build (function): Builds the output, when called with no arguments.
+
+        Returns:
+            output (bytes): The output for the given generation.
+    """
+    entry = cache.get(name)
+    if entry is not None and entry[0] == generation:
+        metrics.inc("dashboard_page_cache_total", output=name, result="hit")
+        return entry[1]
+    with cache_lock:  # Only one thread builds each new version, while the others wait for it
+        entry = cache.get(name)
+        if entry is not None and entry[0] == generation:
+            return entry[1]
+        with metrics.timer("dashboard_render_seconds", output=name):
+            output = build()
+        metrics.inc("dashboard_page_cache_total", output=name, result="build")
+        cache[name] = (generation, output)
+        return output
+
+
+def make_etag(name: str, generation: int) -> str:
+    """Returns the ETag for the output of the given name and generation.
+    Generations from the shared operation log carry on across restarts and are the same on every worker, so they need no boot ID.
+    """
+    if shared_state.backend is not None:
+        return name + "-" + str(generation)
+    return BOOT_ID + "-" + name + "-" + str(generation)
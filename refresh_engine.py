@@ -0,0 +1,554 @@
+"""
+refresh_engine - This module is the background refresh engine.
+This module is responsible for carrying out all data updates away from the Flask request path.
+This includes...
+    - Owning the COVID and news schedulers, and running any due events on a background thread.
+    - Queueing the user's scheduled updates into the schedulers once they are due, and rescheduling or completing them once their refreshes have run.
+    - Publishing a complete snapshot of the dashboard data each time a refresh has finished.
+    - Saving the state of the dashboard to disk whenever it changes, and refreshing all data in the background at start-up.
+    - Pushing what has changed in each new snapshot to connected browsers, as Server-Sent Events.
+    - Sharing the user's changes with other workers, and leaving refreshes to whichever worker is the leader.
+    - Merging refreshes of the same API which are due together into one, and carrying them out within the API's rate limits.
+    - Applying the user's changes straight away, and publishing them in the next snapshot, so that requests never wait for one.
+"""
+import logging
+import datetime
+import threading
+import time
+import functools
+import concurrent.futures
+
+import covid_data_handler
+import covid_news_handling
+import covid_timeseries
+import update_registry
+import snapshot_store
+import event_stream
+import shared_state
+import refresh_policy
+import metrics
+
+
+covid_scheduler = covid_data_handler.covid_scheduler
+news_scheduler = covid_news_handling.news_scheduler
+generation = 0  # Increased every time a snapshot is published, so that anything built from an older snapshot can be spotted
+SEQUENCE_SHIFT = 10  # Each change in the shared operation log starts a new block of 1024 generations
+snapshot = {
+    "generation": generation,
+    "local_covid_data": {},
+    "national_covid_data": {},
+    "area_stats": [],
+    "all_area_stats": [],
+    "trends": {},
+    "news_articles": [],
+    "updates": []
+    }
+
+MAX_SLEEP = 60  # Upper bound (in seconds) on how long the worker sleeps between checks
+RETRY_DELAY = 300  # How long (in seconds) to wait before retrying a failed background refresh
+COALESCE_WINDOW = 60  # A refresh asked for within this many seconds of one already queued for the same API is merged into it
+REFRESHES = {
+    "covid": (covid_scheduler, lambda revalidate: covid_data_handler.update_covid_data(functools.partial(covid_data_handler.covid_API_request, revalidate=revalidate))),
+    "news": (news_scheduler, lambda revalidate: covid_news_handling.news_API_request(revalidate=revalidate))
+    }  # Each refresh is given whether it must ask the API again, rather than use a cached response
+_generation_lock = threading.Lock()
+_published = threading.Condition(_generation_lock)  # Notified whenever a new snapshot is swapped in
+_dirty = False  # Whether anything has changed since the snapshot file was last saved
+_scheduler_pool = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="scheduler")
+_running = {}  # The future running each scheduler's due events, so that a scheduler is never run twice at once
+_running_lock = threading.Lock()
+_refreshes_finished = threading.Event()  # Set whenever a scheduler has finished running its due events
+_wake_event = threading.Event()
+_publish_requested = threading.Event()
+_stop_event = threading.Event()
+_worker = None
+_pending = {}  # The refresh event queued for each API, so that later requests can be merged into it
+_pending_lock = threading.Lock()
+_awaiting = []  # [update, set of APIs whose refreshes have not run yet] for each due update
+_awaiting_lock = threading.Lock()
+
+metrics.describe("dashboard_processing_seconds", "histogram", "Time taken to process fetched data, such as merging COVID records into the time-series store.")
+metrics.describe("dashboard_refresh_engine_tick_seconds", "histogram", "Time taken by each pass of the refresh engine, including any refreshes it carried out.")
+metrics.describe("dashboard_refreshes_total", "counter", "Refreshes of each API, by outcome: new_data, unchanged, skipped, deferred or failed.")
+metrics.register_gauge("dashboard_scheduler_queue_depth", "Events waiting in each scheduler.",
+                       lambda: {(("scheduler", "covid"),): len(covid_scheduler.queue), (("scheduler", "news"),): len(news_scheduler.queue)})
+metrics.register_gauge("dashboard_scheduled_updates", "Updates the user has scheduled.", lambda: len(update_registry.updates))
+metrics.register_gauge("dashboard_news_articles", "Articles in the news store.", lambda: len(covid_news_handling.news_articles))
+metrics.register_gauge("dashboard_snapshot_generation", "Generation of the snapshot being served.", lambda: snapshot["generation"])
+
+
+def publish_snapshot() -> dict:
+    """Builds a new snapshot of the dashboard data and swaps it in as a whole, under a new generation.
+    The generation is taken before any data is gathered, so that the snapshot with the newest generation always
+    holds every change made before any other snapshot was begun.
+    When workers share their state, the generation starts from the newest shared change this worker has caught up with,
+    so that every worker gives the same data the same generation (and the same ETags and event IDs). A snapshot published
+    without any new shared change, which only happens while the shared state cannot be reached, counts up from there.
+
+        Returns:
+            new_snapshot (dict): The snapshot which is now being served to the Flask app.
+    """
+    global snapshot, generation, _dirty
+    with _generation_lock:
+        generation = max(generation + 1, shared_state.sequence() << SEQUENCE_SHIFT)
+        new_generation = generation
+    updates_view = update_registry.list_updates()
+    articles = covid_news_handling.get_articles()
+    area_stats = [covid_timeseries.get_stats(area_type, location) for location, area_type in covid_data_handler.extra_areas()]
+    all_area_stats = [covid_timeseries.get_stats(area_type, location) for location, area_type in covid_data_handler.configured_areas()]
+    trends = {(area_type, location): covid_timeseries.get_trends(area_type, location) for location, area_type in covid_data_handler.configured_areas()}
+    new_snapshot = {
+        "generation": new_generation,
+        "local_covid_data": dict(covid_data_handler.local_covid_data),
+        "national_covid_data": dict(covid_data_handler.national_covid_data),
+        "area_stats": [stats for stats in area_stats if stats is not None],
+        "all_area_stats": [stats for stats in all_area_stats if stats is not None],
+        "trends": trends,  # Each area's trends are rebuilt as a whole on every merge, so they are shared rather than copied
+        "news_articles": articles,
+        "updates": updates_view
+        }
+    with _generation_lock:
+        if new_generation <= snapshot["generation"]:
+            return snapshot  # Never replace a newer snapshot published by another thread
+        old_snapshot = snapshot
+        snapshot = new_snapshot  # A single reference assignment, so readers never see a half-built snapshot
+        push_changes(old_snapshot, new_snapshot)  # Under the lock, so that events are always published in generation order
+        _published.notify_all()
+    _dirty = True  # Saved to disk by the worker, not by whoever published
+    return new_snapshot
+
+
+def push_changes(old_snapshot: dict, new_snapshot: dict) -> None:
+    """Publishes an event for each part of the dashboard which differs between two snapshots.
+
+        Parameters:
+            old_snapshot (dict): The snapshot which was being served before.
+            new_snapshot (dict): The snapshot which has just been published.
+
+        Returns:
+            None
+    """
+    local_data = new_snapshot["local_covid_data"]
+    national_data = new_snapshot["national_covid_data"]
+    stats = {
+        "location": local_data.get("location"),
+        "local_7day_infections": local_data.get("local_7day_infections"),
+        "nation_location": national_data.get("nation_location"),
+        "national_7day_infections": national_data.get("national_7day_infections"),
+        "hospital_cases": national_data.get("hospital_cases"),
+        "deaths_total": national_data.get("deaths_total"),
+        "areas": new_snapshot["all_area_stats"]
+        }
+    if (local_data != old_snapshot["local_covid_data"] or national_data != old_snapshot["national_covid_data"]
+            or new_snapshot["all_area_stats"] != old_snapshot["all_area_stats"]):
+        event_stream.publish("stats", dict(stats, generation=new_snapshot["generation"]))
+
+    old_titles = set(article.title for article in old_snapshot["news_articles"])
+    new_titles = set(article.title for article in new_snapshot["news_articles"])
+    if old_titles != new_titles:
+        event_stream.publish("articles", {
+            "generation": new_snapshot["generation"],
+            "added": [article._asdict() for article in new_snapshot["news_articles"] if article.title not in old_titles],
+            "removed": list(old_titles - new_titles)
+            })
+
+    old_updates = set(item["id"] for item in old_snapshot["updates"])
+    new_updates = set(item["id"] for item in new_snapshot["updates"])
+    if old_updates != new_updates:
+        event_stream.publish("updates", {
+            "generation": new_snapshot["generation"],
+            "added": [{"id": item["id"], "title": item["title"], "content": item["content"]} for item in new_snapshot["updates"] if item["id"] not in old_updates],
+            "removed": list(old_updates - new_updates)
+            })
+
+
+def save_if_changed() -> None:
+    """Saves the state of the dashboard to the snapshot file, if it has changed since it was last saved."""
+    global _dirty
+    if not _dirty or not shared_state.is_leader():
+        return  # Only the leader writes the snapshot file, so that workers never overwrite each other's
+    _dirty = False
+    try:
+        snapshot_store.save_snapshot()
+    except Exception:
+        _dirty = True
+        logging.exception("Unable to save the snapshot file.")
+
+
+def get_snapshot() -> dict:
+    """Returns the most recently published snapshot of the dashboard data."""
+    return snapshot
+
+
+def request_publish(timeout: float = 0) -> dict:
+    """Asks the background worker to publish a new snapshot, and optionally waits for it.
+    However many changes are made before it does, they are all published together in one snapshot.
+
+        Parameters:
+            timeout (float): The longest time (in seconds) to wait for a snapshot begun after this call to be published.
+            Defaults to not waiting. Nothing waits if the worker is not running.
+
+        Returns:
+            snapshot (dict): The snapshot being served once the wait is over, which may be older than the change if the wait timed out.
+    """
+    with _generation_lock:
+        current = generation  # Any snapshot with this generation may have been begun before the change
+    _publish_requested.set()
+    wake()
+    if timeout and _worker is not None and _worker.is_alive():
+        with _published:
+            _published.wait_for(lambda: snapshot["generation"] > current, timeout)
+    return snapshot
+
+
+def _take_publish_request() -> bool:
+    """Returns whether a new snapshot has been asked for since this was last called."""
+    if not _publish_requested.is_set():
+        return False
+    _publish_requested.clear()  # Cleared before the snapshot is built, so any change made after this is still published
+    return True
+
+
+def queue_due_updates(due: list) -> None:
+    """Asks for a refresh of each API needed by the due updates, and holds on to each update until its refreshes have run.
+    However many updates are due together, each API is refreshed at most once. The user asked for these refreshes,
+    so they are forced, and are never skipped because the API is not expected to have published anything new.
+
+        Parameters:
+            due (list): The updates which are due, as returned by 'update_registry.pop_due'.
+
+        Returns:
+            None
+    """
+    with _awaiting_lock:
+        for item in due:
+            _awaiting.append([item, {upstream for upstream, field in (("covid", "covid-data"), ("news", "news")) if item[field]}])
+    if any(item["covid-data"] for item in due):
+        request_refresh("covid", force=True)
+    if any(item["news"] for item in due):
+        request_refresh("news", force=True)
+    for item in due:
+        logging.info("Update '%s' for %s is now being carried out.", item["title"], item["time"])
+
+
+def refresh_ran(upstream: str) -> None:
+    """Records that a refresh of an API has run, whether or not it succeeded, so that the updates waiting for it can be finished."""
+    with _awaiting_lock:
+        for entry in _awaiting:
+            entry[1].discard(upstream)
+
+
+def take_finished_updates() -> list:
+    """Returns the due updates whose refreshes have all run, and stops holding on to them."""
+    with _awaiting_lock:
+        finished = [entry[0] for entry in _awaiting if not entry[1]]
+        _awaiting[:] = [entry for entry in _awaiting if entry[1]]
+    return finished
+
+
+def finish_due_updates(due: list) -> None:
+    """Reschedules repeating updates for the same time tomorrow, and removes all other updates once they are complete.
+
+        Parameters:
+            due (list): The updates whose refreshes have run, as returned by 'take_finished_updates'.
+
+        Returns:
+            None
+    """
+    now = datetime.datetime.now()
+    for item in due:
+        if update_registry.get_update(item["id"]) is not item:
+            continue  # Cancelled (on this or another worker) while its refreshes were waiting to run
+        if item["repeat"] == True:
+            next_time = item["time"] + datetime.timedelta(days=1)  # Repeat again tomorrow at the same time
+            while next_time <= now:
+                next_time += datetime.timedelta(days=1)  # Skip any days missed while the dashboard was not running
+            update_registry.reschedule_update(item["id"], next_time)
+            shared_state.record_op("reschedule_update", id=item["id"], time=next_time)
+            logging.info("'%s' for %s is now scheduled to repeat tomorrow.", item["title"], item["time"])
+        else:
+            item["complete"] = True
+            update_registry.cancel_update(item["id"])
+            shared_state.record_op("cancel_update", id=item["id"])
+            logging.info("Update '%s' for %s has been completed.", item["title"], item["time"])
+
+
+def add_update(item: dict) -> str:
+    """Adds an update to the registry, so that it is carried out once it is due.
+
+        Parameters:
+            item (dict): The update, as created by the Flask app.
+
+        Returns:
+            update_id (str): The ID of the update.
+    """
+    update_id = update_registry.add_update(item)
+    shared_state.record_op("add_update", item=item)
+    logging.info("'%s' for %s has been added to the update registry.", item["title"], item["time"])
+    request_publish()
+    return update_id
+
+
+def cancel_update(update_id: str) -> bool:
+    """Cancels the update with the given ID.
+
+        Parameters:
+            update_id (str): The ID of the update to be cancelled.
+
+        Returns:
+            found (bool): Whether an update with the given ID was found.
+    """
+    item = update_registry.cancel_update(update_id)
+    if item is None:
+        return False
+    item["cancelled"] = True
+    shared_state.record_op("cancel_update", id=update_id)
+    logging.info("The user has cancelled update '%s' for %s.", item["title"], item["time"])
+    request_publish()
+    return True
+
+
+def dismiss_article(title: str) -> bool:
+    """Removes the news article with the given title, so that it is never shown again.
+
+        Parameters:
+            title (str): The title of the article to be removed.
+
+        Returns:
+            found (bool): Whether an article with the given title was being shown.
+    """
+    found = covid_news_handling.remove_article(title)
+    url = covid_news_handling.dismissed_titles.get(title)
+    shared_state.record_op("dismiss_article", title=title, url=url)  # Other workers may still be showing it
+    if found:
+        logging.info("The user has removed article titled '%s'.", title)
+        request_publish()
+    return found
+
+
+def schedule_refresh(upstream: str, when: float, force: bool = False):
+    """Queues a refresh of an API for the given time, unless one is already queued for about the same time or earlier.
+
+        Parameters:
+            upstream (str): The name of the API, "covid" or "news".
+            when (float): When the refresh should be carried out, as a timestamp.
+            force (bool): If True, the refresh is carried out even if the API cannot have published anything new.
+
+        Returns:
+            event (sched.Event): The queued event which will carry out the refresh.
+    """
+    scheduler = REFRESHES[upstream][0]
+    with _pending_lock:
+        pending = _pending.get(upstream)
+        if pending is not None and pending in scheduler.queue:
+            if pending.time <= when + COALESCE_WINDOW and (pending.argument[1] or not force):
+                return pending  # Merged into the refresh which is already queued
+            scheduler.cancel(pending)
+        event = scheduler.enterabs(when, 1, _run_refresh, (upstream, force))
+        _pending[upstream] = event
+    wake()
+    return event
+
+
+def request_refresh(upstream: str, force: bool = False):
+    """Asks for a refresh of an API as soon as possible.
+    Unless it is forced, the refresh is delayed by a little random jitter, so that refreshes from many dashboards do not arrive together.
+    """
+    delay = 0 if force else refresh_policy.jitter(upstream)
+    return schedule_refresh(upstream, time.time() + delay, force)
+
+
+def data_fingerprint(upstream: str) -> tuple:
+    """Returns a value which changes whenever an API has published new data: the latest date of each area, or the newest article."""
+    if upstream == "covid":
+        return tuple(covid_timeseries.latest_date(area_type, location) for location, area_type in covid_data_handler.configured_areas())
+    articles = covid_news_handling.get_articles()
+    return tuple(article.title for article in articles[:1])
+
+
+def _run_refresh(upstream: str, force: bool = False) -> None:
+    """Carries out a refresh of an API, if it could find anything new and the API's rate limits allow it.
+    A refresh the rate limits do not allow is put off until they do, and a failed refresh is tried again after 'RETRY_DELAY' seconds.
+    Either way, the next automatic refresh is queued for just after the API is next expected to publish.
+    A forced refresh (one the user asked for, or a retry while the API is late) always asks the API again, rather than using a cached response,
+    since it is expected to find something published since the last refresh.
+    """
+    with _pending_lock:
+        _pending.pop(upstream, None)
+    now = time.time()
+    if not force and not refresh_policy.should_fetch(upstream, now):
+        metrics.inc("dashboard_refreshes_total", upstream=upstream, outcome="skipped")
+        logging.info("The %s refresh was skipped, since nothing new can have been published since the last one.", upstream)
+        schedule_next_refresh(upstream, now)
+        return
+    cost = len(covid_data_handler.configured_areas()) if upstream == "covid" else 1
+    delay = refresh_policy.acquire(upstream, cost, now)
+    if delay > 0:
+        metrics.inc("dashboard_refreshes_total", upstream=upstream, outcome="deferred")
+        logging.warning("The %s refresh would exceed the API's rate limits, so it has been put off for %.0f seconds.", upstream, delay)
+        schedule_refresh(upstream, now + delay + refresh_policy.jitter(upstream), force)
+        return
+    before = data_fingerprint(upstream)
+    try:
+        REFRESHES[upstream][1](force)
+    except Exception:
+        refresh_ran(upstream)
+        metrics.inc("dashboard_refreshes_total", upstream=upstream, outcome="failed")
+        logging.exception("The %s refresh has failed. It will be retried in %s seconds.", upstream, RETRY_DELAY)
+        schedule_refresh(upstream, time.time() + RETRY_DELAY, force)
+        return
+    refresh_ran(upstream)
+    found_new_data = data_fingerprint(upstream) != before
+    refresh_policy.record_fetch(upstream, found_new_data, now)
+    metrics.inc("dashboard_refreshes_total", upstream=upstream, outcome="new_data" if found_new_data else "unchanged")
+    retry = None if found_new_data else refresh_policy.late_retry(upstream, now)
+    if retry is not None:
+        logging.info("The %s API is late publishing, so it will be refreshed again in %.0f seconds.", upstream, retry - now)
+        schedule_refresh(upstream, retry, force=True)  # Forced, since the last refresh makes it look as if nothing new can be published today
+    else:
+        schedule_next_refresh(upstream, time.time())
+
+
+def schedule_next_refresh(upstream: str, now: float) -> None:
+    """Queues the next automatic refresh of an API, if its policy asks for one."""
+    when = refresh_policy.next_auto_refresh(upstream, now)
+    if when is not None:
+        schedule_refresh(upstream, when)
+
+
+def refresh_now() -> None:
+    """Queues a refresh of all COVID data and the news, to be carried out straight away in the background."""
+    for upstream in REFRESHES:
+        request_refresh(upstream, force=True)
+
+
+def run_due_events() -> bool:
+    """Starts running any events that are due in either scheduler, on the scheduler pool, without waiting for them to finish.
+    Both schedulers are run at the same time, so that due COVID and news refreshes cost one round trip together, and the worker
+    carries on publishing the user's changes while an API is slow. A scheduler which is still running is left until it has finished.
+
+        Returns:
+            started (bool): Whether any events were due.
+    """
+    now = time.time()
+    started = []
+    with _running_lock:
+        for scheduler in (covid_scheduler, news_scheduler):
+            if scheduler not in _running and scheduler.queue and scheduler.queue[0].time <= now:
+                _running[scheduler] = _scheduler_pool.submit(scheduler.run, False)
+                started.append((scheduler, _running[scheduler]))
+    for scheduler, future in started:  # Outside the lock, since a callback runs straight away if its future has already finished
+        future.add_done_callback(functools.partial(_scheduler_finished, scheduler))
+    return len(started) > 0
+
+
+def _scheduler_finished(scheduler, future: concurrent.futures.Future) -> None:
+    """Called on the scheduler pool once a scheduler has finished running its due events, to wake the worker to publish them."""
+    try:
+        future.result()
+    except Exception:
+        # A failed refresh must never take the worker down; the old data keeps being served.
+        logging.exception("A scheduled refresh has failed.")
+    with _running_lock:
+        _running.pop(scheduler, None)
+    _refreshes_finished.set()
+    wake()
+
+
+def _take_finished_refreshes() -> bool:
+    """Returns whether any scheduler has finished running its due events since this was last called."""
+    if not _refreshes_finished.is_set():
+        return False
+    _refreshes_finished.clear()
+    return True
+
+
+def wait_for_refreshes(timeout: float = None) -> None:
+    """Waits for the refreshes which are running on the scheduler pool to finish, for at most 'timeout' seconds."""
+    with _running_lock:
+        futures = list(_running.values())
+    concurrent.futures.wait(futures, timeout)
+
+
+def next_wakeup() -> float:
+    """Returns the number of seconds until the next update or event is due.
+    When the dashboard shares its state with other workers, it also wakes every 'SYNC_INTERVAL' seconds to check for their changes.
+    A worker which is not the leader never runs its schedulers or scheduled updates, so it only wakes to check for changes.
+    """
+    limit = MAX_SLEEP if shared_state.backend is None else min(MAX_SLEEP, shared_state.SYNC_INTERVAL)
+    if not shared_state.is_leader():
+        return limit  # Its past-due events would otherwise wake it straight away, over and over
+    with _running_lock:
+        deadlines = [scheduler.queue[0].time for scheduler in (covid_scheduler, news_scheduler) if scheduler.queue and scheduler not in _running]
+    next_update = update_registry.next_due_time()
+    if next_update is not None:
+        deadlines.append(next_update)
+    if not deadlines:
+        return limit
+    return min(max(min(deadlines) - time.time(), 0), limit)
+
+
+def tick() -> None:
+    """Carries out one pass of the refresh engine, publishing a new snapshot if anything has changed.
+    Only the leader carries out refreshes and scheduled updates; every other worker picks up the leader's data instead.
+    """
+    with metrics.timer("dashboard_refresh_engine_tick_seconds"):
+        synced = shared_state.sync()
+        requested = _take_publish_request()
+        if not shared_state.elect():
+            if synced or requested:
+                publish_snapshot()
+            return
+        due = update_registry.pop_due(time.time())
+        queue_due_updates(due)
+        run_due_events()
+        ran = _take_finished_refreshes()
+        finished = take_finished_updates()
+        finish_due_updates(finished)
+        if ran or due or finished:
+            shared_state.publish_data()  # First, so that the new snapshot is numbered after the publication
+        if ran or due or finished or synced or requested:
+            publish_snapshot()
+        save_if_changed()
+
+
+def _run() -> None:
+    """The main loop of the background worker."""
+    logging.info("The refresh engine has started.")
+    while not _stop_event.is_set():
+        _wake_event.clear()  # Cleared before the pass, so a wake() arriving during it makes the next wait return at once
+        tick()
+        _wake_event.wait(timeout=next_wakeup())
+    logging.info("The refresh engine has stopped.")
+
+
+def wake() -> None:
+    """Wakes the background worker, so that it re-checks the schedulers straight away."""
+    _wake_event.set()
+
+
+def start() -> threading.Thread:
+    """Publishes the initial snapshot and starts the background worker, if it is not already running.
+
+        Returns:
+            worker (threading.Thread): The thread running the refresh engine.
+    """
+    global _worker
+    shared_state.join()
+    publish_snapshot()
+    if _worker is None or not _worker.is_alive():
+        _stop_event.clear()
+        _worker = threading.Thread(target=_run, name="refresh-engine", daemon=True)
+        _worker.start()
+    return _worker
+
+
+def stop() -> None:
+    """Stops the background worker and waits for it to finish."""
+    _stop_event.set()
+    wake()
+    if _worker is not None:
+        _worker.join()
+    wait_for_refreshes()
+    save_if_changed()
+    shared_state.resign()
@@ -0,0 +1,186 @@
+"""
+refresh_policy - This module is the refresh policy module.
+This module is responsible for deciding when each upstream API should be refreshed.
+This includes...
+    - Keeping a token bucket and a daily quota for each API, so that refreshes stay within its rate limits.
+    - Learning what time of day each API publishes new data, from the refreshes which found new data soon after a refresh which did not.
+    - Skipping refreshes which cannot find anything new, because the API has been refreshed since it last published.
+    - Planning automatic refreshes for just after each API is expected to publish, spread out with random jitter.
+    - Refreshing again every few minutes while an API is late publishing, for a limited time, so a late publication is picked up the same day.
+"""
+import math
+import time
+import random
+import threading
+import collections
+
+import settings
+
+
+DAY = 24 * 3600
+DEFAULT_POLICIES = {
+    "covid": {
+        "burst": 10,  # The most requests which can be sent at once
+        "per_second": 0.1,  # The rate at which the bucket refills; the Coronavirus API allows about 10 requests every 100 seconds
+        "daily_quota": None,  # The most requests which can be sent in one (UTC) day, or None for no quota
+        "min_interval": 600,  # Refreshes closer together than this (in seconds) are skipped
+        "fallback_interval": 6 * 3600,  # How often to refresh automatically while the publish time is not known, or None to never do so
+        "settle": 300,  # How long after the expected publish time to refresh, so the new data is complete
+        "late_retries": 12,  # While the API is late publishing, it is refreshed every 'settle' seconds, up to this many times
+        "jitter": 30  # Up to this many seconds are added at random to each refresh
+        },
+    "news": {
+        "burst": 5,
+        "per_second": 1 / 60,
+        "daily_quota": 100,  # The News API allows 100 requests a day on its free plan
+        "min_interval": 300,
+        "fallback_interval": None,  # News is published throughout the day, so it is only refreshed when the user asks
+        "settle": 60,
+        "late_retries": 0,
+        "jitter": 30
+        }
+    }
+MIN_OBSERVATIONS = 3  # How many new publications must be seen before a publish time is trusted
+MIN_CONCENTRATION = 0.9  # How closely the publications must agree on a time of day (1 means exactly), for the publish time to be trusted
+PUBLISH_MARGIN = 3600  # Refreshes within this many seconds before the expected publish time are never skipped
+
+policies = {name: dict(policy, **settings.config_data.get("refresh_policy", {}).get(name, {})) for name, policy in DEFAULT_POLICIES.items()}
+state = {name: {
+    "tokens": float(policy["burst"]),
+    "updated": time.time(),
+    "quota_day": None,
+    "quota_used": 0,
+    "last_fetch": None,
+    "last_found_new_data": False,
+    "last_new_data": None,  # When new data was last found
+    "publish_times": collections.deque(maxlen=14)  # The UTC times of day (in seconds) at which new data was found
+    } for name, policy in policies.items()}
+policy_lock = threading.Lock()
+
+
+def jitter(upstream: str) -> float:
+    """Returns a random delay (in seconds) to add to a refresh, so that refreshes from many dashboards do not arrive together."""
+    return random.uniform(0, policies[upstream]["jitter"])
+
+
+def acquire(upstream: str, cost: int = 1, now: float = None) -> float:
+    """Takes tokens from the bucket and quota of an API, if there are enough.
+
+        Parameters:
+            upstream (str): The name of the API, "covid" or "news".
+            cost (int): The number of requests the refresh is expected to send.
+            now (float): The current time, as a timestamp. Defaults to the time now.
+
+        Returns:
+            delay (float): 0 if the tokens were taken, or else how many seconds to wait before trying again.
+    """
+    now = time.time() if now is None else now
+    policy = policies[upstream]
+    upstream_state = state[upstream]
+    cost = min(cost, policy["burst"])  # A refresh costing more than the burst could otherwise never run
+    with policy_lock:
+        upstream_state["tokens"] = min(policy["burst"], upstream_state["tokens"] + (now - upstream_state["updated"]) * policy["per_second"])
+        upstream_state["updated"] = now
+        if upstream_state["quota_day"] != now // DAY:
+            upstream_state["quota_day"] = now // DAY
+            upstream_state["quota_used"] = 0
+        if policy["daily_quota"] is not None and upstream_state["quota_used"] + cost > policy["daily_quota"]:
+            return DAY - now % DAY  # Wait for the quota to reset at midnight (UTC)
+        if upstream_state["tokens"] < cost:
+            return (cost - upstream_state["tokens"]) / policy["per_second"]
+        upstream_state["tokens"] -= cost
+        upstream_state["quota_used"] += cost
+        return 0
+
+
+def record_fetch(upstream: str, found_new_data: bool, now: float = None) -> None:
+    """Records a successful refresh of an API, and the time of day it found new data, if it did.
+    Once a publish time is trusted, a time is only learned if the previous refresh was at most twice 'settle' seconds before,
+    so that it is known when the data was published. A refresh long after the data was published, such as one the user asked for,
+    would otherwise teach the time of the refresh.
+    """
+    now = time.time() if now is None else now
+    trusted = publish_time(upstream) is not None
+    with policy_lock:
+        upstream_state = state[upstream]
+        last_fetch = upstream_state["last_fetch"]
+        upstream_state["last_fetch"] = now
+        upstream_state["last_found_new_data"] = found_new_data
+        if found_new_data:
+            upstream_state["last_new_data"] = now
+            if not trusted or (last_fetch is not None and now - last_fetch <= 2 * policies[upstream]["settle"]):
+                upstream_state["publish_times"].append(now % DAY)
+
+
+def publish_time(upstream: str) -> float:
+    """Returns the UTC time of day (in seconds) at which an API publishes new data, or None if it does not publish at a regular time.
+    The times of day at which new data was found are averaged around the clock, so that times either side of midnight agree.
+    """
+    with policy_lock:
+        times = list(state[upstream]["publish_times"])
+    if len(times) < MIN_OBSERVATIONS:
+        return None
+    angles = [2 * math.pi * seconds / DAY for seconds in times]
+    x = sum(math.cos(angle) for angle in angles) / len(angles)
+    y = sum(math.sin(angle) for angle in angles) / len(angles)
+    if math.hypot(x, y) < MIN_CONCENTRATION:
+        return None  # The API publishes throughout the day, such as the News API
+    return (math.atan2(y, x) / (2 * math.pi) * DAY) % DAY
+
+
+def expected_publish(upstream: str, after: float) -> float:
+    """Returns when an API is next expected to publish after the given timestamp, or None if it has no regular publish time."""
+    seconds = publish_time(upstream)
+    if seconds is None:
+        return None
+    expected = after - after % DAY + seconds
+    return expected if expected > after else expected + DAY
+
+
+def should_fetch(upstream: str, now: float = None) -> bool:
+    """Returns whether a refresh of an API could find anything new.
+    A refresh is skipped if the API was refreshed very recently, or if it has been refreshed since it last published
+    and is not due to publish again for at least 'PUBLISH_MARGIN' seconds.
+    """
+    now = time.time() if now is None else now
+    last_fetch = state[upstream]["last_fetch"]
+    if last_fetch is None:
+        return True
+    if now - last_fetch < policies[upstream]["min_interval"]:
+        return False
+    if state[upstream]["last_found_new_data"]:
+        last_fetch += PUBLISH_MARGIN  # The last refresh found this publication, even if it came a little before the usual time
+    expected = expected_publish(upstream, last_fetch)
+    return expected is None or now >= expected - PUBLISH_MARGIN
+
+
+def late_retry(upstream: str, now: float = None) -> float:
+    """Returns when an API should be refreshed again after a refresh which found nothing new, as a timestamp, or None if it should not be.
+    While the API is late publishing (nothing new has been found since it was expected to publish), it is refreshed every 'settle' seconds,
+    until 'late_retries' retries after the expected time have passed. Otherwise it would not be refreshed again until the next day.
+    """
+    now = time.time() if now is None else now
+    policy = policies[upstream]
+    expected = expected_publish(upstream, now - DAY)  # The latest time at which it was expected to publish
+    if expected is None:
+        return None
+    last_new_data = state[upstream]["last_new_data"]
+    if last_new_data is not None and last_new_data >= expected - PUBLISH_MARGIN:
+        return None  # This publication has already been found
+    if now >= expected + policy["settle"] * (policy["late_retries"] + 1):
+        return None
+    return now + policy["settle"] + jitter(upstream)
+
+
+def next_auto_refresh(upstream: str, now: float = None) -> float:
+    """Returns when an API should next be refreshed automatically, as a timestamp, or None if it should not be.
+    This is just after it is next expected to publish, or after 'fallback_interval' seconds if it has no regular publish time.
+    """
+    now = time.time() if now is None else now
+    policy = policies[upstream]
+    expected = expected_publish(upstream, now)
+    if expected is not None:
+        return expected + policy["settle"] + jitter(upstream)
+    if policy["fallback_interval"] is None:
+        return None
+    return now + policy["fallback_interval"] + jitter(upstream)
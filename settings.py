@@ -0,0 +1,30 @@
+"""
+settings - This module is the settings module.
+This module is responsible for loading the configuration file once, and sharing it with every other module.
+This includes...
+    - Reading 'config.json', or the file named by the DASHBOARD_CONFIG environment variable, and closing it straight away.
+    - Holding the one parsed configuration, so that importing any number of modules only ever reads the file once.
+    - Deciding whether the start-up of the dashboard should be profiled.
+"""
+import os
+import json
+
+
+CONFIG_FILE = os.environ.get("DASHBOARD_CONFIG", "config.json")
+
+
+def load_config(filename: str = CONFIG_FILE) -> dict:
+    """Reads and parses a configuration file.
+
+        Parameters:
+            filename (str): The path of the configuration file.
+
+        Returns:
+            config_data (dict): The configuration, as parsed from the file.
+    """
+    with open(filename) as config_file:
+        return json.load(config_file)
+
+
+config_data = load_config()
+PROFILE_STARTUP = os.environ.get("DASHBOARD_PROFILE_STARTUP", "") not in ("", "0") or config_data.get("profile_startup", False)
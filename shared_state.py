@@ -0,0 +1,393 @@
+"""
+shared_state - This module is the shared state module.
+This module is responsible for keeping several workers of the dashboard in step with each other.
+This includes...
+    - Storing the shared state in a pluggable backend: an SQLite file in WAL mode for workers on one host, or Redis for workers on several hosts.
+    - Electing a single leader through a renewable lease, so that only one worker contacts the APIs and carries out the scheduled updates.
+    - Recording every change made by a user (adding or cancelling an update, dismissing an article) in an ordered operation log, which the other workers replay.
+    - Publishing the leader's data after each refresh, so that the other workers can serve it without fetching it themselves.
+    - Numbering every change, including each publication of data, in the one operation log, so that workers which have caught up
+      with the same change can give their snapshots the same generation.
+When no backend is configured the dashboard runs as a single process, and this module does nothing.
+"""
+import json
+import uuid
+import time
+import logging
+import sqlite3
+import threading
+
+import covid_news_handling
+import update_registry
+import snapshot_store
+import settings
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+LEASE_NAME = "refresh-leader"
+OPS_KEPT = 1000  # How many operations are kept in the log behind the latest published data
+WORKER_ID = uuid.uuid4().hex  # Identifies this worker, so that it can skip its own operations
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ops (seq INTEGER PRIMARY KEY AUTOINCREMENT, op TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS data (name TEXT PRIMARY KEY, version INTEGER, ops_seq INTEGER, blob BLOB);
+CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT, expires REAL);
+"""
+
+# Each script runs atomically in Redis, so that sequence numbers are never skipped or handed out twice
+REDIS_APPEND_OP = """
+local seq = redis.call('INCR', KEYS[1])
+redis.call('ZADD', KEYS[2], seq, seq .. ':' .. ARGV[1])
+return seq
+"""
+REDIS_PUT_DATA = """
+local seq = redis.call('INCR', KEYS[1])
+redis.call('ZADD', KEYS[2], seq, seq .. ':' .. ARGV[3])
+redis.call('HSET', KEYS[3], 'version', seq, 'ops_seq', ARGV[2], 'blob', ARGV[1])
+return seq
+"""
+REDIS_RENEW_LEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+REDIS_RELEASE_LEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class SQLiteBackend:
+    """Shares state between workers on one host through an SQLite file in WAL mode, so that readers never block the writer."""
+
+    def __init__(self, path: str, busy_timeout: float = 10):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()  # SQLite connections cannot be shared between threads
+        self._connection().executescript(SQLITE_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Returns this thread's connection to the file, opening it if needed."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def append_op(self, op: str) -> int:
+        """Adds an operation to the end of the log, returning its sequence number."""
+        return self._connection().execute("INSERT INTO ops (op) VALUES (?)", (op,)).lastrowid
+
+    def ops_after(self, seq: int) -> list:
+        """Returns every (sequence number, operation) in the log after the given sequence number, oldest first."""
+        return list(self._connection().execute("SELECT seq, op FROM ops WHERE seq > ? ORDER BY seq", (seq,)))
+
+    def trim_ops(self, before_seq: int) -> None:
+        """Removes every operation before the given sequence number from the log."""
+        self._connection().execute("DELETE FROM ops WHERE seq < ?", (before_seq,))
+
+    def put_data(self, blob: bytes, ops_seq: int, op: str) -> int:
+        """Replaces the published data and adds the given operation to the log, returning its sequence number as the data's new version."""
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            version = connection.execute("INSERT INTO ops (op) VALUES (?)", (op,)).lastrowid
+            connection.execute("INSERT OR REPLACE INTO data VALUES ('dashboard', ?, ?, ?)", (version, ops_seq, blob))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return version
+
+    def data_version(self) -> int:
+        """Returns the version of the published data, or 0 if nothing has been published."""
+        row = self._connection().execute("SELECT version FROM data WHERE name = 'dashboard'").fetchone()
+        return row[0] if row else 0
+
+    def get_data(self) -> tuple:
+        """Returns the published data as (version, operation sequence number, blob), or None if nothing has been published."""
+        return self._connection().execute("SELECT version, ops_seq, blob FROM data WHERE name = 'dashboard'").fetchone()
+
+    def acquire_lease(self, name: str, owner: str, seconds: float) -> bool:
+        """Takes or renews a lease, returning whether the given owner now holds it."""
+        connection = self._connection()
+        now = time.time()
+        connection.execute("BEGIN IMMEDIATE")  # Stops two workers from taking an expired lease at the same time
+        try:
+            row = connection.execute("SELECT owner, expires FROM leases WHERE name = ?", (name,)).fetchone()
+            acquired = row is None or row[0] == owner or row[1] <= now
+            if acquired:
+                connection.execute("INSERT OR REPLACE INTO leases VALUES (?, ?, ?)", (name, owner, now + seconds))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return acquired
+
+    def release_lease(self, name: str, owner: str) -> None:
+        """Gives up a lease, if it is held by the given owner."""
+        self._connection().execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+
+class RedisBackend:
+    """Shares state between workers on any number of hosts through Redis.
+    Any client with the interface of redis-py can be passed in, such as one for a Redis-compatible server.
+    """
+
+    def __init__(self, url: str = None, client=None, prefix: str = "covid-dashboard:"):
+        if client is None:
+            if redis is None:
+                raise ImportError("The 'redis' package is needed for the Redis shared state backend. Install it with 'pip install redis'.")
+            client = redis.Redis.from_url(url or "redis://localhost:6379/0")
+        self.client = client
+        self.prefix = prefix
+        self._append_op = client.register_script(REDIS_APPEND_OP)
+        self._put_data = client.register_script(REDIS_PUT_DATA)
+        self._renew_lease = client.register_script(REDIS_RENEW_LEASE)
+        self._release_lease = client.register_script(REDIS_RELEASE_LEASE)
+
+    def append_op(self, op: str) -> int:
+        """Adds an operation to the end of the log, returning its sequence number."""
+        return int(self._append_op(keys=[self.prefix + "ops_seq", self.prefix + "ops"], args=[op]))
+
+    def ops_after(self, seq: int) -> list:
+        """Returns every (sequence number, operation) in the log after the given sequence number, oldest first."""
+        members = self.client.zrangebyscore(self.prefix + "ops", "(" + str(seq), "+inf")
+        ops = []
+        for member in members:
+            if isinstance(member, bytes):
+                member = member.decode()
+            op_seq, op = member.split(":", 1)
+            ops.append((int(op_seq), op))
+        return ops
+
+    def trim_ops(self, before_seq: int) -> None:
+        """Removes every operation before the given sequence number from the log."""
+        self.client.zremrangebyscore(self.prefix + "ops", "-inf", "(" + str(before_seq))
+
+    def put_data(self, blob: bytes, ops_seq: int, op: str) -> int:
+        """Replaces the published data and adds the given operation to the log, returning its sequence number as the data's new version."""
+        return int(self._put_data(keys=[self.prefix + "ops_seq", self.prefix + "ops", self.prefix + "data"], args=[blob, ops_seq, op]))
+
+    def data_version(self) -> int:
+        """Returns the version of the published data, or 0 if nothing has been published."""
+        return int(self.client.hget(self.prefix + "data", "version") or 0)
+
+    def get_data(self) -> tuple:
+        """Returns the published data as (version, operation sequence number, blob), or None if nothing has been published."""
+        version, ops_seq, blob = self.client.hmget(self.prefix + "data", ["version", "ops_seq", "blob"])
+        if version is None:
+            return None
+        return int(version), int(ops_seq), blob
+
+    def acquire_lease(self, name: str, owner: str, seconds: float) -> bool:
+        """Takes or renews a lease, returning whether the given owner now holds it."""
+        key = self.prefix + "lease:" + name
+        if self.client.set(key, owner, nx=True, px=int(seconds * 1000)):
+            return True
+        return bool(self._renew_lease(keys=[key], args=[owner, int(seconds * 1000)]))
+
+    def release_lease(self, name: str, owner: str) -> None:
+        """Gives up a lease, if it is held by the given owner."""
+        self._release_lease(keys=[self.prefix + "lease:" + name], args=[owner])
+
+
+def make_backend(settings: dict):
+    """Creates the shared state backend described by the 'shared_state' section of the config file.
+
+        Parameters:
+            settings (dict): The settings for the backend, such as {"backend": "sqlite", "path": "dashboard_shared.db"}.
+
+        Returns:
+            backend (SQLiteBackend or RedisBackend): The backend, or None if no backend is configured.
+    """
+    if not settings:
+        return None
+    kind = settings.get("backend", "sqlite")
+    if kind == "sqlite":
+        return SQLiteBackend(settings.get("path", "dashboard_shared.db"))
+    if kind == "redis":
+        return RedisBackend(settings.get("url"), prefix=settings.get("prefix", "covid-dashboard:"))
+    raise ValueError("Unknown shared state backend '" + str(kind) + "'.")
+
+
+shared_settings = settings.config_data.get("shared_state") or {}
+LEASE_SECONDS = shared_settings.get("lease_seconds", 30)  # How long the leader keeps its lease without renewing it
+SYNC_INTERVAL = shared_settings.get("sync_interval", 1)  # How often (in seconds) each worker checks for changes by other workers
+backend = make_backend(shared_settings)
+_ops_seq = 0  # The sequence number of the last operation this worker has seen
+_data_version = 0  # The version of the published data this worker last loaded
+_leader = backend is None  # A single process is always its own leader
+
+
+def is_leader() -> bool:
+    """Returns whether this worker is the one which carries out refreshes and scheduled updates."""
+    return _leader
+
+
+def sequence() -> int:
+    """Returns the sequence number of the newest change in the operation log which this worker has caught up with, or 0 without a backend.
+    Workers which have caught up with the same change hold the same state, so it is used to number their snapshots.
+    """
+    return _ops_seq
+
+
+def record_op(kind: str, **fields) -> None:
+    """Records a change made by the user on this worker, so that every other worker makes the same change.
+
+        Parameters:
+            kind (str): The kind of change: "add_update", "cancel_update", "reschedule_update" or "dismiss_article".
+            fields: The details of the change, such as the ID of the update.
+
+        Returns:
+            None
+    """
+    if backend is None:
+        return
+    op = dict(fields, kind=kind, worker=WORKER_ID)
+    try:
+        backend.append_op(json.dumps(op, default=snapshot_store.encode_value))
+    except Exception:
+        logging.exception("Unable to record a '%s' operation in the shared state.", kind)
+
+
+def apply_op(op: dict) -> None:
+    """Makes a change recorded by another worker. Every change can safely be made more than once."""
+    kind = op["kind"]
+    if kind == "add_update":
+        update_registry.add_update(op["item"])
+    elif kind == "cancel_update":
+        update_registry.cancel_update(op["id"])
+    elif kind == "reschedule_update":
+        update_registry.reschedule_update(op["id"], op["time"])
+    elif kind == "dismiss_article":
+        covid_news_handling.remove_article(op["title"], op.get("url"))  # Operations recorded before urls were kept have none
+    else:
+        logging.warning("Ignoring an unknown shared state operation '%s'.", kind)
+
+
+def _apply_ops_after(seq: int) -> bool:
+    """Applies every operation by other workers after the given sequence number, returning whether there were any."""
+    global _ops_seq
+    changed = False
+    for op_seq, text in backend.ops_after(seq):
+        op = json.loads(text, object_hook=snapshot_store.decode_value)
+        if op["worker"] != WORKER_ID and op["kind"] != "publish_data":  # Published data is loaded by 'sync' itself
+            apply_op(op)
+            changed = True
+        _ops_seq = op_seq
+    return changed
+
+
+def join() -> bool:
+    """Brings this worker in line with the shared state when it starts.
+    If other workers have already shared state, it replaces the scheduled updates this worker restored locally.
+    Otherwise, this worker shares the updates it restored, so that the workers which start after it can see them.
+
+        Returns:
+            changed (bool): Whether any shared state was loaded.
+    """
+    global _ops_seq, _data_version
+    if backend is None:
+        return False
+    try:
+        data = backend.get_data()
+        if data is None and not backend.ops_after(0):
+            for item in update_registry.list_updates():
+                record_op("add_update", item=item)
+            return False
+        for item in update_registry.list_updates():
+            update_registry.cancel_update(item["id"])
+        _ops_seq = 0
+        if data is not None:
+            snapshot_store.import_state(data[2])
+            _data_version, _ops_seq = data[0], data[1]
+        _apply_ops_after(_ops_seq)
+        logging.info("Joined the shared state at data version %s and operation %s.", _data_version, _ops_seq)
+        return True
+    except Exception:
+        logging.exception("Unable to join the shared state. This worker will carry on with its own state.")
+        return False
+
+
+def sync() -> bool:
+    """Applies the changes made by other workers since the last sync.
+    Workers other than the leader also load the leader's data, if it has published a newer version.
+
+        Returns:
+            changed (bool): Whether anything has changed.
+    """
+    global _data_version
+    if backend is None:
+        return False
+    try:
+        changed = False
+        if not _leader and backend.data_version() > _data_version:
+            version, ops_seq, blob = backend.get_data()
+            snapshot_store.import_state(blob, include_updates=False)
+            _data_version = version
+            changed = True
+        ops = backend.ops_after(_ops_seq)
+        if ops and ops[0][0] > _ops_seq + 1:
+            return join()  # Operations this worker has not seen were trimmed from the log, so it starts again
+        return _apply_ops_after(_ops_seq) or changed
+    except Exception:
+        logging.exception("Unable to sync with the shared state.")
+        return False
+
+
+def elect() -> bool:
+    """Takes or renews the leader's lease, if no other worker holds it.
+
+        Returns:
+            leader (bool): Whether this worker is now the leader.
+    """
+    global _leader
+    if backend is None:
+        return True
+    try:
+        leader = backend.acquire_lease(LEASE_NAME, WORKER_ID, LEASE_SECONDS)
+    except Exception:
+        logging.exception("Unable to renew the leader's lease.")
+        leader = False
+    if leader != _leader:
+        logging.info("Worker %s is %s.", WORKER_ID, "now the leader" if leader else "no longer the leader")
+    _leader = leader
+    return leader
+
+
+def resign() -> None:
+    """Gives up the leader's lease, so that another worker can take over straight away."""
+    global _leader
+    if backend is None or not _leader:
+        return
+    try:
+        backend.release_lease(LEASE_NAME, WORKER_ID)
+    except Exception:
+        logging.exception("Unable to release the leader's lease.")
+    _leader = False
+
+
+def publish_data() -> None:
+    """Publishes the leader's data for the other workers, and trims operations they no longer need from the log.
+    The publication is itself an operation in the log, and the leader catches up with it, so that its next snapshot is numbered after it.
+    """
+    global _data_version
+    if backend is None or not _leader:
+        return
+    try:
+        op = json.dumps({"kind": "publish_data", "worker": WORKER_ID})
+        _data_version = backend.put_data(snapshot_store.export_state(), _ops_seq, op)
+        _apply_ops_after(_ops_seq)
+        backend.trim_ops(_ops_seq - OPS_KEPT)
+    except Exception:
+        logging.exception("Unable to publish data to the shared state.")
@@ -0,0 +1,209 @@
+"""
+snapshot_store - This module is the persistent snapshot module.
+This module is responsible for saving the state of the dashboard, and restoring it again.
+This includes...
+    - Saving the COVID dictionaries, every area's time series, the news store, the learned publish times and the scheduled updates to an SQLite file.
+    - Loading all of this back at start-up, so that the dashboard can serve straight away without contacting the APIs.
+    - Packing the same state into a single blob, so that it can be shared with other workers.
+"""
+import os
+import json
+import base64
+import sqlite3
+import datetime
+from array import array
+
+import covid_data_handler
+import covid_news_handling
+import covid_timeseries
+import refresh_policy
+import update_registry
+import settings
+
+
+SNAPSHOT_FILE = settings.config_data.get("snapshot_file", "dashboard_snapshot.db")
+SERIES_ARRAYS = ("cases", "cases_mask", "hospital_cases", "hospital_cases_mask", "deaths", "deaths_mask", "cases_7day")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS covid_data (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS series (
+    area_type TEXT, area_name TEXT, area_code TEXT, first_day INTEGER, last_day INTEGER,
+    cases BLOB, cases_mask BLOB, hospital_cases BLOB, hospital_cases_mask BLOB,
+    deaths BLOB, deaths_mask BLOB, cases_7day BLOB,
+    PRIMARY KEY (area_type, area_name));
+CREATE TABLE IF NOT EXISTS articles (position INTEGER PRIMARY KEY, title TEXT, content TEXT, url TEXT, published_at TEXT);
+CREATE TABLE IF NOT EXISTS dismissed (position INTEGER PRIMARY KEY, title TEXT, url TEXT);
+CREATE TABLE IF NOT EXISTS updates (id TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def encode_value(value):
+    """Converts datetimes and binary arrays into values which can be stored as JSON."""
+    if isinstance(value, datetime.datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, bytes):
+        return {"__bytes__": base64.b64encode(value).decode()}
+    raise TypeError("Cannot store " + repr(value))
+
+
+def decode_value(value: dict):
+    """Converts values stored by 'encode_value' back into datetimes and binary arrays."""
+    if "__datetime__" in value:
+        return datetime.datetime.fromisoformat(value["__datetime__"])
+    if "__bytes__" in value:
+        return base64.b64decode(value["__bytes__"])
+    return value
+
+
+def collect_state() -> dict:
+    """Gathers the state of the dashboard into plain rows and values.
+
+        Returns:
+            state (dict): The COVID dictionaries, and rows for the series, articles, dismissed titles and urls, learned publish times and scheduled updates.
+    """
+    with covid_timeseries.store_lock:
+        series_rows = [[series["area_type"], series["area_name"], series["area_code"], series["first_day"], series["last_day"]] +
+                       [bytes(series[name]) for name in SERIES_ARRAYS] for series in covid_timeseries.series_store.values()]
+    with covid_news_handling.news_lock:
+        article_rows = [list(article) for article in covid_news_handling.news_articles.values()]
+        dismissed = [list(item) for item in covid_news_handling.dismissed_titles.items()]
+    with refresh_policy.policy_lock:
+        publish_times = {name: list(upstream_state["publish_times"]) for name, upstream_state in refresh_policy.state.items()}
+    return {
+        "local_covid_data": dict(covid_data_handler.local_covid_data),
+        "national_covid_data": dict(covid_data_handler.national_covid_data),
+        "series": series_rows,
+        "articles": article_rows,
+        "dismissed": dismissed,
+        "publish_times": publish_times,
+        "updates": [{key: value for key, value in item.items() if key != "version"} for item in update_registry.list_updates()]
+        }
+
+
+def restore_state(state: dict, include_updates: bool = True) -> None:
+    """Replaces the state of the dashboard with state gathered by 'collect_state'.
+    Dismissed titles are added to those already known, and articles which have been dismissed are never restored.
+
+        Parameters:
+            state (dict): The state to restore.
+            include_updates (bool): Whether the scheduled updates should be restored as well.
+
+        Returns:
+            None
+    """
+    covid_data_handler.local_covid_data.update(state["local_covid_data"])
+    covid_data_handler.national_covid_data.update(state["national_covid_data"])
+
+    with covid_timeseries.store_lock:
+        for row in state["series"]:
+            series = covid_timeseries.new_series(row[0], row[1])
+            series.update({"area_code": row[2], "first_day": row[3], "last_day": row[4]})
+            for name, blob in zip(SERIES_ARRAYS, row[5:]):
+                if name.endswith("_mask"):
+                    series[name] = bytearray(blob)
+                else:
+                    series[name] = array("q")
+                    series[name].frombytes(blob)
+            covid_timeseries.rebuild_aggregates(series)
+            covid_timeseries.series_store[(row[0], row[1])] = series
+
+    with covid_news_handling.news_lock:
+        for item in state["dismissed"]:
+            title, url = (item, None) if isinstance(item, str) else item  # Older snapshots hold the titles alone
+            covid_news_handling.dismissed_titles[title] = url or covid_news_handling.dismissed_titles.get(title)
+            if url:
+                covid_news_handling.dismissed_urls[url] = title
+        covid_news_handling.news_articles.clear()
+        covid_news_handling.article_urls.clear()
+        for row in state["articles"]:
+            article = covid_news_handling.Article(*row)
+            if article.title in covid_news_handling.dismissed_titles or article.url in covid_news_handling.dismissed_urls:
+                continue
+            covid_news_handling.news_articles[article.title] = article
+            if article.url:
+                covid_news_handling.article_urls[article.url] = article.title
+
+    with refresh_policy.policy_lock:
+        for name, times in state.get("publish_times", {}).items():  # Older snapshot files do not have them
+            if name in refresh_policy.state:
+                refresh_policy.state[name]["publish_times"].clear()
+                refresh_policy.state[name]["publish_times"].extend(times)
+
+    if include_updates:
+        for item in state["updates"]:
+            update_registry.add_update(item)
+
+
+def export_state() -> bytes:
+    """Packs the state of the dashboard into a single JSON blob."""
+    return json.dumps(collect_state(), separators=(",", ":"), default=encode_value).encode()
+
+
+def import_state(blob: bytes, include_updates: bool = True) -> None:
+    """Restores the state of the dashboard from a blob made by 'export_state'."""
+    restore_state(json.loads(blob, object_hook=decode_value), include_updates)
+
+
+def connect(path: str = None) -> sqlite3.Connection:
+    """Opens the snapshot file, creating its tables if they do not exist yet."""
+    connection = sqlite3.connect(path or SNAPSHOT_FILE)
+    connection.executescript(SCHEMA)
+    if "url" not in [column[1] for column in connection.execute("PRAGMA table_info(dismissed)")]:
+        connection.execute("ALTER TABLE dismissed ADD COLUMN url TEXT")  # Snapshot files from before dismissed urls were kept
+    return connection
+
+
+def save_snapshot(path: str = None) -> None:
+    """Saves the current state of the dashboard to the snapshot file, replacing the previous snapshot in one transaction.
+
+        Parameters:
+            path (str): The snapshot file to write to. Defaults to 'SNAPSHOT_FILE'.
+
+        Returns:
+            None
+    """
+    state = collect_state()
+    covid_rows = [("local_covid_data", json.dumps(state["local_covid_data"], default=encode_value)),
+                  ("national_covid_data", json.dumps(state["national_covid_data"], default=encode_value))]
+    connection = connect(path)
+    try:
+        with connection:  # Commits everything together, or nothing if anything fails
+            for table in ("covid_data", "series", "articles", "dismissed", "updates"):
+                connection.execute("DELETE FROM " + table)
+            connection.executemany("INSERT INTO covid_data VALUES (?, ?)", covid_rows)
+            connection.executemany("INSERT INTO series VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", state["series"])
+            connection.executemany("INSERT INTO articles VALUES (?, ?, ?, ?, ?)", [[position] + row for position, row in enumerate(state["articles"])])
+            connection.executemany("INSERT INTO dismissed VALUES (?, ?, ?)", [[position] + item for position, item in enumerate(state["dismissed"])])
+            connection.executemany("INSERT INTO updates VALUES (?, ?)", [(item["id"], json.dumps(item, default=encode_value)) for item in state["updates"]])
+    finally:
+        connection.close()
+
+
+def load_snapshot(path: str = None) -> bool:
+    """Restores the state of the dashboard from the snapshot file.
+
+        Parameters:
+            path (str): The snapshot file to read from. Defaults to 'SNAPSHOT_FILE'.
+
+        Returns:
+            loaded (bool): Whether a snapshot holding COVID data was found and loaded.
+    """
+    if not os.path.exists(path or SNAPSHOT_FILE):
+        return False  # Connecting would create an empty file
+    connection = connect(path)
+    try:
+        covid_rows = dict(connection.execute("SELECT name, value FROM covid_data"))
+        if not covid_rows:
+            return False
+        state = {
+            "local_covid_data": json.loads(covid_rows["local_covid_data"], object_hook=decode_value),
+            "national_covid_data": json.loads(covid_rows["national_covid_data"], object_hook=decode_value),
+            "series": list(connection.execute("SELECT * FROM series")),
+            "articles": list(connection.execute("SELECT title, content, url, published_at FROM articles ORDER BY position")),
+            "dismissed": [list(row) for row in connection.execute("SELECT title, url FROM dismissed ORDER BY position")],
+            "updates": [json.loads(row[0], object_hook=decode_value) for row in connection.execute("SELECT value FROM updates")]
+            }
+    finally:
+        connection.close()
+    restore_state(state)
+    return True
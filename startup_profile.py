@@ -0,0 +1,74 @@
+"""
+startup_profile - This module is the start-up profiling module.
+This module is responsible for measuring where the time goes while the dashboard starts.
+This includes...
+    - Timing the import of every module imported while profiling is on, both with and without the modules it imports in turn.
+    - Timing each named step of the dashboard's initialisation, such as restoring the snapshot file.
+    - Reporting the slowest imports and every step, once the dashboard is ready to serve.
+Profiling is turned on by setting the DASHBOARD_PROFILE_STARTUP environment variable to 1, or "profile_startup" to true in 'config.json'.
+"""
+import sys
+import time
+import builtins
+import threading
+import contextlib
+
+
+REPORTED_IMPORTS = 25  # How many of the slowest imports are reported
+started = time.perf_counter()
+import_times = {}  # Maps module name -> (seconds including the modules it imported, seconds on its own)
+step_times = []  # (step name, seconds), in the order the steps were carried out
+_real_import = builtins.__import__
+_local = threading.local()
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    """Imports a module as 'builtins.__import__' does, timing it if it is being imported for the first time."""
+    if level or name in sys.modules:
+        return _real_import(name, globals, locals, fromlist, level)  # Relative imports are counted towards the module making them
+    stack = _local.__dict__.setdefault("stack", [])
+    stack.append(0.0)
+    start = time.perf_counter()
+    try:
+        return _real_import(name, globals, locals, fromlist, level)
+    finally:
+        elapsed = time.perf_counter() - start
+        children = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        import_times.setdefault(name, (elapsed, elapsed - children))
+
+
+def install() -> None:
+    """Starts timing every import, and restarts the start-up clock."""
+    global started
+    started = time.perf_counter()
+    builtins.__import__ = _timed_import
+
+
+def uninstall() -> None:
+    """Stops timing imports."""
+    builtins.__import__ = _real_import
+
+
+@contextlib.contextmanager
+def step(name: str):
+    """Times a step of the dashboard's initialisation, for example: with startup_profile.step("restore snapshot"): ..."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        step_times.append((name, time.perf_counter() - start))
+
+
+def report() -> str:
+    """Returns a report of the slowest imports and every initialisation step, with times in milliseconds."""
+    lines = ["Start-up took " + format((time.perf_counter() - started) * 1000, ".1f") + " ms.",
+             "Slowest imports (total ms, own ms):"]
+    slowest = sorted(import_times.items(), key=lambda item: item[1][0], reverse=True)[:REPORTED_IMPORTS]
+    for name, (total, own) in slowest:
+        lines.append("  " + name.ljust(32) + format(total * 1000, "9.1f") + format(own * 1000, "9.1f"))
+    lines.append("Initialisation steps (ms):")
+    for name, seconds in step_times:
+        lines.append("  " + name.ljust(32) + format(seconds * 1000, "9.1f"))
+    return "\n".join(lines)
@@ -0,0 +1,196 @@
+import pytest
+import json
+import time
+import threading
+import requests
+from http.server import HTTPServer, ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import api_client
+from api_client import cached_get
+from api_client import fetch_all
+from api_client import response_cache
+from api_client import breakers
+from api_client import UpstreamUnavailable
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers every request with the same JSON body and ETag, honouring If-None-Match."""
+    hits = []
+
+    def do_GET(self):
+        self.hits.append(self.headers.get("If-None-Match"))
+        if self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = json.dumps({"articles": [{"title": "headline"}]}).encode()
+        self.send_response(200)
+        self.send_header("ETag", '"v1"')
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """Answers with '503 Service Unavailable' until 'failures' runs out, and then with a JSON body.
+    The first request is held back for 'first_delay' seconds, and the next 'broken_bodies' responses have a broken chunked body."""
+    hits = []
+    failures = 0
+    first_delay = 0
+    broken_bodies = 0
+
+    def do_GET(self):
+        self.hits.append(time.time())
+        if len(self.hits) == 1:
+            time.sleep(self.first_delay)
+        if FlakyHandler.broken_bodies > 0:
+            FlakyHandler.broken_bodies -= 1
+            self.send_response(200)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            self.wfile.write(b"not a chunk size\r\n")
+            return
+        if FlakyHandler.failures > 0:
+            FlakyHandler.failures -= 1
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = json.dumps({"data": len(self.hits)}).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_url(tmp_path, monkeypatch):
+    """Starts a local stand-in for the APIs and points the on-disk cache at a temporary directory."""
+    monkeypatch.setattr(api_client, "CACHE_DIR", str(tmp_path))
+    response_cache.clear()
+    StubHandler.hits = []
+    server = HTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield "http://127.0.0.1:" + str(server.server_port) + "/"
+    server.shutdown()
+
+
+@pytest.fixture
+def flaky_url(tmp_path, monkeypatch):
+    """Starts a local stand-in for a failing API, with no delay between retries and a fresh circuit breaker."""
+    monkeypatch.setattr(api_client, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(api_client, "RETRY_BASE_DELAY", 0)
+    response_cache.clear()
+    breakers.clear()
+    FlakyHandler.hits = []
+    FlakyHandler.failures = 0
+    FlakyHandler.first_delay = 0
+    FlakyHandler.broken_bodies = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FlakyHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield "http://127.0.0.1:" + str(server.server_port) + "/"
+    server.shutdown()
+    server.server_close()
+    breakers.clear()
+
+
+def test_cached_get_ttl(stub_url):
+    """Checks that a fresh cached response is served without sending another request."""
+    first = cached_get(stub_url, {"q": "covid"}, ttl=60)
+    second = cached_get(stub_url, {"q": "covid"}, ttl=60)
+    assert first["body"] == second["body"]
+    assert len(StubHandler.hits) == 1
+
+
+def test_cached_get_revalidates(stub_url):
+    """Checks that an expired response is revalidated with its ETag, and kept when the API answers 304."""
+    cached_get(stub_url, {"q": "covid"}, ttl=0)
+    entry = cached_get(stub_url, {"q": "covid"}, ttl=0)
+    assert StubHandler.hits == [None, '"v1"']
+    assert entry["body"]["articles"][0]["title"] == "headline"
+
+
+def test_cached_get_from_disk(stub_url):
+    """Checks that a response cached on disk is used after the in-memory cache has been emptied (a warm restart)."""
+    cached_get(stub_url, {"q": "covid"}, ttl=60)
+    response_cache.clear()
+    entry = cached_get(stub_url, {"q": "covid"}, ttl=60)
+    assert entry["body"]["articles"][0]["title"] == "headline"
+    assert len(StubHandler.hits) == 1
+
+
+def test_fetch_all():
+    """Checks that 'fetch_all' returns results in order, and can hand back exceptions instead of raising them."""
+    assert fetch_all([(abs, (-1,)), (abs, (-2,))]) == [1, 2]
+    results = fetch_all([(abs, (-1,)), (int, ("not a number",))], return_exceptions=True)
+    assert results[0] == 1
+    assert isinstance(results[1], ValueError)
+
+
+def test_cached_get_retries(flaky_url):
+    """Checks that a request which fails with '503 Service Unavailable' is retried until it succeeds."""
+    FlakyHandler.failures = 2
+    entry = cached_get(flaky_url, {}, ttl=0)
+    assert entry["body"] == {"data": 3}
+    assert len(FlakyHandler.hits) == 3
+
+
+def test_circuit_breaker(flaky_url, monkeypatch):
+    """Checks that the circuit breaker opens after repeated failures, and that no requests are sent while it is open."""
+    monkeypatch.setattr(api_client, "BREAKER_THRESHOLD", 2)
+    monkeypatch.setattr(api_client, "RETRY_ATTEMPTS", 2)
+    FlakyHandler.failures = 10
+    with pytest.raises(Exception):
+        cached_get(flaky_url, {}, ttl=0)
+    with pytest.raises(UpstreamUnavailable):
+        cached_get(flaky_url, {}, ttl=0)
+    assert len(FlakyHandler.hits) == 2
+
+    monkeypatch.setattr(api_client, "BREAKER_COOLDOWN", 0)
+    FlakyHandler.failures = 0
+    assert cached_get(flaky_url, {}, ttl=0)["status"] == 200  # The trial request succeeds, closing the breaker again
+    assert list(breakers.values())[0]["state"] == "closed"
+
+
+def test_circuit_breaker_broken_body(flaky_url, monkeypatch):
+    """Checks that a trial request which fails in a way that is not retried, such as a broken chunked body, reopens the breaker."""
+    monkeypatch.setattr(api_client, "BREAKER_THRESHOLD", 1)
+    monkeypatch.setattr(api_client, "RETRY_ATTEMPTS", 1)
+    FlakyHandler.failures = 1
+    with pytest.raises(Exception):
+        cached_get(flaky_url, {}, ttl=0)
+    assert list(breakers.values())[0]["state"] == "open"
+
+    monkeypatch.setattr(api_client, "BREAKER_COOLDOWN", 0)
+    FlakyHandler.broken_bodies = 1
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        api_client.send_with_retries(flaky_url, {}, {})
+    assert list(breakers.values())[0]["state"] == "open"  # Not left half-open, which would block every later request
+    assert cached_get(flaky_url, {}, ttl=0)["status"] == 200
+    assert list(breakers.values())[0]["state"] == "closed"
+
+
+def test_cached_get_stale_if_error(flaky_url, monkeypatch):
+    """Checks that the last good response is served, marked as stale, while the API is failing."""
+    monkeypatch.setattr(api_client, "RETRY_ATTEMPTS", 1)
+    cached_get(flaky_url, {"q": "covid"}, ttl=0)
+    FlakyHandler.failures = 1
+    entry = cached_get(flaky_url, {"q": "covid"}, ttl=0)
+    assert entry["body"] == {"data": 1}
+    assert entry["stale"]
+
+
+def test_hedged_request(flaky_url, monkeypatch):
+    """Checks that a second copy of a slow request is sent, and that the first response to arrive is used."""
+    monkeypatch.setattr(api_client, "HEDGE_AFTER", 0.1)
+    FlakyHandler.first_delay = 2
+    start = time.time()
+    entry = cached_get(flaky_url, {}, ttl=0)
+    assert time.time() - start < 1.5
+    assert entry["body"] == {"data": 2}
@@ -4,11 +4,17 @@ import time
 
 from covid_data_handler import parse_csv_data
 from covid_data_handler import process_covid_csv_data
+from covid_data_handler import load_csv_columns
+from covid_data_handler import columns_from_rows
+from covid_data_handler import covid_csv_metrics
+from covid_data_handler import stream_covid_csv_metrics
 from covid_data_handler import covid_API_request
 from covid_data_handler import schedule_covid_updates
 from covid_data_handler import local_covid_data
 from covid_data_handler import national_covid_data
 from covid_data_handler import covid_scheduler
+from covid_timeseries import latest_date
+from benchmarks import fake_upstreams
 
 
 def test_parse_csv_data():
@@ -27,13 +33,77 @@ def test_process_covid_csv_data():
     assert total_deaths == 141_544
 
 
-def test_covid_API_request():
+def test_load_csv_columns():
+    """This test ensures that the 'load_csv_columns' function parses the exemplar CSV file into typed columns, with blank cells masked."""
+    columns = load_csv_columns('nation_2021-10-28.csv')
+    assert len(columns["date"]) == 638
+    assert columns["area_codes"] == ["E92000001"]
+    assert columns["newCasesBySpecimenDate_mask"][0] == 0
+    assert columns["hospitalCases"][0] == 7_019
+    assert covid_csv_metrics(columns) == (240_299, 7_019, 141_544)
+    assert columns == columns_from_rows(parse_csv_data('nation_2021-10-28.csv'))  # The same columns as the csv module gives, row by row
+
+
+def test_process_covid_csv_data_blank_cells(tmp_path):
+    """This test ensures that the metrics do not depend on where the blank cells fall in the file."""
+    rows = ["areaCode,areaName,areaType,date,cumDailyNsoDeathsByDeathDate,hospitalCases,newCasesBySpecimenDate"]
+    for day in range(20):
+        deaths = str(1000 - day) if day >= 3 else ""
+        hospital = str(50 - day) if day >= 2 else ""
+        rows.append("E1,Area,nation," + str(28 - day).zfill(2) + "/10/2021," + deaths + "," + hospital + "," + str(day + 1))
+    csv_file = tmp_path / "nation_blank_cells.csv"
+    csv_file.write_text("\n".join(rows) + "\n")
+    assert process_covid_csv_data(parse_csv_data(str(csv_file))) == (2 + 3 + 4 + 5 + 6 + 7 + 8, 48, 997)
+
+
+def test_process_covid_csv_data_stops_early():
+    """This test ensures that the 'process_covid_csv_data' function stops reading once it has found every value it needs."""
+    data = parse_csv_data('nation_2021-10-28.csv')
+    data.append(["E92000001", "England", "nation", "not a date", "not a number", "not a number", "not a number"])
+    assert process_covid_csv_data(data) == (240_299, 7_019, 141_544)
+
+
+def test_load_csv_columns_quoted(tmp_path):
+    """This test ensures that the 'load_csv_columns' function reads files with quoted cells and blank lines the same way as the csv module."""
+    rows = ["areaCode,areaName,areaType,date,cumDailyNsoDeathsByDeathDate,hospitalCases,newCasesBySpecimenDate"]
+    for day in range(10):
+        rows.append('E2,"Bristol, City of",ltla,' + str(28 - day).zfill(2) + "/10/2021,," + str(day + 1) + "," + (str(day * 10) if day else ""))
+    csv_file = tmp_path / "ltla_quoted.csv"
+    csv_file.write_text("\n".join(rows[:5]) + "\n\n" + "\n".join(rows[5:]) + "\n")
+    columns = load_csv_columns(str(csv_file))
+    assert columns["area_names"] == ["Bristol, City of"]
+    assert len(columns["date"]) == 10
+    assert covid_csv_metrics(columns) == (20 + 30 + 40 + 50 + 60 + 70 + 80, 1, 0)
+
+
+def test_stream_covid_csv_metrics():
+    """This test ensures that streaming the exemplar CSV file gives the same metrics as processing it in full."""
+    metrics = stream_covid_csv_metrics('nation_2021-10-28.csv')
+    assert metrics == {"E92000001": (240_299, 7_019, 141_544)}
+
+
+def test_covid_API_request(fake_apis):
     """This test ensures that the 'covid_API_request' function returns a dictionary."""
     data = covid_API_request()
     assert isinstance(data, dict)
 
 
-def test_schedule_covid_updates():
+def test_covid_API_request_revalidate(fake_apis):
+    """This test ensures that a cached response hides a newly published day, and that a revalidating request, such as a retry while the API is late, sees it."""
+    covid_API_request("Testland", "nation")
+    covid_API_request("Testland", "nation")  # Once the area is held, the request asks for the recent days only, and is cached
+    published = latest_date("nation", "Testland")
+    fake_upstreams.advance_day()
+    try:
+        covid_API_request("Testland", "nation")
+        assert latest_date("nation", "Testland") == published
+        covid_API_request("Testland", "nation", revalidate=True)
+        assert latest_date("nation", "Testland") == (datetime.date.fromisoformat(published) + datetime.timedelta(days=1)).isoformat()
+    finally:
+        fake_upstreams.advance_day(-1)
+
+
+def test_schedule_covid_updates(fake_apis):
     """This test ensures that the 'schedule_covid_updates' function works correctly,
     by ensuring that it updates the data according to the specified time.
     """
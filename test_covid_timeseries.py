@@ -0,0 +1,101 @@
+import pytest
+import datetime
+
+from covid_timeseries import merge_records
+from covid_timeseries import get_stats
+from covid_timeseries import get_trends
+from covid_timeseries import get_value
+from covid_timeseries import series_store
+
+
+def make_records(area, first_day, last_day, cases=100):
+    """Builds API-style records for every day of October 2021 between the two given days, newest first."""
+    return [{
+        "date": "2021-10-" + str(day).zfill(2),
+        "areaName": area,
+        "areaCode": "E0",
+        "newCasesBySpecimenDate": cases,
+        "hospitalCases": day,
+        "cumDailyNsoDeathsByDeathDate": 1000 + day if day <= last_day - 3 else None
+        } for day in range(last_day, first_day - 1, -1)]
+
+
+def test_merge_records():
+    """Checks that merging records works out the 7-day sum (skipping the latest day) and the latest non-blank values."""
+    stats = merge_records("ltla", "Test Town", make_records("Test Town", 1, 20))
+    assert stats["7day_infections"] == 700
+    assert stats["hospital_cases"] == 20
+    assert stats["deaths_total"] == 1017
+    assert stats["deaths_date"] == "2021-10-17"
+    assert get_stats("ltla", "Test Town") is stats
+
+
+def test_merge_records_incremental():
+    """Checks that new days are appended to an existing series, and that revised days are overwritten."""
+    merge_records("ltla", "Test City", make_records("Test City", 1, 20))
+    stats = merge_records("ltla", "Test City", make_records("Test City", 19, 22, cases=200))
+    assert len(series_store[("ltla", "Test City")]["cases"]) == 22
+    assert get_value("ltla", "Test City", "cases", "2021-10-18") == 100
+    assert get_value("ltla", "Test City", "cases", "2021-10-19") == 200
+    assert stats["7day_infections"] == 4 * 100 + 3 * 200
+    assert stats["hospital_cases"] == 22
+
+
+def test_merge_records_areas():
+    """Checks that each area keeps its own series, and that days without a value are reported as missing."""
+    merge_records("utla", "Area A", make_records("Area A", 1, 10))
+    merge_records("utla", "Area B", [{"date": "2021-10-05", "areaName": "Area B", "newCasesBySpecimenDate": 5}])
+    assert get_stats("utla", "Area A")["7day_infections"] == 700
+    assert get_stats("utla", "Area B")["hospital_cases"] is None
+    assert get_value("utla", "Area B", "cases", "2021-10-04") is None
+    assert get_value("utla", "Area C", "cases", "2021-10-05") is None
+
+
+def test_rolling_sum_incremental():
+    """Checks that the rolling 7-day sum kept up to date by each merge matches one worked out from scratch."""
+    merge_records("nation", "Test Nation", make_records("Test Nation", 1, 15))
+    merge_records("nation", "Test Nation", [{"date": "2021-10-10", "newCasesBySpecimenDate": 400}])
+    merge_records("nation", "Test Nation", make_records("Test Nation", 14, 25, cases=50))
+    series = series_store[("nation", "Test Nation")]
+    cases = series["cases"]
+    assert list(series["cases_7day"]) == [sum(cases[max(i - 6, 0):i + 1]) for i in range(len(cases))]
+
+
+def test_weekly_buckets():
+    """Checks that the weekly buckets hold the weekly sum of cases, the average hospital cases and the latest cumulative deaths."""
+    merge_records("ltla", "Weekly Town", make_records("Weekly Town", 4, 17))  # Monday 4th to Sunday 17th October 2021
+    series = series_store[("ltla", "Weekly Town")]
+    assert list(series["cases_weekly"]) == [700, 700]
+    assert list(series["hospital_cases_weekly"]) == [7, 14]
+    assert list(series["deaths_weekly"]) == [1010, 1014]
+
+
+def test_weekly_buckets_incremental():
+    """Checks that the weekly buckets kept up to date by later merges match those built from scratch."""
+    merge_records("ltla", "Trend Town", make_records("Trend Town", 1, 12))
+    merge_records("ltla", "Trend Town", make_records("Trend Town", 10, 31, cases=50))
+    merge_records("ltla", "Scratch Town", make_records("Scratch Town", 10, 31, cases=50) + make_records("Scratch Town", 1, 12)[3:])  # The same days, merged at once
+    incremental = series_store[("ltla", "Trend Town")]
+    scratch = series_store[("ltla", "Scratch Town")]
+    for metric in ("cases", "hospital_cases", "deaths"):
+        assert incremental[metric + "_weekly"] == scratch[metric + "_weekly"]
+        assert incremental[metric + "_weekly_mask"] == scratch[metric + "_weekly_mask"]
+
+
+def test_trends():
+    """Checks that each trend covers its range in days or weeks, so its size does not grow with the history."""
+    records = [{"date": (datetime.date(2021, 10, 31) - datetime.timedelta(days=offset)).isoformat(), "newCasesBySpecimenDate": offset}
+               for offset in range(1000)]
+    merge_records("nation", "Trend Nation", records)
+    trends = get_trends("nation", "Trend Nation")
+    assert len(trends[30]["labels"]) == 30
+    assert trends[30]["labels"][-1] == "2021-10-31"
+    assert trends[30]["cases"][-1] == 0
+    assert trends[90]["period"] == "week"
+    first_day = datetime.date(2021, 10, 31) - datetime.timedelta(days=89)
+    assert len(trends[90]["cases"]) == 13  # The 90 days from Tuesday 3rd August touch 13 weeks
+    assert trends[90]["labels"][0] == (first_day - datetime.timedelta(days=first_day.weekday())).isoformat() == "2021-08-02"
+    assert len(trends[365]["cases"]) == 53
+    assert trends[365]["labels"][0] == "2020-10-26"  # The Monday of the week holding the first of the 365 days
+    assert trends[365]["labels"][-1] == "2021-10-25"  # The Monday of the last week
+    assert trends[365]["hospital_cases"][-1] is None
@@ -0,0 +1,81 @@
+import pytest
+import csv
+
+from csv_archive import ingest
+from csv_archive import open_archive
+from csv_archive import close_archive
+from csv_archive import area_columns
+from csv_archive import archive_metrics
+from covid_data_handler import parse_csv_data
+from covid_data_handler import process_covid_csv_data
+
+HEADER = ["areaCode", "areaName", "areaType", "date", "cumDailyNsoDeathsByDeathDate", "hospitalCases", "newCasesBySpecimenDate"]
+
+
+def write_dump(path, rows):
+    """Writes a CSV dump in the 'nation_*.csv' format."""
+    with open(path, "w", newline="") as dump:
+        csv.writer(dump).writerows([HEADER] + rows)
+
+
+def test_ingest(tmp_path):
+    """Checks that the metrics worked out from the archive match those worked out from the CSV file it was loaded from."""
+    archive_file = str(tmp_path / "archive.col")
+    assert ingest(["nation_2021-10-28.csv"], archive_file, workers=2) == len(parse_csv_data("nation_2021-10-28.csv")) - 1
+    archive = open_archive(archive_file)
+    assert archive_metrics(archive) == {"E92000001": process_covid_csv_data(parse_csv_data("nation_2021-10-28.csv"))}
+    close_archive(archive)
+
+
+def test_ingest_dedupes(tmp_path):
+    """Checks that each area and date is only held once, that newer dumps replace older figures, and that dumps can be added later."""
+    write_dump(tmp_path / "nation_2021-10-01.csv", [
+        ["E1", "Area 1", "ltla", "01/10/2021", "", "10", "100"],
+        ["E1", "Area 1", "ltla", "30/09/2021", "5", "11", "110"]
+        ])
+    write_dump(tmp_path / "nation_2021-10-02.csv", [
+        ["E1", "Area 1", "ltla", "02/10/2021", "", "12", ""],
+        ["E1", "Area 1", "ltla", "01/10/2021", "6", "10", "105"],
+        ["E2", "Area 2", "ltla", "01/10/2021", "", "3", "30"]
+        ])
+    archive_file = str(tmp_path / "archive.col")
+    assert ingest([str(tmp_path)], archive_file, workers=2) == 4
+    archive = open_archive(archive_file)
+    columns = area_columns(archive, "E1")
+    assert list(columns["date"]) == sorted(columns["date"], reverse=True)
+    assert list(columns["newCasesBySpecimenDate"]) == [0, 105, 110]
+    assert list(columns["newCasesBySpecimenDate_mask"]) == [0, 1, 1]
+    assert archive_metrics(archive, "E1") == {"E1": (110, 12, 6)}
+    del columns
+    close_archive(archive)
+
+    extra = tmp_path / "extra"
+    extra.mkdir()
+    write_dump(extra / "nation_2021-10-03.csv", [["E2", "Area 2", "ltla", "02/10/2021", "", "4", "40"]])
+    assert ingest([str(extra)], archive_file) == 5
+    archive = open_archive(archive_file)
+    assert archive["area_names"] == ["Area 1", "Area 2"]
+    assert archive_metrics(archive, "E2") == {"E2": (30, 4, 0)}
+    close_archive(archive)
+
+
+def test_ingest_keeps_newest_dump(tmp_path):
+    """Checks that an older dump added after a newer one does not replace the newer dump's figures."""
+    write_dump(tmp_path / "nation_2021-10-02.csv", [
+        ["E1", "Area 1", "ltla", "02/10/2021", "", "12", ""],
+        ["E1", "Area 1", "ltla", "01/10/2021", "6", "10", "105"]
+        ])
+    write_dump(tmp_path / "nation_2021-10-01.csv", [
+        ["E1", "Area 1", "ltla", "01/10/2021", "", "10", "100"],
+        ["E1", "Area 1", "ltla", "30/09/2021", "5", "11", "110"]
+        ])
+    archive_file = str(tmp_path / "archive.col")
+    assert ingest([str(tmp_path / "nation_2021-10-02.csv")], archive_file) == 2
+    assert ingest([str(tmp_path / "nation_2021-10-01.csv")], archive_file) == 3
+    archive = open_archive(archive_file)
+    columns = area_columns(archive, "E1")
+    assert list(columns["newCasesBySpecimenDate"]) == [0, 105, 110]
+    assert list(columns["cumDailyNsoDeathsByDeathDate_mask"]) == [0, 1, 1]
+    assert archive_metrics(archive, "E1") == {"E1": (110, 12, 6)}
+    del columns
+    close_archive(archive)
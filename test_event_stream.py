@@ -0,0 +1,61 @@
+import pytest
+
+import event_stream
+from event_stream import publish
+from event_stream import stream
+from event_stream import events_after
+from event_stream import open_stream
+from event_stream import close_stream
+from event_stream import HISTORY_LENGTH
+from event_stream import EVENTS_PER_GENERATION
+
+
+def test_publish():
+    """Checks that published events are numbered in order, from their generation, and kept in the history."""
+    first_id = publish("test", {"generation": 1})
+    second_id = publish("test", {"generation": 2})
+    assert second_id > first_id
+    assert publish("articles", {"generation": 1000}) == 1000 * EVENTS_PER_GENERATION + 1
+    assert publish("stats", {"generation": 999}) > 1000 * EVENTS_PER_GENERATION  # IDs never go backwards
+    assert [event[0] for event in events_after(first_id - 1)][:2] == [first_id, second_id]
+
+
+def test_stream_reconnect():
+    """Checks that a reconnecting browser is sent the events it missed, in the Server-Sent Events format."""
+    event_id = publish("stats", {"generation": 5, "local_7day_infections": 100})
+    messages = stream(event_id - 1)
+    assert next(messages) == b"retry: 5000\n\n"
+    message = next(messages).decode()
+    assert message.startswith("id: " + str(event_id) + "\nevent: stats\n")
+    assert '"local_7day_infections":100' in message
+
+
+def test_stream_generation():
+    """Checks that a new browser is sent every change made after the generation of the page it was given."""
+    publish("updates", {"generation": 1000})
+    event_id = publish("articles", {"generation": 1001})
+    messages = stream(generation=1000)
+    next(messages)
+    assert next(messages).decode().startswith("id: " + str(event_id) + "\nevent: articles\n")
+
+
+def test_events_after_reset():
+    """Checks that a browser which has missed more events than the history holds is sent a single "reset" event instead."""
+    first_id = publish("test", {"generation": 1})
+    for generation in range(HISTORY_LENGTH):
+        last_id = publish("test", {"generation": generation + 2})
+    events = events_after(first_id - 1)
+    assert len(events) == 1
+    assert events[0][2].decode().startswith("id: " + str(last_id) + "\nevent: reset\n")
+    assert events_after(events[0][0]) == []
+    assert events_after(last_id + 1) == events  # An ID from another run of the dashboard
+
+
+def test_open_stream(monkeypatch):
+    """Checks that no more than 'MAX_STREAMS' streams can be open at once."""
+    monkeypatch.setattr(event_stream, "MAX_STREAMS", 1)
+    assert open_stream()
+    assert not open_stream()
+    close_stream()
+    assert open_stream()
+    close_stream()
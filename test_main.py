@@ -0,0 +1,111 @@
+import pytest
+import gzip
+import json
+import datetime
+import collections
+
+import main
+import refresh_engine
+import covid_data_handler
+import covid_news_handling
+
+
+@pytest.fixture
+def client(fake_apis, monkeypatch):
+    """Fills the dashboard with data from the stand-in APIs, publishes it, and returns a test client for the Flask app.
+    Dismissed articles are kept apart from the other tests."""
+    monkeypatch.setattr(covid_news_handling, "dismissed_titles", collections.OrderedDict())
+    monkeypatch.setattr(covid_news_handling, "dismissed_urls", {})
+    covid_data_handler.update_covid_data(covid_data_handler.covid_API_request)
+    covid_news_handling.news_API_request()
+    refresh_engine.publish_snapshot()
+    return main.app.test_client()
+
+
+def test_index(client):
+    """Checks that the dashboard is rendered from the published snapshot, and that a form sent to '/index' renders it too."""
+    response = client.get("/")
+    assert response.status_code == 200
+    assert response.mimetype == "text/html"
+    assert refresh_engine.get_snapshot()["local_covid_data"]["location"] in response.get_data(as_text=True)
+    assert client.get("/index").status_code == 200
+
+
+def test_api_stats(client):
+    """Checks that '/api/stats' returns the statistics of the published snapshot, and answers a matching ETag with '304 Not Modified'."""
+    response = client.get("/api/stats")
+    assert response.status_code == 200
+    stats = response.get_json()
+    assert stats["generation"] == refresh_engine.get_snapshot()["generation"]
+    assert stats["local"]["location"] == covid_data_handler.config_data["local_location"]
+    assert len(stats["areas"]) == len(covid_data_handler.configured_areas())
+    assert client.get("/api/stats", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+    refresh_engine.publish_snapshot()
+    assert client.get("/api/stats", headers={"If-None-Match": response.headers["ETag"]}).status_code == 200  # A new generation has a new ETag
+
+
+def test_api_gzip(client):
+    """Checks that output is gzipped for clients which accept it, under its own ETag, and sent as it is to clients which do not."""
+    plain = client.get("/api/articles")
+    compressed = client.get("/api/articles", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in plain.headers
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert compressed.headers["Vary"] == "Accept-Encoding"
+    assert json.loads(gzip.decompress(compressed.get_data())) == plain.get_json()
+    assert compressed.headers["ETag"] != plain.headers["ETag"]
+    assert len(plain.get_json()["articles"]) > 0
+
+
+def test_api_trends(client):
+    """Checks that '/api/trends' returns the trend of the local area, and a 404 for a range or area it does not hold."""
+    response = client.get("/api/trends?days=30")
+    assert response.status_code == 200
+    assert len(response.get_json()["labels"]) == 30
+    assert client.get("/api/trends?days=7").status_code == 404
+    assert client.get("/api/trends?area_type=ltla&area_name=Nowhere").status_code == 404
+
+
+def test_api_add_and_cancel_update(client):
+    """Checks that an update is added by POST '/api/updates', shown by GET '/api/updates' once published, and cancelled by DELETE."""
+    response = client.post("/api/updates", json={"title": "Morning", "time": "08:00", "covid-data": True, "news": False, "repeat": True})
+    assert response.status_code == 202
+    update_id = response.get_json()["id"]
+    refresh_engine.publish_snapshot()
+    updates = client.get("/api/updates").get_json()["updates"]
+    assert [item["title"] for item in updates if item["id"] == update_id] == ["Morning"]
+    assert client.delete("/api/updates/" + update_id).status_code == 202
+    assert client.delete("/api/updates/" + update_id).status_code == 404
+    refresh_engine.publish_snapshot()
+    assert update_id not in [item["id"] for item in client.get("/api/updates").get_json()["updates"]]
+
+
+def test_api_add_update_invalid(client):
+    """Checks that POST '/api/updates' answers an update without a title, with an invalid time or which refreshes nothing with a 400."""
+    assert client.post("/api/updates", json={"time": "08:00", "covid-data": True}).status_code == 400
+    assert client.post("/api/updates", data="not json").status_code == 400
+    for update_time in ("25:00", "08:00x", "ab:cd", ""):
+        assert client.post("/api/updates", json={"title": "Bad", "time": update_time, "covid-data": True}).status_code == 400
+    assert client.post("/api/updates", json={"title": "Nothing", "time": "08:00"}).status_code == 400
+
+
+def test_api_dismiss_article(client):
+    """Checks that POST '/api/articles/dismiss' removes an article, which is gone from '/api/articles' once published."""
+    title = client.get("/api/articles").get_json()["articles"][0]["title"]
+    response = client.post("/api/articles/dismiss", json={"title": title})
+    assert response.status_code == 202
+    assert response.get_json()["found"]
+    assert not client.post("/api/articles/dismiss", json={"title": title}).get_json()["found"]
+    assert client.post("/api/articles/dismiss", json={}).status_code == 400
+    refresh_engine.publish_snapshot()
+    assert title not in [article["title"] for article in client.get("/api/articles").get_json()["articles"]]
+
+
+def test_make_update():
+    """Checks that 'make_update' schedules an update for the next time the chosen time of day comes round, and rejects one which refreshes nothing."""
+    now = datetime.datetime.now()
+    for minutes in (-2, 2):
+        chosen = now + datetime.timedelta(minutes=minutes)
+        item = main.make_update("Test", chosen.strftime("%H:%M"), True, False, False)
+        assert now < item["time"] <= now + datetime.timedelta(days=1)
+        assert item["time"].strftime("%H:%M") == chosen.strftime("%H:%M")
+    assert main.make_update("Nothing", "08:00", False, False, False) is None
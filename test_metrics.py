@@ -0,0 +1,44 @@
+import pytest
+
+import metrics
+from metrics import inc
+from metrics import observe
+from metrics import timer
+from metrics import register_gauge
+from metrics import render
+
+
+def test_counter():
+    """Checks that a counter adds up separately for each set of labels, in any order."""
+    inc("test_requests_total", api="covid", result="hit")
+    inc("test_requests_total", result="hit", api="covid")
+    inc("test_requests_total", api="news", result="miss")
+    text = render()
+    assert 'test_requests_total{api="covid",result="hit"} 2.0' in text
+    assert 'test_requests_total{api="news",result="miss"} 1.0' in text
+
+
+def test_histogram():
+    """Checks that a histogram gives cumulative bucket counts, along with the sum and count of every value recorded."""
+    observe("test_latency_seconds", 0.003)
+    observe("test_latency_seconds", 0.2)
+    observe("test_latency_seconds", 100)
+    with timer("test_latency_seconds"):
+        pass
+    text = render()
+    assert 'test_latency_seconds_bucket{le="0.005"} 2' in text
+    assert 'test_latency_seconds_bucket{le="0.25"} 3' in text
+    assert 'test_latency_seconds_bucket{le="30.0"} 3' in text
+    assert 'test_latency_seconds_bucket{le="+Inf"} 4' in text
+    assert "test_latency_seconds_count 4" in text
+
+
+def test_gauge():
+    """Checks that a gauge is read when the metrics are rendered, with its help text and type."""
+    depth = [3]
+    register_gauge("test_queue_depth", "Events waiting.", lambda: {(("scheduler", "covid"),): depth[0]})
+    depth[0] = 5
+    text = render()
+    assert "# HELP test_queue_depth Events waiting." in text
+    assert "# TYPE test_queue_depth gauge" in text
+    assert 'test_queue_depth{scheduler="covid"} 5.0' in text
@@ -3,24 +3,56 @@ import datetime
 
 from covid_news_handling import news_API_request
 from covid_news_handling import update_news
-from covid_news_handling import news_data
+from covid_news_handling import news_status
 from covid_news_handling import news_scheduler
+from covid_news_handling import update_news_store
+from covid_news_handling import remove_article
+from covid_news_handling import get_articles
+from covid_news_handling import MAX_ARTICLES
 
 
-def test_news_API_request():
+def test_news_API_request(fake_apis):
     """Checks that the 'news_API_request' function is using the correct arguments and hence searching for the correct articles."""
     assert news_API_request()
     assert news_API_request('Covid COVID-19 coronavirus') == news_API_request()
 
 
-def test_update_news():
+def test_update_news(fake_apis):
     """Checks that the 'update_news' function updates the news articles at the specified time,
-    by checking if the length of the news data has incremened by 1 after the update has taken place.
+    by checking that the time of the last news update matches the time the update was scheduled for.
     """
-    length = len(news_data)
     now = datetime.datetime.now()
     update_interval = now + datetime.timedelta(seconds=1)
     update_news(update_interval, news_API_request)
     news_scheduler.run(blocking=True)
-    assert len(news_data) == length + 1
-    
+    assert news_status["last_update"].timestamp() - update_interval.timestamp() < 0.5
+
+
+def test_update_news_store():
+    """Checks that the news store skips duplicate articles and never grows beyond its limit."""
+    articles = [{"title": "Story " + str(i), "content": "", "url": "https://example.com/" + str(i)} for i in range(MAX_ARTICLES + 10)]
+    update_news_store(articles)
+    update_news_store(articles)
+    update_news_store([{"title": "Story 0 (updated)", "content": "", "url": "https://example.com/0"}])
+    titles = [article.title for article in get_articles()]
+    assert len(titles) == MAX_ARTICLES
+    assert len(set(titles)) == len(titles)
+    assert titles[0] == "Story 0"
+    assert "Story 0 (updated)" not in titles
+
+
+def test_remove_article():
+    """Checks that a removed article is not added back to the news store by later updates."""
+    article = {"title": "Dismissed story", "content": "", "url": "https://example.com/dismissed"}
+    update_news_store([article])
+    assert remove_article("Dismissed story")
+    update_news_store([article])
+    assert "Dismissed story" not in [article.title for article in get_articles()]
+
+
+def test_remove_article_by_url():
+    """Checks that a removed article is not added back to the news store under a new title."""
+    update_news_store([{"title": "Dismissed by url", "content": "", "url": "https://example.com/dismissed-by-url"}])
+    assert remove_article("Dismissed by url")
+    update_news_store([{"title": "Dismissed by url (updated)", "content": "", "url": "https://example.com/dismissed-by-url"}])
+    assert "Dismissed by url (updated)" not in [article.title for article in get_articles()]
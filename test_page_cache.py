@@ -0,0 +1,21 @@
+import pytest
+
+from page_cache import get_or_build
+from page_cache import make_etag
+
+
+def test_get_or_build():
+    """Checks that output is only built once for each generation, and rebuilt once the generation changes."""
+    builds = []
+    build = lambda: builds.append(1) or b"page " + str(len(builds)).encode()
+    assert get_or_build("test page", 1, build) == b"page 1"
+    assert get_or_build("test page", 1, build) == b"page 1"
+    assert get_or_build("test page", 2, build) == b"page 2"
+    assert len(builds) == 2
+
+
+def test_make_etag():
+    """Checks that each name and generation is given its own ETag."""
+    assert make_etag("index", 1) == make_etag("index", 1)
+    assert make_etag("index", 1) != make_etag("index", 2)
+    assert make_etag("index", 1) != make_etag("stats", 1)
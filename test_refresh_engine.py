@@ -0,0 +1,147 @@
+import pytest
+import datetime
+import threading
+import concurrent.futures
+
+import refresh_engine
+import refresh_policy
+import shared_state
+from refresh_engine import add_update
+from refresh_engine import cancel_update
+from refresh_engine import request_refresh
+from refresh_engine import get_snapshot
+from refresh_engine import publish_snapshot
+from refresh_engine import covid_scheduler
+from refresh_engine import news_scheduler
+from update_registry import get_update
+
+
+def make_update(title, time, repeat=False):
+    """Builds an update in the same format as the Flask app."""
+    return {
+        "title": title,
+        "content": "",
+        "time": time,
+        "covid-data": True,
+        "news": True,
+        "repeat": repeat,
+        "complete": False,
+        "cancelled": False
+        }
+
+
+def test_add_update():
+    """Checks that an added update is published in the next snapshot, without queueing anything until it is due."""
+    covid_length = len(covid_scheduler.queue)
+    news_length = len(news_scheduler.queue)
+    update_id = add_update(make_update("test add", datetime.datetime.now() + datetime.timedelta(days=1)))
+    assert len(covid_scheduler.queue) == covid_length
+    assert len(news_scheduler.queue) == news_length
+    publish_snapshot()
+    assert update_id in [item["id"] for item in get_snapshot()["updates"]]
+    cancel_update(update_id)
+
+
+def test_cancel_update():
+    """Checks that cancelling an update removes it from the next snapshot, and that it can only be cancelled once."""
+    update_id = add_update(make_update("test cancel", datetime.datetime.now() + datetime.timedelta(days=1), repeat=True))
+    assert cancel_update(update_id)
+    publish_snapshot()
+    assert update_id not in [item["id"] for item in get_snapshot()["updates"]]
+    assert not cancel_update(update_id)
+
+
+def test_request_refresh():
+    """Checks that refreshes of the same API asked for together are merged into one queued event."""
+    first = request_refresh("news")
+    second = request_refresh("news")
+    assert second is first
+    assert len([event for event in news_scheduler.queue if event.action.__name__ == "_run_refresh"]) == 1
+    news_scheduler.cancel(first)
+
+
+def test_publish_during_refresh(monkeypatch):
+    """Checks that a change made while a refresh is still running is published straight away, rather than once the refresh has finished."""
+    release = threading.Event()
+    finished = []
+    monkeypatch.setitem(refresh_engine.REFRESHES, "news", (news_scheduler, lambda revalidate: finished.append(release.wait(5))))
+    monkeypatch.setattr(refresh_engine, "save_if_changed", lambda: None)
+    monkeypatch.setattr(refresh_policy, "acquire", lambda upstream, cost=1, now=None: 0)
+    monkeypatch.setattr(refresh_policy, "record_fetch", lambda upstream, found_new_data, now=None: None)
+    request_refresh("news", force=True)
+    refresh_engine.tick()  # Starts the refresh, which hangs until it is released
+    update_id = add_update(make_update("during refresh", datetime.datetime.now() + datetime.timedelta(days=1)))
+    refresh_engine.tick()
+    assert update_id in [item["id"] for item in get_snapshot()["updates"]]
+    assert finished == []  # Published while the refresh was still running
+    release.set()
+    refresh_engine.wait_for_refreshes()
+    cancel_update(update_id)
+    refresh_engine.tick()
+
+
+def test_follower_next_wakeup(monkeypatch):
+    """Checks that a worker which is not the leader ignores its past-due events, rather than waking straight away."""
+    event = covid_scheduler.enterabs(0, 1, lambda: None)
+    monkeypatch.setattr(shared_state, "backend", object())
+    monkeypatch.setattr(shared_state, "_leader", True)
+    assert refresh_engine.next_wakeup() == 0
+    monkeypatch.setattr(shared_state, "_leader", False)
+    assert refresh_engine.next_wakeup() == min(refresh_engine.MAX_SLEEP, shared_state.SYNC_INTERVAL)
+    covid_scheduler.cancel(event)
+
+
+def test_request_publish_waits(monkeypatch):
+    """Checks that 'request_publish' waits for the worker to publish a snapshot begun after it was called, and only while the worker is running."""
+    worker = threading.Timer(0.2, publish_snapshot)  # Stands in for the worker, publishing once
+    monkeypatch.setattr(refresh_engine, "_worker", worker)
+    generation = publish_snapshot()["generation"]
+    worker.start()
+    assert refresh_engine.request_publish(5)["generation"] > generation
+    worker.join()
+    assert refresh_engine.request_publish(5) is get_snapshot()  # The worker has finished, so nothing waits
+    refresh_engine._take_publish_request()
+
+
+def test_concurrent_mutations():
+    """Checks that updates added and cancelled from many threads at once all end up in the registry, and in one snapshot."""
+    start = datetime.datetime.now() + datetime.timedelta(days=1)
+
+    def worker(number):
+        kept = add_update(make_update("kept " + str(number), start))
+        cancel_update(add_update(make_update("dropped " + str(number), start)))
+        return kept
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as pool:
+        kept_ids = list(pool.map(worker, range(50)))
+    publish_snapshot()
+    published = [item["id"] for item in get_snapshot()["updates"]]
+    assert set(kept_ids) <= set(published)
+    assert not [item for item in get_snapshot()["updates"] if item["title"].startswith("dropped")]
+    for update_id in kept_ids:
+        cancel_update(update_id)
+
+
+def test_due_update_waits_for_refresh(monkeypatch):
+    """Checks that a due update asks for a forced refresh, and is only completed once that refresh has actually run."""
+    refreshes = []
+    monkeypatch.setitem(refresh_engine.REFRESHES, "covid", (covid_scheduler, lambda revalidate: refreshes.append(revalidate)))
+    monkeypatch.setattr(refresh_engine, "save_if_changed", lambda: None)
+    monkeypatch.setattr(refresh_policy, "should_fetch", lambda upstream, now=None: False)
+    monkeypatch.setattr(refresh_policy, "acquire", lambda upstream, cost=1, now=None: 100)
+    item = make_update("test due", datetime.datetime.now() - datetime.timedelta(seconds=1))
+    item["news"] = False
+    update_id = add_update(item)
+    refresh_engine.tick()
+    refresh_engine.wait_for_refreshes()
+    assert refreshes == []
+    assert get_update(update_id) is not None  # The refresh was put off by the rate limits, so the update is still waiting
+
+    monkeypatch.setattr(refresh_policy, "acquire", lambda upstream, cost=1, now=None: 0)
+    refresh_engine._run_refresh("covid", True)
+    assert refreshes == [True]  # Forced, so neither skipped even though nothing new is expected, nor answered from the cache
+    refresh_engine.tick()
+    assert get_update(update_id) is None
+    for event in list(covid_scheduler.queue):
+        if event.action.__name__ == "_run_refresh":
+            covid_scheduler.cancel(event)
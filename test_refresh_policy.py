@@ -0,0 +1,84 @@
+import pytest
+import copy
+
+import refresh_policy
+from refresh_policy import acquire
+from refresh_policy import record_fetch
+from refresh_policy import publish_time
+from refresh_policy import should_fetch
+from refresh_policy import next_auto_refresh
+from refresh_policy import late_retry
+from refresh_policy import DAY
+
+
+@pytest.fixture(autouse=True)
+def fresh_state():
+    """Gives each test a full token bucket and no learned publish times, and puts the real state back afterwards."""
+    saved = copy.deepcopy(refresh_policy.state)
+    for name, upstream_state in refresh_policy.state.items():
+        upstream_state.update({"tokens": float(refresh_policy.policies[name]["burst"]), "updated": 0, "quota_day": None,
+                               "quota_used": 0, "last_fetch": None, "last_found_new_data": False,
+                               "last_new_data": None})
+        upstream_state["publish_times"].clear()
+    yield
+    refresh_policy.state.clear()
+    refresh_policy.state.update(saved)
+
+
+def test_acquire():
+    """Checks that refreshes are allowed until the token bucket is empty, and then put off until it has refilled."""
+    burst = refresh_policy.policies["covid"]["burst"]
+    start = 100 * DAY
+    for unused in range(burst):
+        assert acquire("covid", 1, start) == 0
+    delay = acquire("covid", 1, start)
+    assert delay == pytest.approx(1 / refresh_policy.policies["covid"]["per_second"])
+    assert acquire("covid", 1, start + delay) == 0
+
+
+def test_daily_quota():
+    """Checks that once the daily quota is used up, refreshes are put off until midnight (UTC)."""
+    quota = refresh_policy.policies["news"]["daily_quota"]
+    refresh_policy.state["news"].update({"quota_day": 100, "quota_used": quota})
+    assert acquire("news", 1, 100 * DAY + 3600) == DAY - 3600
+    assert acquire("news", 1, 101 * DAY) == 0
+
+
+def test_publish_time():
+    """Checks that a regular publish time is learned, and that refreshes are skipped until it comes round again."""
+    for day in range(100, 103):
+        assert publish_time("covid") is None
+        record_fetch("covid", True, day * DAY + 16 * 3600 + day % 2 * 600)
+    assert publish_time("covid") == pytest.approx(16 * 3600 + 200, abs=60)
+    assert not should_fetch("covid", 102 * DAY + 20 * 3600)
+    assert should_fetch("covid", 103 * DAY + 15.5 * 3600)
+    assert next_auto_refresh("covid", 102 * DAY + 20 * 3600) > 103 * DAY + 16 * 3600
+
+
+def test_publish_time_around_midnight():
+    """Checks that publish times either side of midnight are averaged to midnight, and that irregular times are not trusted."""
+    for day, seconds in ((100, DAY - 600), (101, 600), (102, DAY - 300)):
+        record_fetch("covid", True, day * DAY + seconds)
+    assert min(publish_time("covid"), DAY - publish_time("covid")) < 600
+    for day, seconds in ((103, 6 * 3600), (104, 12 * 3600), (105, 18 * 3600)):
+        record_fetch("news", True, day * DAY + seconds)
+    assert publish_time("news") is None
+    assert should_fetch("news", 105 * DAY + 19 * 3600)
+
+
+def test_late_retry():
+    """Checks that a late API is refreshed again every 'settle' seconds for a limited time, and that only those refreshes teach a publish time."""
+    settle = refresh_policy.policies["covid"]["settle"]
+    retries = refresh_policy.policies["covid"]["late_retries"]
+    for day in range(100, 103):
+        record_fetch("covid", True, day * DAY + 16 * 3600)
+    record_fetch("covid", False, 103 * DAY + 16 * 3600 + settle)
+    assert 103 * DAY + 16 * 3600 + 2 * settle <= late_retry("covid", 103 * DAY + 16 * 3600 + settle) <= 103 * DAY + 16 * 3600 + 2 * settle + 30
+    assert late_retry("covid", 103 * DAY + 16 * 3600 + settle * (retries + 1)) is None
+
+    record_fetch("covid", True, 103 * DAY + 20 * 3600)  # Long after the last refresh, such as one the user asked for
+    assert len(refresh_policy.state["covid"]["publish_times"]) == 3
+    assert late_retry("covid", 103 * DAY + 20 * 3600 + 60) is None
+    record_fetch("covid", False, 104 * DAY + 17 * 3600)
+    record_fetch("covid", True, 104 * DAY + 17 * 3600 + settle)  # A retry, soon after a refresh which found nothing
+    assert len(refresh_policy.state["covid"]["publish_times"]) == 4
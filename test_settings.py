@@ -0,0 +1,18 @@
+import pytest
+import json
+
+import settings
+from settings import load_config
+
+
+def test_load_config(tmp_path):
+    """Checks that a configuration file is parsed, and that the shared configuration is the one every module uses."""
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps({"local_location": "Devon", "areas": []}))
+    assert load_config(str(config_path)) == {"local_location": "Devon", "areas": []}
+    import covid_data_handler
+    import covid_news_handling
+    import api_client
+    assert covid_data_handler.config_data is settings.config_data
+    assert covid_news_handling.config_data is settings.config_data
+    assert api_client.config_data is settings.config_data
@@ -0,0 +1,98 @@
+import pytest
+import json
+import time
+import datetime
+
+import shared_state
+import refresh_engine
+from shared_state import SQLiteBackend
+from shared_state import RedisBackend
+from shared_state import sync
+from snapshot_store import encode_value
+from page_cache import make_etag
+from update_registry import get_update
+from update_registry import cancel_update
+from covid_news_handling import update_news_store
+from covid_news_handling import get_articles
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def connect_backend(request, tmp_path):
+    """Returns a function which opens a new connection to one shared store, once for each backend.
+    Redis is stood in for by 'fakeredis', which runs the backend's Lua scripts as Redis would."""
+    if request.param == "sqlite":
+        return lambda: SQLiteBackend(str(tmp_path / "shared.db"))
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    return lambda: RedisBackend(client=fakeredis.FakeRedis(server=server))
+
+
+def test_backend_ops(connect_backend):
+    """Checks that operations are read back in order after a given sequence number, and can be trimmed."""
+    backend = connect_backend()
+    seqs = [backend.append_op("op " + str(number)) for number in range(5)]
+    assert seqs == sorted(seqs)
+    assert backend.ops_after(seqs[2]) == [(seqs[3], "op 3"), (seqs[4], "op 4")]
+    backend.trim_ops(seqs[4])
+    assert backend.ops_after(0) == [(seqs[4], "op 4")]
+
+
+def test_backend_data(connect_backend):
+    """Checks that each publication of data is numbered in the operation log, and that another connection can read it."""
+    backend = connect_backend()
+    assert backend.get_data() is None
+    assert backend.data_version() == 0
+    first_seq = backend.append_op("op")
+    assert backend.put_data(b"first", first_seq, "publish 1") == first_seq + 1
+    assert backend.put_data(b"second", first_seq, "publish 2") == first_seq + 2
+    assert connect_backend().get_data() == (first_seq + 2, first_seq, b"second")
+    assert connect_backend().data_version() == first_seq + 2
+    assert backend.ops_after(first_seq) == [(first_seq + 1, "publish 1"), (first_seq + 2, "publish 2")]
+
+
+def test_backend_lease(connect_backend):
+    """Checks that only one worker holds the lease at a time, and that another can take it once it expires or is released."""
+    backend = connect_backend()
+    assert backend.acquire_lease("leader", "worker 1", 60)
+    assert backend.acquire_lease("leader", "worker 1", 60)
+    assert not backend.acquire_lease("leader", "worker 2", 60)
+    backend.release_lease("leader", "worker 2")
+    assert not backend.acquire_lease("leader", "worker 2", 60)
+    backend.release_lease("leader", "worker 1")
+    assert backend.acquire_lease("leader", "worker 2", 0.05)
+    time.sleep(0.1)
+    assert backend.acquire_lease("leader", "worker 1", 60)
+
+
+def test_sync_applies_other_workers_ops(connect_backend, monkeypatch):
+    """Checks that updates and dismissed articles recorded by another worker are applied, and this worker's own are skipped."""
+    backend = connect_backend()
+    monkeypatch.setattr(shared_state, "backend", backend)
+    monkeypatch.setattr(shared_state, "_ops_seq", 0)
+    update_time = datetime.datetime.now() + datetime.timedelta(days=1)
+    item = {"id": "shared-update", "title": "Shared update", "content": "", "time": update_time, "covid-data": True, "news": False, "repeat": False}
+    update_news_store([{"title": "Shared story", "content": "", "url": "https://example.com/shared"}])
+    backend.append_op(json.dumps({"kind": "add_update", "item": item, "worker": "other"}, default=encode_value))
+    backend.append_op(json.dumps({"kind": "dismiss_article", "title": "Shared story", "worker": "other"}))
+    backend.append_op(json.dumps({"kind": "cancel_update", "id": "shared-update", "worker": shared_state.WORKER_ID}))
+
+    assert sync()
+    assert get_update("shared-update")["time"] == update_time
+    assert "Shared story" not in [article.title for article in get_articles()]
+    assert not sync()
+    cancel_update("shared-update")
+
+
+def test_publish_data_numbers_snapshots(connect_backend, monkeypatch):
+    """Checks that published data is numbered in the operation log, and that the leader's next snapshot takes its generation from it."""
+    backend = connect_backend()
+    monkeypatch.setattr(shared_state, "backend", backend)
+    monkeypatch.setattr(shared_state, "_ops_seq", 0)
+    monkeypatch.setattr(shared_state, "_leader", True)
+    monkeypatch.setattr(refresh_engine, "generation", 0)
+    monkeypatch.setattr(refresh_engine, "snapshot", dict(refresh_engine.snapshot, generation=0))
+    backend.append_op(json.dumps({"kind": "cancel_update", "id": "no such update", "worker": "other"}))
+    shared_state.publish_data()
+    assert shared_state.sequence() == backend.data_version() == 2
+    assert refresh_engine.publish_snapshot()["generation"] == 2 << refresh_engine.SEQUENCE_SHIFT
+    assert make_etag("index", 2 << refresh_engine.SEQUENCE_SHIFT) == "index-" + str(2 << refresh_engine.SEQUENCE_SHIFT)
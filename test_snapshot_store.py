@@ -0,0 +1,64 @@
+import pytest
+import datetime
+
+from snapshot_store import save_snapshot
+from snapshot_store import load_snapshot
+from snapshot_store import export_state
+from snapshot_store import import_state
+from covid_timeseries import merge_records
+from covid_timeseries import get_stats
+from covid_timeseries import series_store
+from covid_news_handling import update_news_store
+from covid_news_handling import remove_article
+from covid_news_handling import get_articles
+from covid_news_handling import news_articles
+from covid_news_handling import dismissed_titles
+from update_registry import add_update
+from update_registry import cancel_update
+from update_registry import get_update
+
+
+def test_load_snapshot_missing(tmp_path):
+    """Checks that loading a snapshot file which does not exist reports that nothing was loaded, without creating the file."""
+    path = tmp_path / "missing.db"
+    assert not load_snapshot(str(path))
+    assert not path.exists()
+
+
+def test_save_and_load_snapshot(tmp_path):
+    """Checks that the time series, news store and scheduled updates all survive being saved and loaded again."""
+    path = str(tmp_path / "snapshot.db")
+    merge_records("ltla", "Snapshot Town", [{"date": "2021-10-" + str(day).zfill(2), "newCasesBySpecimenDate": day, "hospitalCases": 5} for day in range(1, 11)])
+    update_news_store([{"title": "Saved story", "content": "", "url": "https://example.com/saved"}])
+    remove_article("Dismissed before saving")
+    update_time = datetime.datetime.now() + datetime.timedelta(days=1)
+    update_id = add_update({"title": "Saved update", "content": "", "time": update_time, "covid-data": True, "news": False, "repeat": True})
+    stats = dict(get_stats("ltla", "Snapshot Town"))
+    save_snapshot(path)
+
+    del series_store[("ltla", "Snapshot Town")]
+    news_articles.pop("Saved story")
+    dismissed_titles.pop("Dismissed before saving")
+    cancel_update(update_id)
+    assert load_snapshot(path)
+
+    assert get_stats("ltla", "Snapshot Town") == stats
+    assert "Saved story" in [article.title for article in get_articles()]
+    assert "Dismissed before saving" in dismissed_titles
+    assert get_update(update_id)["time"] == update_time
+    cancel_update(update_id)
+
+
+def test_export_and_import_state():
+    """Checks that the time series survive being packed into a blob and restored, without the scheduled updates if they are left out."""
+    merge_records("ltla", "Blob Town", [{"date": "2021-11-" + str(day).zfill(2), "newCasesBySpecimenDate": day * 2} for day in range(1, 15)])
+    update_id = add_update({"title": "Blob update", "content": "", "time": datetime.datetime.now() + datetime.timedelta(days=1), "covid-data": True, "news": False, "repeat": False})
+    stats = dict(get_stats("ltla", "Blob Town"))
+    blob = export_state()
+
+    del series_store[("ltla", "Blob Town")]
+    cancel_update(update_id)
+    import_state(blob, include_updates=False)
+
+    assert get_stats("ltla", "Blob Town") == stats
+    assert get_update(update_id) is None
@@ -0,0 +1,27 @@
+import pytest
+import sys
+
+import startup_profile
+from startup_profile import step
+from startup_profile import report
+
+
+def test_import_times():
+    """Checks that modules imported while profiling is on are timed, and that profiling can be turned off again."""
+    sys.modules.pop("colorsys", None)
+    startup_profile.install()
+    try:
+        import colorsys
+    finally:
+        startup_profile.uninstall()
+    total, own = startup_profile.import_times["colorsys"]
+    assert total >= own >= 0
+    assert "colorsys" in report()
+
+
+def test_step():
+    """Checks that each initialisation step is timed and reported."""
+    with step("test step"):
+        pass
+    assert startup_profile.step_times[-1][0] == "test step"
+    assert "test step" in report()
@@ -0,0 +1,50 @@
+import pytest
+import datetime
+import time
+
+from update_registry import add_update
+from update_registry import cancel_update
+from update_registry import reschedule_update
+from update_registry import pop_due
+from update_registry import next_due_time
+from update_registry import list_updates
+
+
+def make_update(title, time):
+    """Builds an update in the same format as the Flask app."""
+    return {"title": title, "content": "", "time": time, "covid-data": True, "news": False, "repeat": False}
+
+
+def test_pop_due():
+    """Checks that due updates come off the heap earliest first, and later updates stay queued."""
+    now = datetime.datetime.now()
+    later_id = add_update(make_update("later", now - datetime.timedelta(minutes=1)))
+    earlier_id = add_update(make_update("earlier", now - datetime.timedelta(minutes=2)))
+    future_id = add_update(make_update("future", now + datetime.timedelta(days=1)))
+    assert [item["id"] for item in pop_due(time.time())] == [earlier_id, later_id]
+    assert pop_due(time.time()) == []
+    for update_id in (earlier_id, later_id, future_id):
+        cancel_update(update_id)
+
+
+def test_add_update_idempotent():
+    """Checks that adding the same update twice only queues it once."""
+    item = make_update("twice", datetime.datetime.now() - datetime.timedelta(minutes=1))
+    update_id = add_update(item)
+    add_update(item)
+    assert [entry["title"] for entry in list_updates()].count("twice") == 1
+    assert len(pop_due(time.time())) == 1
+    cancel_update(update_id)
+
+
+def test_cancel_and_reschedule():
+    """Checks that a cancelled update is never returned as due, and that rescheduling moves an update."""
+    now = datetime.datetime.now()
+    cancelled_id = add_update(make_update("cancelled", now - datetime.timedelta(minutes=1)))
+    moved_id = add_update(make_update("moved", now - datetime.timedelta(minutes=1)))
+    assert cancel_update(cancelled_id)["title"] == "cancelled"
+    assert reschedule_update(moved_id, now + datetime.timedelta(hours=1))
+    assert pop_due(time.time()) == []
+    assert next_due_time() == (now + datetime.timedelta(hours=1)).timestamp()
+    cancel_update(moved_id)
+    assert next_due_time() is None
@@ -0,0 +1,148 @@
+"""
+update_registry - This module is the scheduled update registry module.
+This module is responsible for keeping track of all updates the user has scheduled.
+This includes...
+    - Storing each update under a stable ID, so that it can be found or cancelled in O(1).
+    - Keeping a time-ordered heap of the updates, so that the next due update is found in O(log n).
+    - Making sure each update is queued exactly once, however often it is rescheduled.
+"""
+import heapq
+import itertools
+import threading
+import uuid
+
+
+updates = {}  # Maps update ID -> update, in the order the updates were added
+_heap = []  # Entries are (due timestamp, version, update ID); entries with an old version are stale
+_versions = itertools.count()
+_stale = 0  # The number of stale entries in the heap, so that it can be compacted
+registry_lock = threading.Lock()
+
+
+def _push(item: dict) -> None:
+    """Pushes an update onto the heap under a new version, making any older entry for it stale."""
+    global _stale
+    if item.get("version") is not None:
+        _stale += 1
+    item["version"] = next(_versions)
+    heapq.heappush(_heap, (item["time"].timestamp(), item["version"], item["id"]))
+
+
+def _compact() -> None:
+    """Rebuilds the heap without its stale entries, once they make up more than half of it."""
+    global _heap, _stale
+    if _stale > 32 and _stale > len(_heap) // 2:
+        _heap = [entry for entry in _heap if entry[2] in updates and updates[entry[2]]["version"] == entry[1]]
+        heapq.heapify(_heap)
+        _stale = 0
+
+
+def _is_live(entry: tuple) -> bool:
+    """Returns whether a heap entry still belongs to a scheduled update."""
+    item = updates.get(entry[2])
+    return item is not None and item["version"] == entry[1]
+
+
+def add_update(item: dict) -> str:
+    """Adds an update to the registry, giving it an ID if it does not have one.
+    Adding an update which is already in the registry only reschedules it, so it is never queued twice.
+    The registry keeps its own copy of the update, so that the caller can never change it without holding the lock.
+
+        Parameters:
+            item (dict): The update, as created by the Flask app.
+
+        Returns:
+            update_id (str): The ID of the update.
+    """
+    with registry_lock:
+        if item.get("id") is None:
+            item["id"] = uuid.uuid4().hex
+        if item["id"] in updates:
+            updates[item["id"]]["time"] = item["time"]
+            _push(updates[item["id"]])
+        else:
+            updates[item["id"]] = dict(item, version=None)
+            _push(updates[item["id"]])
+        return item["id"]
+
+
+def cancel_update(update_id: str) -> dict:
+    """Removes an update from the registry. Its heap entry becomes stale, and is skipped when it is reached.
+
+        Parameters:
+            update_id (str): The ID of the update to be cancelled.
+
+        Returns:
+            item (dict): The cancelled update, or None if there was no update with the given ID.
+    """
+    global _stale
+    with registry_lock:
+        item = updates.pop(update_id, None)
+        if item is not None and item["version"] is not None:
+            _stale += 1
+            _compact()
+        return item
+
+
+def reschedule_update(update_id: str, new_time) -> bool:
+    """Moves an update to a new time.
+
+        Parameters:
+            update_id (str): The ID of the update to be rescheduled.
+            new_time (datetime.datetime): The new time for the update.
+
+        Returns:
+            found (bool): Whether an update with the given ID was found.
+    """
+    with registry_lock:
+        item = updates.get(update_id)
+        if item is None:
+            return False
+        item["time"] = new_time
+        _push(item)
+        _compact()
+        return True
+
+
+def pop_due(now: float) -> list:
+    """Takes every update which is due by the given time off the heap.
+    The updates stay in the registry until they are rescheduled or cancelled.
+
+        Parameters:
+            now (float): The current time, as a timestamp.
+
+        Returns:
+            due (list): The updates which are due, earliest first.
+    """
+    global _stale
+    due = []
+    with registry_lock:
+        while _heap and _heap[0][0] <= now:
+            entry = heapq.heappop(_heap)
+            if _is_live(entry):
+                updates[entry[2]]["version"] = None  # No longer queued, until it is rescheduled
+                due.append(updates[entry[2]])
+            else:
+                _stale = max(_stale - 1, 0)
+    return due
+
+
+def next_due_time() -> float:
+    """Returns the timestamp at which the next update is due, or None if no updates are queued."""
+    global _stale
+    with registry_lock:
+        while _heap and not _is_live(_heap[0]):
+            heapq.heappop(_heap)
+            _stale = max(_stale - 1, 0)
+        return _heap[0][0] if _heap else None
+
+
+def list_updates() -> list:
+    """Returns a copy of every update in the registry, in the order they were added."""
+    with registry_lock:
+        return [dict(item) for item in updates.values()]
+
+
+def get_update(update_id: str) -> dict:
+    """Returns the update with the given ID, or None if there is no such update."""
+    return updates.get(update_id)